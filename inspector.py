@@ -1,42 +1,310 @@
-import tensorflow as tf
+#!/usr/bin/env python3
+"""
+Inspector y perfilador de modelos TFLite.
+
+Sin opciones muestra las entradas y salidas del modelo. Con --profile ejecuta
+bucles cronometrados de invoke() (con calentamiento) para cada valor de
+--threads y emite un JSON con la latencia p50/p90/p99, la memoria (tamaño de
+los tensores del intérprete y RSS del proceso) y, si se indica el binario
+benchmark_model de TensorFlow Lite, el tiempo por tipo de operación. Sirve
+para comparar modelos candidatos antes de llevarlos a la app móvil:
+
+    python inspector.py modelo.tflite
+    python inspector.py modelo.tflite --profile --threads 1 2 4 --images uploads --output perfil.json
+    python inspector.py modelo.tflite --profile --benchmark-model ./benchmark_model
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
 import sys
+import time
 
-if len(sys.argv) < 2:
-    print("Uso: python inspector.py <ruta_al_modelo.tflite>")
-    sys.exit(1)
+import numpy as np
 
-model_path = sys.argv[1]
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+# Normalización de CLIP (la de los modelos exportados con web_app/export_model.py)
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+def load_interpreter(model_path, num_threads=None):
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter(model_path=model_path, num_threads=num_threads)
 
-try:
-    interpreter = tf.lite.Interpreter(model_path=model_path)
-    interpreter.allocate_tensors()
 
+def print_details(interpreter, model_path):
     print(f"\n--- Detalles del Modelo TFLite: {model_path} ---\n")
 
     # Detalles de las entradas
-    input_details = interpreter.get_input_details()
     print("Entradas:")
-    for i, detail in enumerate(input_details):
+    for i, detail in enumerate(interpreter.get_input_details()):
         print(f"  Entrada {i}:")
-        print(f"    Nombre: {detail['name']}")
-        print(f"    Forma (Shape): {detail['shape']}")
-        print(f"    Tipo de Dato (Dtype): {detail['dtype']}")
-        print(f"    Índice de Tensor: {detail['index']}")
-        print(f"    Cuantización: {detail.get('quantization', 'N/A')}")
+        print_tensor(detail)
 
     # Detalles de las salidas
-    output_details = interpreter.get_output_details()
     print("\nSalidas:")
-    for i, detail in enumerate(output_details):
+    for i, detail in enumerate(interpreter.get_output_details()):
         print(f"  Salida {i}:")
-        print(f"    Nombre: {detail['name']}")
-        print(f"    Forma (Shape): {detail['shape']}")
-        print(f"    Tipo de Dato (Dtype): {detail['dtype']}")
-        print(f"    Índice de Tensor: {detail['index']}")
-        print(f"    Cuantización: {detail.get('quantization', 'N/A')}")
+        print_tensor(detail)
 
     print("\n--- Fin de los Detalles ---\n")
 
-except Exception as e:
-    print(f"Error al cargar o inspeccionar el modelo: {e}")
-    sys.exit(1)
+
+def print_tensor(detail):
+    print(f"    Nombre: {detail['name']}")
+    print(f"    Forma (Shape): {detail['shape']}")
+    print(f"    Tipo de Dato (Dtype): {detail['dtype']}")
+    print(f"    Índice de Tensor: {detail['index']}")
+    print(f"    Cuantización: {detail.get('quantization', 'N/A')}")
+
+
+def rss_bytes():
+    """RSS actual del proceso (None si no hay /proc)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss_bytes():
+    """Pico de RSS del proceso (ru_maxrss está en KB en Linux y en bytes en macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform.system() == 'Darwin' else peak * 1024
+
+
+def find_images(directory, limit):
+    """Primeras imágenes (orden alfabético) bajo un directorio, p. ej. uploads/"""
+    paths = []
+    for dirpath, _, filenames in os.walk(directory):
+        paths.extend(os.path.join(dirpath, name) for name in filenames if name.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(paths)[:limit]
+
+
+def image_input(path, detail):
+    """Imagen con resize + recorte central + normalización de CLIP, en la forma y tipo de la entrada"""
+    from PIL import Image
+
+    shape = [int(n) for n in detail['shape']]
+    channels_last = shape[-1] == 3
+    height, width = (shape[1], shape[2]) if channels_last else (shape[2], shape[3])
+
+    image = Image.open(path).convert('RGB')
+    scale = max(width / image.width, height / image.height)
+    image = image.resize((max(width, round(image.width * scale)), max(height, round(image.height * scale))),
+                         Image.BICUBIC)
+    left, top = (image.width - width) // 2, (image.height - height) // 2
+    pixels = np.asarray(image.crop((left, top, left + width, top + height)), dtype=np.float32) / 255.0
+    pixels = (pixels - np.array(CLIP_MEAN, dtype=np.float32)) / np.array(CLIP_STD, dtype=np.float32)
+    if not channels_last:
+        pixels = pixels.transpose(2, 0, 1)
+    return quantize(np.broadcast_to(pixels, shape), detail)
+
+
+def synthetic_input(rng, detail):
+    """Entrada aleatoria con la forma y tipo de la entrada del modelo"""
+    shape = [int(n) for n in detail['shape']]
+    dtype = np.dtype(detail['dtype'])
+    if np.issubdtype(dtype, np.integer) and not detail.get('quantization', (0, 0))[0]:
+        info = np.iinfo(dtype)
+        return rng.integers(info.min, info.max, size=shape, endpoint=True).astype(dtype)
+    return quantize(rng.standard_normal(shape).astype(np.float32), detail)
+
+
+def quantize(values, detail):
+    """Pasa valores float al tipo de la entrada, aplicando su escala y punto cero si está cuantizada"""
+    dtype = np.dtype(detail['dtype'])
+    scale, zero_point = detail.get('quantization', (0.0, 0))
+    if np.issubdtype(dtype, np.integer) and scale:
+        info = np.iinfo(dtype)
+        return np.clip(np.round(values / scale + zero_point), info.min, info.max).astype(dtype)
+    return np.ascontiguousarray(values, dtype=dtype)
+
+
+def tensor_memory(interpreter):
+    """Bytes de todos los tensores del intérprete (pesos y activaciones del arena)"""
+    total = 0
+    for detail in interpreter.get_tensor_details():
+        total += int(np.prod(detail['shape'])) * np.dtype(detail['dtype']).itemsize
+    return total
+
+
+def op_counts(interpreter):
+    """Número de operaciones por tipo (None si la versión de TFLite no lo expone)"""
+    get_ops = getattr(interpreter, '_get_ops_details', None)
+    if get_ops is None:
+        return None
+    counts = {}
+    for op in get_ops():
+        counts[op['op_name']] = counts.get(op['op_name'], 0) + 1
+    return dict(sorted(counts.items(), key=lambda item: -item[1]))
+
+
+def percentiles(latencies):
+    ms = np.array(latencies) * 1000.0
+    return {
+        "runs": len(latencies),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "min_ms": float(ms.min()),
+        "max_ms": float(ms.max())
+    }
+
+
+def profile_threads(model_path, num_threads, inputs_for, warmup, runs):
+    """Latencia de invoke() y memoria con un número de hilos"""
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    interpreter = load_interpreter(model_path, num_threads)
+    interpreter.allocate_tensors()
+    load_seconds = time.perf_counter() - start
+    rss_allocated = rss_bytes()
+
+    input_details = interpreter.get_input_details()
+    inputs = inputs_for(input_details)
+
+    def invoke(i):
+        for detail, values in zip(input_details, inputs[i % len(inputs)]):
+            interpreter.set_tensor(detail['index'], values)
+        start = time.perf_counter()
+        interpreter.invoke()
+        return time.perf_counter() - start
+
+    for i in range(warmup):
+        invoke(i)
+    latencies = [invoke(i) for i in range(runs)]
+
+    rss_after = rss_bytes()
+    return {
+        "num_threads": num_threads,
+        "load_seconds": load_seconds,
+        "latency": percentiles(latencies),
+        "memory": {
+            "tensor_bytes": tensor_memory(interpreter),
+            "rss_allocate_delta_bytes": rss_allocated - rss_before if rss_before is not None else None,
+            "rss_invoke_delta_bytes": rss_after - rss_allocated if rss_after is not None else None,
+            "peak_rss_bytes": peak_rss_bytes()
+        }
+    }
+
+
+def op_profile(benchmark_model, model_path, num_threads, runs):
+    """
+    Tiempo por tipo de operación con el benchmark_model oficial de TFLite.
+
+    El intérprete de Python no expone el perfilado por operación; el binario
+    sí (--enable_op_profiling). Se analiza su tabla "by node type".
+    """
+    command = [benchmark_model, f"--graph={model_path}", f"--num_threads={num_threads}",
+               f"--num_runs={runs}", "--enable_op_profiling=true"]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    section = output.split("by node type", 1)
+    if len(section) < 2:
+        return None
+    ops = []
+    # [node type] [count] [avg ms] [avg %] [cdf %] [mem KB] [times called]
+    row = re.compile(r"^\s*(\S+)\s+(\d+)\s+([\d.]+)\s+([\d.]+)%\s+([\d.]+)%\s+([\d.]+)\s+(\d+)")
+    for line in section[1].splitlines()[2:]:
+        match = row.match(line)
+        if match is None:
+            if ops:
+                break
+            continue
+        name, count, avg_ms, avg_pct, _, mem_kb, _ = match.groups()
+        ops.append({"op": name, "count": int(count), "avg_ms": float(avg_ms),
+                    "percent": float(avg_pct), "mem_kb": float(mem_kb)})
+    return ops
+
+
+def profile(args):
+    interpreter = load_interpreter(args.model)
+    interpreter.allocate_tensors()
+    paths = find_images(args.images, args.num_images) if args.images else []
+    if args.images and not paths:
+        raise RuntimeError(f"No hay imágenes en {args.images}")
+
+    rng = np.random.default_rng(args.seed)
+
+    def inputs_for(details):
+        if paths:
+            return [[image_input(path, detail) for detail in details] for path in paths]
+        return [[synthetic_input(rng, detail) for detail in details] for _ in range(args.num_images)]
+
+    report = {
+        "model": os.path.abspath(args.model),
+        "model_bytes": os.path.getsize(args.model),
+        "inputs": "images" if paths else "synthetic",
+        "num_inputs": len(paths) if paths else args.num_images,
+        "warmup": args.warmup,
+        "runs": args.runs,
+        "input_details": [{"shape": [int(n) for n in d['shape']], "dtype": np.dtype(d['dtype']).name,
+                           "quantization": list(d.get('quantization', ()))}
+                          for d in interpreter.get_input_details()],
+        "op_counts": op_counts(interpreter),
+        "platform": {"machine": platform.machine(), "system": platform.system(), "cpus": os.cpu_count()},
+        "threads": []
+    }
+    del interpreter
+
+    for num_threads in args.threads:
+        result = profile_threads(args.model, num_threads, inputs_for, args.warmup, args.runs)
+        report["threads"].append(result)
+        latency = result["latency"]
+        print(f"{num_threads} hilos: p50 {latency['p50_ms']:.2f} ms, p99 {latency['p99_ms']:.2f} ms, "
+              f"tensores {result['memory']['tensor_bytes'] / 2**20:.1f} MB", file=sys.stderr)
+
+    if args.benchmark_model:
+        report["op_profile"] = op_profile(args.benchmark_model, args.model, args.threads[0], args.runs)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspector y perfilador de modelos TFLite")
+    parser.add_argument("model", help="Ruta al modelo .tflite")
+    parser.add_argument("--profile", action="store_true", help="Medir latencia y memoria de invoke()")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4], help="Valores de num_threads")
+    parser.add_argument("--warmup", type=int, default=10, help="Invocaciones de calentamiento")
+    parser.add_argument("--runs", type=int, default=100, help="Invocaciones cronometradas")
+    parser.add_argument("--images", default=None, help="Directorio de imágenes reales (p. ej. uploads)")
+    parser.add_argument("--num-images", type=int, default=16, help="Entradas distintas que se alternan")
+    parser.add_argument("--seed", type=int, default=0, help="Semilla de las entradas sintéticas")
+    parser.add_argument("--benchmark-model", default=None,
+                        help="Binario benchmark_model de TFLite para el tiempo por operación")
+    parser.add_argument("--output", default=None, help="Guardar el JSON en un archivo (por defecto stdout)")
+    args = parser.parse_args()
+
+    try:
+        if not args.profile:
+            interpreter = load_interpreter(args.model)
+            interpreter.allocate_tensors()
+            print_details(interpreter, args.model)
+            return 0
+        report = profile(args)
+    except Exception as e:
+        print(f"Error al cargar o inspeccionar el modelo: {e}")
+        return 1
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+        print(f"Perfil guardado en: {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
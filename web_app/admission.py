@@ -0,0 +1,134 @@
+"""
+Control de admisión a la inferencia con prioridades.
+
+Todas las peticiones acaban en el mismo modelo. Sin límite, una ráfaga de
+frames de la cámara (que se pueden descartar: el siguiente llega enseguida)
+retrasa las llamadas a /predict cuyo resultado espera un operario. El
+controlador limita las inferencias en curso y las admite por prioridad:
+
+- predict: espera un hueco como mucho su presupuesto de latencia; si se
+  agota, se rechaza con un tiempo de reintento.
+- batch (/predict_batch, /predict_video y las funciones de app.py que usan
+  los scripts): espera sin límite, pero cede el turno a predict.
+- realtime: nunca espera. Si no hay hueco libre fuera de los reservados para
+  predict, o hay peticiones esperando, el frame se descarta al momento.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from observability import ADMISSION_SHED, ADMISSION_WAIT
+
+PRIORITIES = ("predict", "batch", "realtime")
+
+
+class Overloaded(Exception):
+    """No hay capacidad para atender la petición; reintentar tras retry_after segundos"""
+
+    def __init__(self, priority, retry_after):
+        super().__init__(f"Servidor ocupado ({priority}), reintentar en {retry_after:g}s")
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Semáforo de inferencias en curso con prioridades y descarte"""
+
+    def __init__(self, max_concurrent=4, reserved=1, predict_budget=2.0, retry_after=1.0):
+        """
+        Args:
+            max_concurrent: Máximo de inferencias en curso (0 desactiva el control)
+            reserved: Huecos que realtime no puede ocupar, reservados para predict y batch
+            predict_budget: Segundos que predict espera un hueco antes de rechazarse
+            retry_after: Segundos de reintento que se sugieren al descartar
+        """
+        self.max_concurrent = max_concurrent
+        self.reserved = min(reserved, max(max_concurrent - 1, 0))
+        self.predict_budget = predict_budget
+        self.retry_after = retry_after
+
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = {name: 0 for name in PRIORITIES}
+        self._counters = {name: {"admitted": 0, "shed": 0, "wait_seconds": 0.0} for name in PRIORITIES}
+
+    @property
+    def enabled(self):
+        return self.max_concurrent > 0
+
+    @contextmanager
+    def admit(self, priority):
+        """
+        Ocupa un hueco durante el bloque.
+
+        Raises:
+            Overloaded: si la petición se descarta o agota su presupuesto
+        """
+        if not self.enabled:
+            yield
+            return
+        self._acquire(priority)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def _acquire(self, priority):
+        start = time.perf_counter()
+        with self._cond:
+            if priority == "realtime":
+                if self._in_flight < self.max_concurrent - self.reserved and not any(self._waiting.values()):
+                    self._admit(priority, 0.0)
+                    return
+                self._shed(priority)
+
+            deadline = start + self.predict_budget if priority == "predict" else None
+            self._waiting[priority] += 1
+            try:
+                while not self._can_admit(priority):
+                    remaining = None if deadline is None else deadline - time.perf_counter()
+                    if remaining is not None and remaining <= 0:
+                        self._shed(priority, time.perf_counter() - start)
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting[priority] -= 1
+            self._admit(priority, time.perf_counter() - start)
+
+    def _can_admit(self, priority):
+        if self._in_flight >= self.max_concurrent:
+            return False
+        return priority == "predict" or not self._waiting["predict"]
+
+    def _admit(self, priority, waited):
+        self._in_flight += 1
+        counters = self._counters[priority]
+        counters["admitted"] += 1
+        counters["wait_seconds"] += waited
+        ADMISSION_WAIT.observe(waited, priority=priority)
+
+    def _shed(self, priority, waited=0.0):
+        self._counters[priority]["shed"] += 1
+        ADMISSION_SHED.inc(priority=priority)
+        if waited:
+            ADMISSION_WAIT.observe(waited, priority=priority)
+        raise Overloaded(priority, self.retry_after)
+
+    def stats(self):
+        with self._cond:
+            priorities = {}
+            for name, counters in self._counters.items():
+                priorities[name] = dict(counters, waiting=self._waiting[name])
+                admitted = counters["admitted"]
+                priorities[name]["mean_wait_ms"] = (
+                    1000 * counters["wait_seconds"] / admitted if admitted else 0.0
+                )
+            return {
+                "enabled": self.enabled,
+                "max_concurrent": self.max_concurrent,
+                "reserved": self.reserved,
+                "in_flight": self._in_flight,
+                "priorities": priorities
+            }
@@ -1,26 +1,199 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, g, request, jsonify, render_template
 from flask_cors import CORS
 import torch
 import clip
 import numpy as np
-from PIL import Image
-import io
 import os
-from datetime import datetime
+import atexit
+import hashlib
+import json
+import logging
+import shutil
+import tempfile
+import time
+import uuid
+import zipfile
 from werkzeug.utils import secure_filename
+from PIL import Image
+
+from admission import AdmissionController, Overloaded
+from backends import OptimizedTorchBackend, create_backend
+from batcher import MicroBatcher
+from cascade import Cascade, FishGate
+from embedding_store import EmbeddingStore
+from fast_preprocess import FastPreprocessor
+from model_artifact import image_only_path, load_artifact, save_artifact
+from parity import compare_encoders, list_images
+from observability import (
+    HTTP_ERRORS, HTTP_LATENCY, HTTP_REQUESTS, MODEL_INFO, configure_logging, log_event, render as render_metrics,
+    rss_bytes
+)
+from pipeline import FishPipeline, RawFrameSizeError
+from prompt_cache import drop_text_tower, has_text_tower, load_text_embeddings, prompt_key
+from realtime import RealtimeStats, serve_session
+from result_cache import ResultCache, result_version
+from tracking import SessionTracker
+from upload_store import IMAGE_EXTENSIONS, UploadStore
+from upload_writer import BackgroundWriter
+from video import VIDEO_SUPPORTED, aggregate, sample_frames
+
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
 
 app = Flask(__name__)
 CORS(app)
 
+# WebSocket para el modo en tiempo real (opcional: requiere flask-sock)
+sock = Sock(app) if Sock is not None else None
+realtime_stats = RealtimeStats()
+
+# Fracción de peticiones que se registran en el log (JSON por línea; 0 lo desactiva).
+# Los errores se registran siempre.
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '0.1'))
+configure_logging(LOG_SAMPLE_RATE)
+
 # Carpeta para guardar las imágenes subidas
 UPLOAD_FOLDER = 'uploads'
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+# Escritura de las imágenes subidas en segundo plano
+# UPLOAD_WRITE_POLICY: 'block' (esperar si la cola está llena) o 'drop' (no guardar)
+UPLOAD_WRITE_WORKERS = int(os.environ.get('UPLOAD_WRITE_WORKERS', '2'))
+UPLOAD_WRITE_MAX_PENDING = int(os.environ.get('UPLOAD_WRITE_MAX_PENDING', '64'))
+UPLOAD_WRITE_POLICY = os.environ.get('UPLOAD_WRITE_POLICY', 'block')
+UPLOAD_FSYNC = os.environ.get('UPLOAD_FSYNC', '0') == '1'
+
+upload_writer = BackgroundWriter(UPLOAD_WRITE_WORKERS, UPLOAD_WRITE_MAX_PENDING, UPLOAD_WRITE_POLICY, UPLOAD_FSYNC)
+# Terminar las escrituras pendientes al salir
+atexit.register(upload_writer.flush)
+
+# Almacén por hash de contenido con retención (0 = sin límite), ver upload_store.py
+UPLOAD_MAX_AGE_DAYS = float(os.environ.get('UPLOAD_MAX_AGE_DAYS', '0'))
+UPLOAD_MAX_MB = float(os.environ.get('UPLOAD_MAX_MB', '0'))
+UPLOAD_EVICT_INTERVAL = float(os.environ.get('UPLOAD_EVICT_INTERVAL', '300'))
+
+upload_store = UploadStore(
+    UPLOAD_FOLDER, upload_writer, UPLOAD_MAX_AGE_DAYS, int(UPLOAD_MAX_MB * 1024 * 1024), UPLOAD_EVICT_INTERVAL
+)
+
+# Carpeta para la caché de embeddings de texto
+CACHE_FOLDER = os.environ.get('CACHE_FOLDER', 'cache')
+
+# Almacén de embeddings de las imágenes subidas (EMBEDDING_STORE=0 lo desactiva)
+EMBEDDING_STORE_ENABLED = os.environ.get('EMBEDDING_STORE', '1') == '1'
+EMBEDDING_STORE_FOLDER = os.environ.get('EMBEDDING_STORE_FOLDER', os.path.join(CACHE_FOLDER, 'image-embeddings'))
+
+# Seguimiento temporal de sesiones en tiempo real (TRACKING=0 lo desactiva)
+TRACKING_ENABLED = os.environ.get('TRACKING', '1') == '1'
+TRACKING_REUSE_THRESHOLD = float(os.environ.get('TRACKING_REUSE_THRESHOLD', '0.03'))
+TRACKING_RESET_THRESHOLD = float(os.environ.get('TRACKING_RESET_THRESHOLD', '0.15'))
+TRACKING_EMA_ALPHA = float(os.environ.get('TRACKING_EMA_ALPHA', '0.5'))
+TRACKING_MAX_REUSE = int(os.environ.get('TRACKING_MAX_REUSE', '10'))
+
+# Cascada de tiempo real (ver cascade.py): un primer nivel a CASCADE_RESOLUTION
+# píxeles descarta los frames con probabilidad de pez < CASCADE_THRESHOLD antes
+# del forward completo (CASCADE=1 la activa; calibrar con cascade.py --check)
+CASCADE_ENABLED = os.environ.get('CASCADE', '0') == '1'
+CASCADE_RESOLUTION = int(os.environ.get('CASCADE_RESOLUTION', '96'))
+CASCADE_THRESHOLD = float(os.environ.get('CASCADE_THRESHOLD', '0.1'))
+
+# Control de admisión a la inferencia (ver admission.py; ADMISSION_MAX_CONCURRENT=0
+# lo desactiva): máximo de inferencias en curso, huecos que los frames de tiempo
+# real no pueden ocupar, presupuesto de espera de /predict y reintento sugerido
+ADMISSION_MAX_CONCURRENT = int(os.environ.get('ADMISSION_MAX_CONCURRENT', '4'))
+ADMISSION_RESERVED = int(os.environ.get('ADMISSION_RESERVED', '1'))
+ADMISSION_PREDICT_BUDGET = float(os.environ.get('ADMISSION_PREDICT_BUDGET', '2'))
+ADMISSION_RETRY_AFTER = float(os.environ.get('ADMISSION_RETRY_AFTER', '1'))
+
+# Micro-batching de codificación de imágenes (BATCH_MAX_SIZE=1 lo desactiva).
+# Con control de admisión nunca hay más de ADMISSION_MAX_CONCURRENT imágenes en
+# la cola del batcher: un batch mayor no se llenaría nunca y cada forward
+# esperaría BATCH_MAX_WAIT_MS completo, así que el tamaño se limita a ese valor
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', ADMISSION_MAX_CONCURRENT or 8))
+if ADMISSION_MAX_CONCURRENT > 0:
+    BATCH_MAX_SIZE = min(BATCH_MAX_SIZE, ADMISSION_MAX_CONCURRENT)
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', '10'))
+
+# Caché en memoria de predicciones por hash de contenido (RESULT_CACHE_SIZE=0 la desactiva)
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', '1024'))
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', '3600'))
+
+# Tamaño de batch de /predict_batch
+PREDICT_BATCH_SIZE = int(os.environ.get('PREDICT_BATCH_SIZE', '16'))
+
+# Límites de las subidas: tamaño de la petición y, en los .zip de /predict_batch,
+# número de imágenes y tamaño descomprimido de cada una y del total de la petición
+MAX_UPLOAD_MB = float(os.environ.get('MAX_UPLOAD_MB', '256'))
+BATCH_ZIP_MAX_MEMBERS = int(os.environ.get('BATCH_ZIP_MAX_MEMBERS', '1000'))
+BATCH_ZIP_MAX_MEMBER_MB = float(os.environ.get('BATCH_ZIP_MAX_MEMBER_MB', '32'))
+BATCH_ZIP_MAX_TOTAL_MB = float(os.environ.get('BATCH_ZIP_MAX_TOTAL_MB', '1024'))
+app.config['MAX_CONTENT_LENGTH'] = int(MAX_UPLOAD_MB * 2**20)
+
+# Muestreo de /predict_video: frames por segundo de vídeo, distancia de firma
+# para el muestreo por cambio de escena y máximo de frames por clip
+VIDEO_SAMPLE_FPS = float(os.environ.get('VIDEO_SAMPLE_FPS', '2'))
+VIDEO_SCENE_THRESHOLD = float(os.environ.get('VIDEO_SCENE_THRESHOLD', '0.08'))
+VIDEO_MAX_FRAMES = int(os.environ.get('VIDEO_MAX_FRAMES', '120'))
+
+# Decodificación JPEG reducida y preprocesado vectorizado (ver fast_preprocess.py)
+FAST_PREPROCESS = os.environ.get('FAST_PREPROCESS', '0') == '1'
+
+# Backend del codificador de imagen: 'torch', 'onnx' o 'tflite' (ver export_model.py)
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'torch')
+BACKEND_MODEL_PATH = os.environ.get('BACKEND_MODEL_PATH')
+INFERENCE_THREADS = int(os.environ.get('INFERENCE_THREADS', '0')) or None
+
+# Optimizaciones de CPU del backend torch (ver backends.OptimizedTorchBackend):
+# TORCH_QUANTIZE=int8 (cuantización dinámica), TORCH_COMPILE=1, TORCH_BF16=1.
+# Sólo se aplican si las decisiones sobre OPTIMIZE_GATE_IMAGES imágenes de
+# referencia coinciden con las del modelo fp32 en al menos OPTIMIZE_MIN_AGREEMENT.
+TORCH_QUANTIZE = os.environ.get('TORCH_QUANTIZE', '')
+TORCH_COMPILE = os.environ.get('TORCH_COMPILE', '0') == '1'
+TORCH_BF16 = os.environ.get('TORCH_BF16', '0') == '1'
+OPTIMIZE_GATE_FOLDER = os.environ.get('OPTIMIZE_GATE_FOLDER', UPLOAD_FOLDER)
+OPTIMIZE_GATE_IMAGES = int(os.environ.get('OPTIMIZE_GATE_IMAGES', '64'))
+OPTIMIZE_MIN_AGREEMENT = float(os.environ.get('OPTIMIZE_MIN_AGREEMENT', '0.98'))
+
+# Modelo ya construido y serializado (ver model_artifact.py); si no existe se
+# carga con clip.load y se guarda en esa ruta para el siguiente arranque
+MODEL_ARTIFACT = os.environ.get('MODEL_ARTIFACT')
+# Modo sólo imagen: liberar la torre de texto de CLIP tras calcular los
+# embeddings de los prompts (IMAGE_ONLY=1 lo activa)
+IMAGE_ONLY = os.environ.get('IMAGE_ONLY', '0') == '1'
+# Forward de calentamiento al arrancar (WARMUP=0 lo desactiva)
+WARMUP = os.environ.get('WARMUP', '1') == '1'
+
 # Configuración de CLIP
+MODEL_NAME = 'ViT-B/32'
 device = "cuda" if torch.cuda.is_available() else "cpu"
 model = None
 preprocess = None
+# Embeddings normalizados de cada conjunto de prompts (ver PROMPT_SETS)
+text_embeddings = None
+pipeline = None
+# Cascada de tiempo real (None si está desactivada)
+cascade = None
+# Nombre del backend de inferencia realmente en uso
+backend_name = None
+# Listo para recibir tráfico: modelo cargado y calentado (ver /readyz)
+ready = False
+# Tiempos de arranque en segundos
+startup_times = {}
+# Resultado de la comprobación de exactitud de las optimizaciones de torch
+optimization_report = None
+# Memoria liberada al descartar la torre de texto (modo sólo imagen)
+image_only_report = None
+embedding_store = None
+result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+admission = AdmissionController(
+    ADMISSION_MAX_CONCURRENT, ADMISSION_RESERVED, ADMISSION_PREDICT_BUDGET, ADMISSION_RETRY_AFTER
+)
+tracker = SessionTracker(
+    TRACKING_REUSE_THRESHOLD, TRACKING_RESET_THRESHOLD, TRACKING_EMA_ALPHA, TRACKING_MAX_REUSE
+) if TRACKING_ENABLED else None
 
 # Definición de clases de texto para cada especie
 # DORADA (Sparus aurata / S_AURATA)
@@ -47,6 +220,27 @@ SPECIES_LABELS = [
     "a photo of a sea bass fish with elongated streamlined body, dark silver grey color, straight head profile, prominent jaw, dicentrarchus labrax lubina"
 ]
 
+# Múltiples prompts por especie para mejor detección (ensemble)
+DORADA_PROMPTS = [
+    "a photo of a dorada fish with oval rounded body, silver grey color with golden spots near eyes, steep forehead profile, sparus aurata gilthead seabream",
+    "a gilthead sea bream fish with rounded oval shape and golden markings",
+    "sparus aurata dorada with compact oval body shape"
+]
+
+LUBINA_PROMPTS = [
+    "a photo of a sea bass fish with elongated streamlined body, dark silver grey color, straight head profile, prominent jaw, dicentrarchus labrax lubina",
+    "a european sea bass with long streamlined body and prominent lower jaw",
+    "dicentrarchus labrax lubina with elongated torpedo-shaped body"
+]
+
+# Conjuntos de prompts cuyos embeddings se precalculan al cargar el modelo
+PROMPT_SETS = {
+    "validation": VALIDATION_LABELS,
+    "species": DORADA_PROMPTS + LUBINA_PROMPTS,
+    "dorada": TEXT_LABELS_DORADA,
+    "lubina": TEXT_LABELS_LUBINA
+}
+
 CLASS_NAMES = {
     0: "Cultivada",
     1: "Salvaje"
@@ -58,117 +252,226 @@ SPECIES_NAMES = {
 }
 
 def load_model():
-    """Carga el modelo CLIP"""
-    global model, preprocess
+    """Carga el modelo CLIP, los embeddings de texto y el pipeline de inferencia"""
+    global model, preprocess, text_embeddings, pipeline, cascade, embedding_store, backend_name, ready
+    global image_only_report
     try:
+        start = time.perf_counter()
         print(f"Cargando modelo CLIP en dispositivo: {device}")
-        model, preprocess = clip.load('ViT-B/32', device)
-        print("Modelo CLIP cargado exitosamente")
+        model = None
+        image_only_artifact = image_only_path(MODEL_ARTIFACT) if IMAGE_ONLY and MODEL_ARTIFACT else None
+        if image_only_artifact and os.path.exists(image_only_artifact):
+            print(f"Usando el artefacto sólo imagen: {image_only_artifact}")
+            model, preprocess = load_artifact(image_only_artifact, device)
+            try:
+                text_embeddings = load_text_embeddings(model, MODEL_NAME, PROMPT_SETS, CACHE_FOLDER, device)
+            except RuntimeError as e:
+                # Sin torre de texto sólo sirven los embeddings de la caché
+                print(f"Aviso: {e}; se carga el modelo completo")
+                model = None
+        if model is None:
+            if MODEL_ARTIFACT and os.path.exists(MODEL_ARTIFACT):
+                print(f"Usando el artefacto del modelo: {MODEL_ARTIFACT}")
+                model, preprocess = load_artifact(MODEL_ARTIFACT, device)
+            else:
+                model, preprocess = clip.load(MODEL_NAME, device)
+                model.eval()
+                if MODEL_ARTIFACT:
+                    save_artifact(model, MODEL_ARTIFACT)
+                    print(f"Artefacto del modelo guardado en {MODEL_ARTIFACT}")
+            text_embeddings = load_text_embeddings(model, MODEL_NAME, PROMPT_SETS, CACHE_FOLDER, device)
+        pipeline_preprocess = FastPreprocessor(model.visual.input_resolution) if FAST_PREPROCESS else preprocess
+        encoder, backend_name = load_backend()
+        pipeline = FishPipeline(model, pipeline_preprocess, device, text_embeddings, len(DORADA_PROMPTS), encoder)
+        result_cache.set_version(prediction_version())
+        if BATCH_MAX_SIZE > 1:
+            pipeline.batcher = MicroBatcher(pipeline.encode, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS)
+        if CASCADE_ENABLED:
+            try:
+                gate = FishGate(model, text_embeddings["validation"], CASCADE_RESOLUTION, CASCADE_THRESHOLD)
+                cascade = Cascade(pipeline, gate)
+                print(f"Cascada de tiempo real: primer nivel a {CASCADE_RESOLUTION}px, umbral {CASCADE_THRESHOLD}")
+            except ValueError as e:
+                print(f"Aviso: no se usa la cascada de tiempo real: {e}")
+        if EMBEDDING_STORE_ENABLED:
+            # Cada backend y cada preprocesado tienen su propio almacén: sus
+            # embeddings no son idénticos
+            store_name = MODEL_NAME.replace('/', '-')
+            if backend_name != 'torch':
+                store_name += f"-{backend_name}"
+            if FAST_PREPROCESS:
+                store_name += "-fast"
+            store_folder = os.path.join(EMBEDDING_STORE_FOLDER, store_name)
+            embedding_store = EmbeddingStore(store_folder, model.visual.output_dim)
+            # Las imágenes que borra la retención dejan de aparecer en /similar
+            upload_store.on_evict = embedding_store.remove
+            print(f"Almacén de embeddings de imagen: {len(embedding_store)} imágenes")
+        if IMAGE_ONLY and not has_text_tower(model):
+            image_only_report = {"artifact": image_only_artifact, "rss_bytes": rss_bytes()}
+            print("Modo sólo imagen: modelo cargado sin torre de texto")
+        elif IMAGE_ONLY:
+            # Todo lo que usa los prompts ya tiene sus embeddings: el texto no vuelve a codificarse
+            image_only_report = drop_text_tower(model)
+            saved = image_only_report["rss_saved_bytes"]
+            print(f"Modo sólo imagen: torre de texto liberada "
+                  f"({image_only_report['parameters_freed_bytes'] / 2**20:.0f} MB de parámetros"
+                  + (f", RSS -{saved / 2**20:.0f} MB)" if saved is not None else ")"))
+            if image_only_artifact:
+                # Los siguientes arranques cargan directamente el artefacto sin torre de texto
+                save_artifact(model, image_only_artifact)
+                print(f"Artefacto sólo imagen guardado en {image_only_artifact}")
+        startup_times["load_seconds"] = time.perf_counter() - start
+        print(f"Modelo CLIP cargado exitosamente en {startup_times['load_seconds']:.1f}s")
     except Exception as e:
         print(f"Error al cargar el modelo CLIP: {e}")
         model = None
+        pipeline = None
+        return
 
-def validate_fish_presence(image_path):
+    # Sin un forward correcto el servidor no se anuncia como listo
+    ready = warmup() if WARMUP else True
+
+def warmup():
     """
-    Valida que haya un pez en la imagen
+    Forward de calentamiento con imágenes vacías.
+
+    La primera inferencia paga la inicialización de los kernels, los pools de
+    hilos y el asignador de memoria; así no la paga la primera petición real.
+    Con gunicorn se repite en cada worker tras el fork.
 
     Returns:
-        tuple: (is_fish_present, confidence)
+        bool: True si el forward terminó sin errores
     """
-    if model is None:
-        raise Exception("Modelo no cargado")
+    if pipeline is None:
+        return False
+    start = time.perf_counter()
+    n_px = model.visual.input_resolution
+    sizes = sorted({1, max(1, BATCH_MAX_SIZE)})
+    try:
+        for size in sizes:
+            image_input = pipeline.preprocess_images([Image.new('RGB', (n_px, n_px))] * size)
+            pipeline.score(pipeline.encode(image_input))
+            if cascade is not None:
+                cascade.gate.fish_confidence(image_input)
+    except Exception as e:
+        print(f"Error: falló el calentamiento del modelo: {e}")
+        return False
+    startup_times["warmup_seconds"] = time.perf_counter() - start
+    print(f"Calentamiento completado en {startup_times['warmup_seconds']:.1f}s (batches de {sizes})")
+    return True
+
+def file_version(path):
+    """Tamaño y fecha de modificación de un archivo (None si no existe)"""
+    if not path or not os.path.exists(path):
+        return None
+    info = os.stat(path)
+    return f"{info.st_size}-{info.st_mtime_ns}"
+
+def prediction_version():
+    """
+    Versión de las predicciones para la caché de resultados.
 
-    # Cargar y preprocesar imagen
-    image = Image.open(image_path).convert('RGB')
-    image_input = preprocess(image).unsqueeze(0).to(device)
+    Cambia si cambian el modelo (o su artefacto), el backend y su modelo
+    exportado, el preprocesado o cualquier prompt.
+    """
+    return result_version(
+        MODEL_NAME, file_version(MODEL_ARTIFACT), backend_name, file_version(BACKEND_MODEL_PATH),
+        FAST_PREPROCESS, prompt_key(MODEL_NAME, PROMPT_SETS)
+    )
 
-    # Tokenizar textos de validación
-    text_tokens = clip.tokenize(VALIDATION_LABELS).to(device)
+def load_backend():
+    """
+    Crea el codificador de imagen configurado en INFERENCE_BACKEND.
 
-    with torch.no_grad():
-        image_features = model.encode_image(image_input)
-        text_features = model.encode_text(text_tokens)
+    Si el modelo exportado no existe o no superó la comprobación de paridad
+    se usa el modelo PyTorch.
 
-        # Normalizar
-        image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-        text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+    Returns:
+        tuple: (encoder, nombre del backend)
+    """
+    if INFERENCE_BACKEND == 'torch':
+        if TORCH_QUANTIZE or TORCH_COMPILE or TORCH_BF16:
+            return load_optimized_torch()
+        return model, 'torch'
+    try:
+        threads = INFERENCE_THREADS or torch.get_num_threads()
+        encoder = create_backend(INFERENCE_BACKEND, model, BACKEND_MODEL_PATH, threads)
+        print(f"Backend de inferencia: {INFERENCE_BACKEND} ({BACKEND_MODEL_PATH})")
+        return encoder, INFERENCE_BACKEND
+    except Exception as e:
+        print(f"Aviso: no se pudo usar el backend {INFERENCE_BACKEND}, se usa torch: {e}")
+        return model, 'torch'
 
-        # Calcular similaridad
-        similarity = (100.0 * image_features @ text_features.T).softmax(dim=-1)
+def load_optimized_torch():
+    """
+    Aplica las optimizaciones de CPU configuradas al codificador de imagen.
 
-    probs = similarity[0].cpu().numpy()
-    fish_confidence = float(probs[0])
+    Antes de usarlo compara sus decisiones (pez, especie, cultivada/salvaje)
+    con las del modelo fp32 sobre las imágenes de referencia; si cambian más
+    de lo tolerado, o no hay imágenes con las que comprobarlo, se usa fp32.
 
-    # Si la confianza de que hay un pez es mayor al 50%, es válido
-    return fish_confidence > 0.5, fish_confidence
+    Returns:
+        tuple: (encoder, nombre del backend)
+    """
+    global optimization_report
+    try:
+        encoder = OptimizedTorchBackend(model, TORCH_QUANTIZE, TORCH_COMPILE, TORCH_BF16)
+        paths = list_images(OPTIMIZE_GATE_FOLDER, OPTIMIZE_GATE_IMAGES)
+        if not paths:
+            raise RuntimeError(f"no hay imágenes de referencia en {OPTIMIZE_GATE_FOLDER}")
+        reference = FishPipeline(model, preprocess, device, text_embeddings, len(DORADA_PROMPTS))
+        start = time.perf_counter()
+        optimization_report = compare_encoders(model, encoder, preprocess, paths, reference.score,
+                                               device, BATCH_MAX_SIZE, OPTIMIZE_MIN_AGREEMENT)
+        optimization_report["backend"] = encoder.name
+        optimization_report["gate_seconds"] = time.perf_counter() - start
+    except Exception as e:
+        print(f"Aviso: no se aplican las optimizaciones de torch, se usa fp32: {e}")
+        optimization_report = {"passed": False, "error": str(e)}
+        return model, 'torch'
+
+    agreement = optimization_report["agreement"]
+    print(f"Comprobación de {encoder.name} sobre {optimization_report['images']} imágenes: "
+          f"coincidencia especie {agreement['species_id']:.1%}, "
+          f"cultivada/salvaje {agreement['predicted_class']:.1%}")
+    if not optimization_report["passed"]:
+        print(f"Aviso: {encoder.name} cambia demasiadas decisiones "
+              f"(< {OPTIMIZE_MIN_AGREEMENT:.0%}), se usa fp32")
+        return model, 'torch'
+    return encoder, encoder.name
 
-def detect_species(image_path):
+def validate_fish_presence(image_path):
     """
-    Detecta automáticamente si es dorada o lubina usando ensemble de prompts
+    Valida que haya un pez en la imagen
 
     Returns:
-        tuple: (species_name, species_id, confidence)
+        tuple: (is_fish_present, confidence)
     """
     if model is None:
         raise Exception("Modelo no cargado")
 
-    # Cargar y preprocesar imagen
-    image = Image.open(image_path).convert('RGB')
-    image_input = preprocess(image).unsqueeze(0).to(device)
-
-    # Múltiples prompts por especie para mejor detección (ensemble)
-    dorada_prompts = [
-        "a photo of a dorada fish with oval rounded body, silver grey color with golden spots near eyes, steep forehead profile, sparus aurata gilthead seabream",
-        "a gilthead sea bream fish with rounded oval shape and golden markings",
-        "sparus aurata dorada with compact oval body shape"
-    ]
-
-    lubina_prompts = [
-        "a photo of a sea bass fish with elongated streamlined body, dark silver grey color, straight head profile, prominent jaw, dicentrarchus labrax lubina",
-        "a european sea bass with long streamlined body and prominent lower jaw",
-        "dicentrarchus labrax lubina with elongated torpedo-shaped body"
-    ]
-
-    # Combinar todos los prompts
-    all_prompts = dorada_prompts + lubina_prompts
-    text_tokens = clip.tokenize(all_prompts).to(device)
-
-    with torch.no_grad():
-        image_features = model.encode_image(image_input)
-        text_features = model.encode_text(text_tokens)
-
-        # Normalizar
-        image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-        text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+    with admission.admit('batch'):
+        scores = pipeline.predict(image_path)
+    return scores["is_fish"], scores["fish_confidence"]
 
-        # Calcular similaridad
-        similarity = (100.0 * image_features @ text_features.T).softmax(dim=-1)
-
-    probs = similarity[0].cpu().numpy()
-
-    # Promediar las probabilidades de cada especie (ensemble)
-    num_dorada_prompts = len(dorada_prompts)
-    num_lubina_prompts = len(lubina_prompts)
-
-    dorada_prob = np.mean(probs[:num_dorada_prompts])
-    lubina_prob = np.mean(probs[num_dorada_prompts:])
+def detect_species(image_path):
+    """
+    Detecta automáticamente si es dorada o lubina usando ensemble de prompts
 
-    # Normalizar probabilidades
-    total = dorada_prob + lubina_prob
-    dorada_prob_norm = dorada_prob / total
-    lubina_prob_norm = lubina_prob / total
+    Returns:
+        tuple: (species_name, species_id, confidence)
+    """
+    if model is None:
+        raise Exception("Modelo no cargado")
 
-    # Seleccionar especie con mayor probabilidad
-    if dorada_prob_norm > lubina_prob_norm:
-        species_id = 0
-        confidence = float(dorada_prob_norm)
-    else:
-        species_id = 1
-        confidence = float(lubina_prob_norm)
+    with admission.admit('batch'):
+        scores = pipeline.predict(image_path)
+    species_id = scores["species_id"]
 
-    print(f"Detección de especie - Dorada: {dorada_prob_norm:.3f}, Lubina: {lubina_prob_norm:.3f}")
+    log_event("detect_species", dorada=scores['species_probabilities']['dorada'],
+              lubina=scores['species_probabilities']['lubina'])
 
-    return SPECIES_NAMES[species_id], species_id, confidence
+    return SPECIES_NAMES[species_id], species_id, scores["species_confidence"]
 
 def classify_fish(image_path, species_id):
     """
@@ -184,30 +487,14 @@ def classify_fish(image_path, species_id):
     if model is None:
         raise Exception("Modelo no cargado")
 
-    # Seleccionar text labels según la especie
-    if species_id == 0:  # Dorada
-        text_labels = TEXT_LABELS_DORADA
-    else:  # Lubina
-        text_labels = TEXT_LABELS_LUBINA
-
-    # Cargar y preprocesar imagen
-    image = Image.open(image_path).convert('RGB')
-    image_input = preprocess(image).unsqueeze(0).to(device)
-
-    # Tokenizar textos
-    text_tokens = clip.tokenize(text_labels).to(device)
+    with admission.admit('batch'):
+        image = pipeline.decode(image_path)
+        image_features = pipeline.encode(pipeline.preprocess_images([image]))
 
-    # Obtener embeddings
+    # Seleccionar el tramo de prompts según la especie indicada
+    stage = "dorada" if species_id == 0 else "lubina"
     with torch.no_grad():
-        image_features = model.encode_image(image_input)
-        text_features = model.encode_text(text_tokens)
-
-        # Normalizar
-        image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-        text_features = text_features / text_features.norm(dim=-1, keepdim=True)
-
-        # Calcular similaridad y aplicar softmax
-        similarity = (100.0 * image_features @ text_features.T).softmax(dim=-1)
+        similarity = (100.0 * image_features @ text_embeddings[stage].T).softmax(dim=-1)
 
     # Obtener predicción
     probs = similarity[0].cpu().numpy()
@@ -224,10 +511,118 @@ def classify_fish(image_path, species_id):
         }
     }
 
+def build_result(scores):
+    """Construye la respuesta JSON de una predicción a partir del pipeline"""
+    species_name = SPECIES_NAMES[scores["species_id"]]
+    class_name = CLASS_NAMES[scores["predicted_class"]]
+
+    result = {
+        "success": True,
+        "is_fish": True,
+        "fish_confidence": scores["fish_confidence"],
+        "species": species_name,
+        "species_id": scores["species_id"],
+        "species_confidence": scores["species_confidence"],
+        "species_probabilities": scores["species_probabilities"],
+        "classification": class_name,
+        "classification_id": scores["predicted_class"],
+        "classification_confidence": scores["confidence"],
+        "probabilities": scores["probabilities"]
+    }
+    result["summary"] = f"{species_name} {class_name}"
+    return result
+
+def build_no_fish_result(scores):
+    """Respuesta de /predict cuando no se detecta un pez"""
+    return {
+        "error": "No se detectó un pez en la imagen",
+        "is_fish": False,
+        "fish_confidence": scores["fish_confidence"],
+        "message": "Por favor, toma una foto donde aparezca claramente un pez"
+    }
+
+def busy_response(error, status):
+    """Respuesta de una petición descartada por el control de admisión, con Retry-After"""
+    response = jsonify(busy_result(error))
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, round(error.retry_after)))
+    return response
+
+def busy_result(error):
+    """Cuerpo JSON de una petición descartada (también se envía por el WebSocket)"""
+    return {
+        "success": False,
+        "busy": True,
+        "retry_after": error.retry_after,
+        "error": "Servidor ocupado, inténtalo de nuevo en unos instantes"
+    }
+
+def content_hash(image_data):
+    """SHA-256 de los bytes de una imagen"""
+    return hashlib.sha256(image_data).hexdigest()
+
+def cached_embedding(image_hash):
+    """Embedding [dim] ya calculado para un hash de contenido, o None"""
+    if embedding_store is None:
+        return None
+    cached = embedding_store.get(image_hash)
+    if cached is None:
+        return None
+    return torch.from_numpy(cached).to(device=device, dtype=model.dtype)
+
+def store_embedding(image_hash, features, filename):
+    """Guarda el embedding [dim] de una imagen subida (o un alias si ya existe)"""
+    if embedding_store is not None and filename is not None:
+        embedding_store.add(image_hash, features.float().cpu().numpy(), filename)
+
+def save_upload(image_data, original_filename, image_hash, scores=None):
+    """
+    Guarda la imagen en el almacén por hash de contenido junto con su predicción.
+
+    Las imágenes repetidas se guardan una sola vez. La escritura la hace
+    upload_writer en segundo plano; la inferencia usa los bytes en memoria.
+
+    Returns:
+        str: Nombre del archivo ('<hash><ext>'), o None si la escritura se descartó
+    """
+    prediction = None
+    if scores is not None:
+        prediction = {"is_fish": int(scores["is_fish"]), "fish_confidence": scores["fish_confidence"]}
+        if scores["is_fish"]:
+            prediction.update(species=SPECIES_NAMES[scores["species_id"]],
+                              classification=CLASS_NAMES[scores["predicted_class"]],
+                              confidence=scores["confidence"])
+
+    filename = upload_store.save(image_hash, image_data, secure_filename(original_filename), prediction)
+    if filename is None:
+        log_event("upload_dropped", level=logging.WARNING, hash=image_hash)
+    return filename
+
 # Cargar el modelo al iniciar la aplicación Flask
 with app.app_context():
     load_model()
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Cuenta la petición y su latencia por endpoint (la regla de la ruta, no la URL)"""
+    start = g.pop('request_start', None)
+    if start is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'desconocido'
+        HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        HTTP_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint)
+        if response.status_code >= 500:
+            HTTP_ERRORS.inc(endpoint=endpoint)
+    return response
+
+@app.errorhandler(413)
+def request_too_large(error):
+    """Petición mayor que MAX_UPLOAD_MB"""
+    return jsonify({"error": f"La petición supera el tamaño máximo de {MAX_UPLOAD_MB:g} MB."}), 413
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -248,71 +643,335 @@ def predict():
         # Leer los datos de la imagen en memoria
         image_data = file.read()
 
-        # Guardar la imagen en el servidor con un nombre único
-        filename = secure_filename(file.filename)
-        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-        unique_filename = f"{timestamp}-{filename}"
-
-        # Asegurarse de que la carpeta de subida exista
-        if not os.path.exists(UPLOAD_FOLDER):
-            os.makedirs(UPLOAD_FOLDER)
-
-        image_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-        with open(image_path, 'wb') as f:
-            f.write(image_data)
-        print(f"Imagen guardada como: {unique_filename}")
-
-        # 1. Validar que hay un pez en la imagen
-        is_fish, fish_confidence = validate_fish_presence(image_path)
-
-        if not is_fish:
-            return jsonify({
-                "error": "No se detectó un pez en la imagen",
-                "is_fish": False,
-                "fish_confidence": fish_confidence,
-                "message": "Por favor, toma una foto donde aparezca claramente un pez"
-            }), 400
-
-        # 2. Detectar tipo de pez (Dorada o Lubina)
-        species_name, species_id, species_confidence = detect_species(image_path)
-
-        # Calcular probabilidades de ambas especies para debug
-        species_probs = {
-            "dorada": species_confidence if species_id == 0 else (1 - species_confidence),
-            "lubina": species_confidence if species_id == 1 else (1 - species_confidence)
-        }
+        # Una sola decodificación y codificación para las tres etapas:
+        # validación de pez, detección de especie y clasificación.
+        # Si la imagen ya se envió antes se reutiliza su predicción (caché
+        # en memoria) o al menos su embedding (almacén en disco).
+        image_hash = content_hash(image_data)
+        scores = result_cache.get(image_hash)
+        features = None
+        if scores is None:
+            features = cached_embedding(image_hash)
+            if features is None:
+                with admission.admit('predict'):
+                    image = pipeline.decode(image_data)
+                    features = pipeline.encode_one(pipeline.preprocess_one(image))[0]
+            scores = pipeline.score(features.unsqueeze(0))[0]
+            result_cache.put(image_hash, scores)
+
+        # Guardar la imagen (una vez por contenido) con su predicción
+        unique_filename = save_upload(image_data, file.filename, image_hash, scores)
+        if features is not None:
+            store_embedding(image_hash, features, unique_filename)
+
+        if not scores["is_fish"]:
+            return jsonify(build_no_fish_result(scores)), 400
+
+        result = build_result(scores)
+        # null si la cola de escritura descartó la imagen (política 'drop')
+        result["filename"] = unique_filename
+
+        log_event("predict", filename=unique_filename, species=result['species'],
+                  species_confidence=result['species_confidence'], classification=result['classification'],
+                  classification_confidence=result['classification_confidence'])
 
-        # 3. Clasificar si es salvaje o cultivado
-        classification = classify_fish(image_path, species_id)
-
-        # Construir respuesta completa
-        result = {
-            "success": True,
-            "is_fish": True,
-            "fish_confidence": fish_confidence,
-            "species": species_name,
-            "species_id": species_id,
-            "species_confidence": species_confidence,
-            "species_probabilities": species_probs,
-            "classification": classification["class_name"],
-            "classification_id": classification["predicted_class"],
-            "classification_confidence": classification["confidence"],
-            "probabilities": classification["probabilities"],
-            "filename": unique_filename,
-            "summary": f"{species_name} {classification['class_name']}"
-        }
+        return jsonify(result)
 
-        # Log para debug
-        print(f"Predicción final - Especie: {species_name} ({species_confidence:.2%}), Clasificación: {classification['class_name']} ({classification['confidence']:.2%})")
+    except Overloaded as e:
+        # Sin hueco de inferencia dentro del presupuesto de latencia
+        return busy_response(e, 503)
+    except Exception as e:
+        log_event("predict_error", sampled=False, level=logging.ERROR, exc_info=True, error=str(e))
+        return jsonify({"error": f"Error durante la predicción: {str(e)}"}), 500
 
-        return jsonify(result)
+def zip_image_members(archive):
+    """
+    Imágenes de un zip de /predict_batch, comprobando su tamaño antes de
+    descomprimir nada. ZipInfo.file_size es el tamaño descomprimido que declara
+    el zip, y zipfile no descomprime más allá de él.
+
+    Raises:
+        ValueError: si alguna imagen supera BATCH_ZIP_MAX_MEMBER_MB
+    """
+    members = [info for info in archive.infolist()
+               if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)]
+    for info in members:
+        if info.file_size > BATCH_ZIP_MAX_MEMBER_MB * 2**20:
+            raise ValueError(f"{info.filename} ocupa {info.file_size / 2**20:.0f} MB descomprimido "
+                             f"(máximo {BATCH_ZIP_MAX_MEMBER_MB:g} MB)")
+    return members
+
+def check_batch_zips(files):
+    """
+    Comprueba los límites de los zip de una petición de /predict_batch
+    (número de imágenes y tamaño descomprimido total) sin descomprimirlos.
+
+    Raises:
+        ValueError: si se supera algún límite
+        zipfile.BadZipFile: si algún zip no es válido
+    """
+    members = 0
+    total = 0
+    for filename, stream in files:
+        if not filename.lower().endswith('.zip'):
+            continue
+        with zipfile.ZipFile(stream) as archive:
+            infos = zip_image_members(archive)
+        stream.seek(0)
+        members += len(infos)
+        total += sum(info.file_size for info in infos)
+    if members > BATCH_ZIP_MAX_MEMBERS:
+        raise ValueError(f"Demasiadas imágenes en los zip: {members} (máximo {BATCH_ZIP_MAX_MEMBERS})")
+    if total > BATCH_ZIP_MAX_TOTAL_MB * 2**20:
+        raise ValueError(f"Los zip ocupan {total / 2**20:.0f} MB descomprimidos "
+                         f"(máximo {BATCH_ZIP_MAX_TOTAL_MB:g} MB)")
+
+def iter_batch_sources(files):
+    """Genera (nombre, bytes) de cada imagen subida, abriendo los archivos zip"""
+    for filename, stream in files:
+        if filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(stream) as archive:
+                for info in zip_image_members(archive):
+                    yield info.filename, archive.read(info)
+        else:
+            yield filename, stream.read()
+
+def predict_batch_lines(files):
+    """Clasifica las imágenes en batches y genera una línea JSON por imagen"""
+    chunk = []
+    index = 0
+
+    def flush(chunk):
+        # Reutilizar predicciones y embeddings ya calculados y decodificar sólo el resto
+        cached = []
+        encoded_items = []
+        pending = []
+        for i, name, image_data in chunk:
+            image_hash = content_hash(image_data)
+            scores = result_cache.get(image_hash)
+            if scores is not None:
+                cached.append((i, name, image_data, image_hash, None, scores))
+                continue
+            features = cached_embedding(image_hash)
+            if features is not None:
+                encoded_items.append((i, name, image_data, image_hash, features))
+                continue
+            try:
+                pending.append((i, name, image_data, image_hash, pipeline.decode(image_data)))
+            except Exception as e:
+                yield {"index": i, "source": name, "success": False,
+                       "error": f"No se pudo leer la imagen: {str(e)}"}
+
+        if pending:
+            with admission.admit('batch'):
+                encoded = pipeline.encode(pipeline.preprocess_images([item[4] for item in pending]))
+            encoded_items.extend(item[:4] + (features,) for item, features in zip(pending, encoded))
+
+        if encoded_items:
+            all_scores = pipeline.score(torch.stack([item[4] for item in encoded_items]))
+            for item, scores in zip(encoded_items, all_scores):
+                result_cache.put(item[3], scores)
+                cached.append(item + (scores,))
+
+        cached.sort(key=lambda item: item[0])
+        for i, name, image_data, image_hash, features, scores in cached:
+            unique_filename = save_upload(image_data, os.path.basename(name), image_hash, scores)
+            if features is not None:
+                store_embedding(image_hash, features, unique_filename)
+            if scores["is_fish"]:
+                result = build_result(scores)
+            else:
+                result = build_no_fish_result(scores)
+            result["filename"] = unique_filename
+            result["index"] = i
+            result["source"] = name
+            yield result
+
+    for name, image_data in iter_batch_sources(files):
+        chunk.append((index, name, image_data))
+        index += 1
+        if len(chunk) >= PREDICT_BATCH_SIZE:
+            yield from flush(chunk)
+            chunk = []
+    if chunk:
+        yield from flush(chunk)
+
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():
+    """
+    Clasifica muchas imágenes en una sola petición.
 
+    Acepta varios archivos en el campo 'images' (o 'image') y/o archivos .zip
+    con imágenes. Devuelve NDJSON: una línea por imagen, en cuanto está lista,
+    con el mismo esquema que /predict más 'index' y 'source'.
+    """
+    if model is None:
+        return jsonify({"error": "Modelo no cargado."}), 500
+
+    uploads = [f for f in request.files.getlist('images') + request.files.getlist('image') if f.filename]
+    if not uploads:
+        return jsonify({"error": "No se encontraron imágenes en la solicitud."}), 400
+
+    # Flask cierra los archivos de la petición al terminar la vista, antes de
+    # que se consuma el stream: copiarlos a archivos temporales propios
+    files = []
+    for upload in uploads:
+        stream = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+        shutil.copyfileobj(upload.stream, stream)
+        stream.seek(0)
+        files.append((upload.filename, stream))
+
+    # Rechazar los zip demasiado grandes antes de descomprimir ninguna imagen
+    try:
+        check_batch_zips(files)
+    except (ValueError, zipfile.BadZipFile) as e:
+        for _, stream in files:
+            stream.close()
+        status = 400 if isinstance(e, zipfile.BadZipFile) else 413
+        return jsonify({"error": f"Archivo zip no válido: {str(e)}"}), status
+
+    def generate():
+        try:
+            for result in predict_batch_lines(files):
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            log_event("predict_batch_error", sampled=False, level=logging.ERROR, exc_info=True, error=str(e))
+            yield json.dumps({"success": False, "error": f"Error durante la predicción: {str(e)}"}) + "\n"
+        finally:
+            for _, stream in files:
+                stream.close()
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/predict_video', methods=['POST'])
+def predict_video():
+    """
+    Clasifica un clip de vídeo (campo 'video').
+
+    El vídeo se decodifica como stream y se muestrea por ritmo ('fps', por
+    defecto VIDEO_SAMPLE_FPS) o, con mode=scene, por cambio de escena
+    ('scene_threshold'), hasta 'max_frames' frames. Los frames pasan por el
+    pipeline en batches y se devuelve el veredicto agregado del clip (mismo
+    esquema que /predict) y las puntuaciones de cada frame en 'frames'.
+    """
+    if model is None:
+        return jsonify({"error": "Modelo no cargado."}), 500
+    if not VIDEO_SUPPORTED:
+        return jsonify({"error": "La clasificación de vídeo necesita PyAV: pip install av"}), 501
+
+    file = request.files.get('video')
+    if file is None or file.filename == '':
+        return jsonify({"error": "No se encontró el vídeo en la solicitud."}), 400
+
+    try:
+        mode = request.values.get('mode', 'rate')
+        if mode not in ('rate', 'scene'):
+            raise ValueError(f"modo de muestreo desconocido: {mode}")
+        fps = float(request.values.get('fps', VIDEO_SAMPLE_FPS))
+        scene_threshold = float(request.values.get('scene_threshold', VIDEO_SCENE_THRESHOLD))
+        max_frames = min(int(request.values.get('max_frames', VIDEO_MAX_FRAMES)), VIDEO_MAX_FRAMES)
+        if fps <= 0 or max_frames <= 0:
+            raise ValueError("'fps' y 'max_frames' deben ser positivos")
+    except ValueError as e:
+        return jsonify({"error": f"Parámetros no válidos: {str(e)}"}), 400
+
+    start = time.perf_counter()
+    frames = []
+    batch = []
+
+    def flush():
+        if not batch:
+            return
+        with admission.admit('batch'):
+            all_scores = pipeline.score(pipeline.encode(pipeline.preprocess_images([image for _, image in batch])))
+        frames.extend((frame_time, scores) for (frame_time, _), scores in zip(batch, all_scores))
+        batch.clear()
+
+    try:
+        for frame_time, image in sample_frames(file.stream, pipeline.input_resolution, fps,
+                                               scene_threshold if mode == 'scene' else None, max_frames):
+            batch.append((frame_time, image))
+            if len(batch) >= PREDICT_BATCH_SIZE:
+                flush()
+        flush()
+    except ValueError as e:
+        return jsonify({"error": f"Vídeo no válido: {str(e)}"}), 400
     except Exception as e:
-        print(f"Error durante la predicción: {e}")
-        import traceback
-        traceback.print_exc()
+        log_event("predict_video_error", sampled=False, level=logging.ERROR, exc_info=True, error=str(e))
         return jsonify({"error": f"Error durante la predicción: {str(e)}"}), 500
 
+    frame_results = [{
+        "time": round(frame_time, 3),
+        "is_fish": scores["is_fish"],
+        "fish_confidence": scores["fish_confidence"],
+        "species": SPECIES_NAMES[scores["species_id"]],
+        "species_confidence": scores["species_confidence"],
+        "classification": CLASS_NAMES[scores["predicted_class"]],
+        "classification_confidence": scores["confidence"]
+    } for frame_time, scores in frames]
+
+    verdict = aggregate([scores for _, scores in frames])
+    if verdict is None:
+        result = build_no_fish_result({"fish_confidence": max((s["fish_confidence"] for _, s in frames), default=0.0)})
+        status = 400
+    else:
+        result = build_result(verdict)
+        status = 200
+    result.update(sampled_frames=len(frames), fish_frames=verdict["fish_frames"] if verdict else 0,
+                  sampling=mode, frames=frame_results)
+
+    log_event("predict_video", sampled_frames=len(frames), fish_frames=result["fish_frames"],
+              summary=result.get("summary"), seconds=round(time.perf_counter() - start, 3))
+    return jsonify(result), status
+
+@app.route('/similar', methods=['GET', 'POST'])
+def similar():
+    """
+    Busca en el archivo de imágenes subidas las más parecidas a una dada.
+
+    La imagen de consulta puede enviarse en el campo 'image' o indicarse por
+    'filename' (nombre devuelto por /predict). El parámetro 'k' fija el número
+    de resultados.
+    """
+    if model is None:
+        return jsonify({"error": "Modelo no cargado."}), 500
+    if embedding_store is None:
+        return jsonify({"error": "El almacén de embeddings está desactivado."}), 400
+
+    try:
+        k = int(request.values.get('k', 5))
+    except ValueError:
+        return jsonify({"error": "El parámetro 'k' debe ser un entero."}), 400
+
+    try:
+        file = request.files.get('image')
+        filename = request.values.get('filename')
+        if file is not None and file.filename != '':
+            image_data = file.read()
+            image_hash = content_hash(image_data)
+            features = cached_embedding(image_hash)
+            if features is None:
+                with admission.admit('predict'):
+                    image = pipeline.decode(image_data)
+                    features = pipeline.encode_one(pipeline.preprocess_one(image))[0]
+        elif filename:
+            image_hash = embedding_store.hash_for_filename(filename)
+            features = cached_embedding(image_hash) if image_hash is not None else None
+            if features is None:
+                # Sin embedding o con la imagen ya eliminada del almacén
+                return jsonify({"error": f"No hay embedding para la imagen '{filename}'."}), 404
+        else:
+            return jsonify({"error": "Indica una imagen ('image') o un nombre de archivo ('filename')."}), 400
+
+        results = embedding_store.nearest(features.float().cpu().numpy(), k=k, exclude_hash=image_hash)
+        return jsonify({"hash": image_hash, "results": results})
+
+    except Overloaded as e:
+        return busy_response(e, 503)
+    except Exception as e:
+        log_event("similar_error", sampled=False, level=logging.ERROR, error=str(e))
+        return jsonify({"error": f"Error en la búsqueda de similares: {str(e)}"}), 500
+
 @app.route('/predict_realtime', methods=['POST'])
 def predict_realtime():
     """
@@ -332,115 +991,104 @@ def predict_realtime():
     try:
         # Leer los datos de la imagen en memoria (sin guardar en disco para mayor velocidad)
         image_data = file.read()
+        session_id = request.form.get('session_id') or None
+        return jsonify(classify_realtime_frame(image_data, session_id))
+
+    except Overloaded as e:
+        # Modelo saturado: el frame se descarta al momento, el cliente enviará otro
+        return busy_response(e, 429)
+    except RawFrameSizeError as e:
+        return jsonify({"success": False, "error": f"Error: {str(e)}"}), 400
+    except Exception as e:
+        log_event("realtime_error", sampled=False, level=logging.ERROR, error=str(e))
+        return jsonify({"success": False, "error": f"Error: {str(e)}"}), 500
 
-        # Crear una ruta temporal en memoria
-        from io import BytesIO
-        image_path = BytesIO(image_data)
-
-        # 1. Validar que hay un pez en la imagen
-        image = Image.open(image_path).convert('RGB')
-        image_input = preprocess(image).unsqueeze(0).to(device)
-
-        # Validación de pez
-        text_tokens = clip.tokenize(VALIDATION_LABELS).to(device)
-        with torch.no_grad():
-            image_features = model.encode_image(image_input)
-            text_features = model.encode_text(text_tokens)
-            image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-            text_features = text_features / text_features.norm(dim=-1, keepdim=True)
-            similarity = (100.0 * image_features @ text_features.T).softmax(dim=-1)
-
-        probs = similarity[0].cpu().numpy()
-        fish_confidence = float(probs[0])
-
-        if fish_confidence <= 0.5:
-            return jsonify({
-                "success": False,
-                "is_fish": False,
-                "fish_confidence": fish_confidence,
-                "message": "Buscando pez..."
-            }), 200
-
-        # 2. Detectar especie con prompts ensemble
-        dorada_prompts = [
-            "a photo of a dorada fish with oval rounded body, silver grey color with golden spots near eyes, steep forehead profile, sparus aurata gilthead seabream",
-            "a gilthead sea bream fish with rounded oval shape and golden markings",
-            "sparus aurata dorada with compact oval body shape"
-        ]
-
-        lubina_prompts = [
-            "a photo of a sea bass fish with elongated streamlined body, dark silver grey color, straight head profile, prominent jaw, dicentrarchus labrax lubina",
-            "a european sea bass with long streamlined body and prominent lower jaw",
-            "dicentrarchus labrax lubina with elongated torpedo-shaped body"
-        ]
-
-        all_prompts = dorada_prompts + lubina_prompts
-        text_tokens = clip.tokenize(all_prompts).to(device)
-
-        with torch.no_grad():
-            text_features = model.encode_text(text_tokens)
-            text_features = text_features / text_features.norm(dim=-1, keepdim=True)
-            similarity = (100.0 * image_features @ text_features.T).softmax(dim=-1)
-
-        probs = similarity[0].cpu().numpy()
-        num_dorada_prompts = len(dorada_prompts)
-
-        dorada_prob = np.mean(probs[:num_dorada_prompts])
-        lubina_prob = np.mean(probs[num_dorada_prompts:])
-
-        total = dorada_prob + lubina_prob
-        dorada_prob_norm = dorada_prob / total
-        lubina_prob_norm = lubina_prob / total
-
-        if dorada_prob_norm > lubina_prob_norm:
-            species_id = 0
-            species_confidence = float(dorada_prob_norm)
-        else:
-            species_id = 1
-            species_confidence = float(lubina_prob_norm)
-
-        species_name = SPECIES_NAMES[species_id]
-
-        # 3. Clasificar cultivado vs salvaje
-        text_labels = TEXT_LABELS_DORADA if species_id == 0 else TEXT_LABELS_LUBINA
-        text_tokens = clip.tokenize(text_labels).to(device)
-
-        with torch.no_grad():
-            text_features = model.encode_text(text_tokens)
-            text_features = text_features / text_features.norm(dim=-1, keepdim=True)
-            similarity = (100.0 * image_features @ text_features.T).softmax(dim=-1)
-
-        probs = similarity[0].cpu().numpy()
-        predicted_class = int(np.argmax(probs))
-        classification_confidence = float(probs[predicted_class])
-
-        # Construir respuesta compacta para tiempo real
-        result = {
-            "success": True,
-            "is_fish": True,
-            "fish_confidence": fish_confidence,
-            "species": species_name,
-            "species_id": species_id,
-            "species_confidence": species_confidence,
-            "species_probabilities": {
-                "dorada": float(dorada_prob_norm),
-                "lubina": float(lubina_prob_norm)
-            },
-            "classification": CLASS_NAMES[predicted_class],
-            "classification_id": predicted_class,
-            "classification_confidence": classification_confidence,
-            "probabilities": {
-                "cultivada": float(probs[0]),
-                "salvaje": float(probs[1])
-            },
-            "summary": f"{species_name} {CLASS_NAMES[predicted_class]}"
+def classify_realtime_frame(image_data, session_id=None):
+    """
+    Clasifica un frame de cámara y devuelve la respuesta compacta de tiempo real.
+
+    Con session_id, los frames sin cambios respecto al anterior de la sesión
+    reutilizan su veredicto y el resto se suaviza en el tiempo. Con la cascada
+    activa, los frames claramente sin pez no llegan al pipeline completo.
+
+    Raises:
+        Overloaded: si el control de admisión descarta el frame
+    """
+    model_classify = cascade.predict if cascade is not None else pipeline.predict
+
+    def classify(frame):
+        with admission.admit('realtime'):
+            return model_classify(frame)
+
+    if session_id is not None and tracker is not None:
+        scores = tracker.process(session_id, image_data, classify)
+    else:
+        scores = classify(image_data)
+
+    if not scores["is_fish"]:
+        return {
+            "success": False,
+            "is_fish": False,
+            "fish_confidence": scores["fish_confidence"],
+            "message": "Buscando pez..."
         }
 
-        return jsonify(result)
+    # Construir respuesta compacta para tiempo real
+    return build_result(scores)
+
+if sock is not None:
+    @sock.route('/ws/realtime')
+    def realtime_socket(ws):
+        """
+        Canal persistente para el modo en tiempo real.
+
+        El cliente envía frames (JPEG o RGB crudo, ver /model_info) como
+        mensajes binarios y recibe un mensaje JSON por frame procesado (mismo
+        esquema que /predict_realtime). Si llegan frames mientras el modelo
+        está ocupado, sólo se procesa el más reciente.
+        """
+        if model is None:
+            ws.send(json.dumps({"success": False, "error": "Modelo no cargado."}))
+            return
+        session_id = uuid.uuid4().hex
+
+        def process_frame(frame):
+            try:
+                return classify_realtime_frame(frame, session_id)
+            except Overloaded as e:
+                return busy_result(e)
+
+        try:
+            serve_session(ws, process_frame, realtime_stats)
+        finally:
+            if tracker is not None:
+                tracker.end(session_id)
+
+@app.route('/model_info', methods=['GET'])
+def model_info():
+    """
+    Tamaño de entrada del modelo y formatos compactos que acepta el modo en tiempo real.
 
-    except Exception as e:
-        print(f"Error en detección en tiempo real: {e}")
-        return jsonify({"success": False, "error": f"Error: {str(e)}"}), 500
+    Los clientes pueden enviar el frame ya recortado al centro (cuadrado) y
+    reducido a input_resolution, como JPEG o como RGB crudo, en lugar de la
+    imagen completa de la cámara.
+    """
+    if model is None:
+        return jsonify({"error": "Modelo no cargado."}), 503
+    n_px = pipeline.input_resolution
+    return jsonify({
+        "model": MODEL_NAME,
+        "backend": backend_name,
+        "device": device,
+        "input_resolution": n_px,
+        "optimization_check": optimization_report,
+        "image_only": image_only_report,
+        "realtime_formats": {
+            "jpeg": {"width": n_px, "height": n_px, "crop": "center"},
+            "raw_rgb": {"width": n_px, "height": n_px, "crop": "center", "layout": "HWC", "dtype": "uint8",
+                        "size_bytes": n_px * n_px * 3}
+        }
+    })
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -448,7 +1096,62 @@ def health():
     return jsonify({
         "status": "ok",
         "model_loaded": model is not None,
-        "device": device
+        "ready": ready,
+        "device": device,
+        "backend": backend_name
+    })
+
+@app.route('/livez', methods=['GET'])
+def livez():
+    """Liveness: el proceso responde, sin depender del modelo"""
+    return jsonify({"status": "alive"})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: 200 sólo si el modelo se cargó y el forward de calentamiento funcionó"""
+    return jsonify({
+        "ready": ready,
+        "backend": backend_name,
+        **startup_times
+    }), 200 if ready else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas en formato de texto de Prometheus"""
+    if model is not None:
+        MODEL_INFO.set(1, model=MODEL_NAME, device=device, backend=backend_name, pid=os.getpid())
+    batcher = pipeline.batcher if pipeline is not None else None
+    writer = upload_writer.stats()
+    store = upload_store.stats()
+    state = {
+        "ready": int(ready),
+        "resident_memory_bytes": rss_bytes(),
+        "batch_queue_depth": batcher.stats()["queue_depth"] if batcher is not None else None,
+        "upload_write_pending": writer["pending"],
+        "upload_write_dropped": writer["dropped"],
+        "upload_write_failed": writer["failed"],
+        "upload_store_images": store["images"],
+        "upload_store_bytes": store["bytes"],
+        "embedding_store_images": len(embedding_store) if embedding_store is not None else None,
+        "result_cache_entries": len(result_cache),
+        "admission_in_flight": admission.stats()["in_flight"] if admission.enabled else None
+    }
+    return Response(render_metrics(state), mimetype='text/plain; version=0.0.4')
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Estadísticas internas de inferencia (cola y tamaños de batch)"""
+    batcher = pipeline.batcher if pipeline is not None else None
+    return jsonify({
+        "batcher": batcher.stats() if batcher is not None else None,
+        "embedding_store": embedding_store.stats() if embedding_store is not None else None,
+        "upload_writer": upload_writer.stats(),
+        "upload_store": upload_store.stats(),
+        "result_cache": result_cache.stats(),
+        "admission": admission.stats(),
+        "realtime": realtime_stats.snapshot(),
+        "tracking": tracker.stats() if tracker is not None else None,
+        "cascade": cascade.stats.snapshot() if cascade is not None else None
     })
 
 if __name__ == '__main__':
@@ -0,0 +1,197 @@
+"""
+Backends de inferencia para el codificador de imagen de CLIP.
+
+Todos exponen encode_image(tensor [B, 3, H, W]) -> tensor [B, dim], igual que
+el modelo CLIP de PyTorch, de modo que el pipeline puede usar cualquiera:
+
+- torch: el modelo CLIP cargado con clip.load (por defecto), opcionalmente
+  cuantizado a int8, compilado con torch.compile o con autocast bf16
+- onnx: modelo exportado con export_model.py, ejecutado con ONNX Runtime
+- tflite: modelo exportado con export_model.py, ejecutado con TensorFlow Lite
+
+Los modelos exportados se acompañan de un informe de paridad
+(<modelo>.parity.json); sólo se cargan si ese informe dice que pasó. Las
+variantes optimizadas de torch se comprueban al arrancar (ver app.load_backend).
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+import torch
+
+BACKENDS = ("torch", "onnx", "tflite")
+
+
+def parity_report_path(model_path):
+    return model_path + '.parity.json'
+
+
+def check_parity_report(model_path):
+    """Lanza una excepción si el modelo exportado no tiene un informe de paridad aprobado"""
+    report_path = parity_report_path(model_path)
+    if not os.path.exists(report_path):
+        raise RuntimeError(f"Falta el informe de paridad {report_path}; exporta el modelo con export_model.py")
+    with open(report_path, encoding='utf-8') as f:
+        report = json.load(f)
+    if not report.get("passed"):
+        raise RuntimeError(f"El modelo {model_path} no superó la comprobación de paridad")
+    return report
+
+
+def bf16_supported():
+    """True si la CPU tiene instrucciones bf16 nativas (AVX512-BF16 o AMX)"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+class OptimizedTorchBackend:
+    """
+    Codificador de imagen de PyTorch con optimizaciones de CPU:
+
+    - quantize='int8': cuantización dinámica de las capas lineales (pesos int8,
+      activaciones cuantizadas en cada forward)
+    - compile: torch.compile (la compilación ocurre en el primer forward, el
+      calentamiento; necesita un compilador de C)
+    - bf16: autocast a bfloat16, sólo en CPUs con soporte nativo
+
+    Sólo se optimiza la torre de imagen: la de texto se usa una vez por prompt
+    y sus embeddings están en caché.
+    """
+
+    def __init__(self, model, quantize=None, compile=False, bf16=False):
+        if quantize not in (None, '', 'int8'):
+            raise ValueError(f"Cuantización no soportada: {quantize}")
+        if bf16 and not bf16_supported():
+            raise RuntimeError("La CPU no tiene soporte nativo de bf16")
+
+        visual = model.visual
+        self.optimizations = []
+        if quantize == 'int8':
+            visual = torch.ao.quantization.quantize_dynamic(visual, {torch.nn.Linear}, dtype=torch.qint8)
+            self.optimizations.append('int8')
+        if bf16:
+            self.optimizations.append('bf16')
+        if compile:
+            visual = torch.compile(visual)
+            self.optimizations.append('compile')
+
+        self.visual = visual
+        self.dtype = model.dtype
+        self.bf16 = bf16
+        self.name = '-'.join(['torch'] + self.optimizations)
+
+    def encode_image(self, image_input):
+        with torch.no_grad(), torch.autocast('cpu', dtype=torch.bfloat16, enabled=self.bf16):
+            return self.visual(image_input.type(self.dtype)).float()
+
+
+class OnnxBackend:
+    """Codificador de imagen exportado a ONNX, ejecutado con ONNX Runtime"""
+
+    name = "onnx"
+
+    def __init__(self, model_path, num_threads=None):
+        import onnxruntime  # noqa: F401 (falla pronto si no está instalado)
+
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self._session = None
+        self._pid = None
+
+    def session(self):
+        # El pool de hilos de ONNX Runtime no sobrevive a un fork: una sesión por proceso
+        if self._pid != os.getpid():
+            import onnxruntime as ort
+
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if self.num_threads:
+                options.intra_op_num_threads = self.num_threads
+            self._session = ort.InferenceSession(self.model_path, options, providers=['CPUExecutionProvider'])
+            self._pid = os.getpid()
+        return self._session
+
+    def encode_image(self, image_input):
+        session = self.session()
+        pixels = image_input.detach().cpu().float().numpy()
+        features = session.run(None, {session.get_inputs()[0].name: pixels})[0]
+        return torch.from_numpy(features)
+
+
+class TFLiteBackend:
+    """Codificador de imagen exportado a TFLite (entrada NHWC o NCHW)"""
+
+    name = "tflite"
+
+    def __init__(self, model_path, num_threads=None):
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self._pid = None
+        # El intérprete de TFLite no admite llamadas concurrentes y encode_image
+        # cambia su forma de entrada: un forward a la vez
+        self._lock = threading.Lock()
+        self.interpreter()
+
+    def interpreter(self):
+        # Igual que en ONNX: un intérprete por proceso
+        if self._pid != os.getpid():
+            try:
+                from tflite_runtime.interpreter import Interpreter
+            except ImportError:
+                import tensorflow as tf
+                Interpreter = tf.lite.Interpreter
+
+            self._interpreter = Interpreter(model_path=self.model_path, num_threads=self.num_threads)
+            self._interpreter.allocate_tensors()
+            self.input_detail = self._interpreter.get_input_details()[0]
+            self.output_index = self._interpreter.get_output_details()[0]['index']
+            # onnx2tf convierte la entrada a NHWC
+            self.channels_last = int(self.input_detail['shape'][-1]) == 3
+            self._batch_size = int(self.input_detail['shape'][0])
+            self._pid = os.getpid()
+        return self._interpreter
+
+    def encode_image(self, image_input):
+        pixels = image_input.detach().cpu().float().numpy()
+        with self._lock:
+            interpreter = self.interpreter()
+            if self.channels_last:
+                pixels = np.ascontiguousarray(pixels.transpose(0, 2, 3, 1))
+
+            if pixels.shape[0] != self._batch_size:
+                interpreter.resize_tensor_input(self.input_detail['index'], list(pixels.shape))
+                interpreter.allocate_tensors()
+                self._batch_size = pixels.shape[0]
+
+            interpreter.set_tensor(self.input_detail['index'], pixels.astype(self.input_detail['dtype']))
+            interpreter.invoke()
+            # get_tensor copia la salida antes de soltar el lock
+            features = interpreter.get_tensor(self.output_index)
+        return torch.from_numpy(np.array(features, dtype=np.float32))
+
+
+def create_backend(kind, model, model_path=None, num_threads=None):
+    """
+    Crea el codificador de imagen indicado.
+
+    Args:
+        kind: 'torch', 'onnx' o 'tflite'
+        model: Modelo CLIP de PyTorch (es el backend 'torch')
+        model_path: Modelo exportado para 'onnx'/'tflite'
+        num_threads: Hilos de inferencia (None = valor por defecto del runtime)
+    """
+    if kind == "torch":
+        return model
+    if kind not in BACKENDS:
+        raise ValueError(f"Backend de inferencia desconocido: {kind}")
+    if not model_path or not os.path.exists(model_path):
+        raise RuntimeError(f"No se encontró el modelo exportado para el backend {kind}: {model_path}")
+
+    check_parity_report(model_path)
+    if kind == "onnx":
+        return OnnxBackend(model_path, num_threads)
+    return TFLiteBackend(model_path, num_threads)
@@ -0,0 +1,125 @@
+"""
+Planificador de micro-batching para la codificación de imágenes.
+
+Las peticiones concurrentes dejan su imagen preprocesada en una cola central.
+Un hilo trabajador espera como máximo `max_wait_ms` a que lleguen más imágenes
+(hasta `max_batch_size`), ejecuta un único forward en batch y devuelve a cada
+petición su embedding a través de un Future.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+
+class MicroBatcher:
+    """Agrupa imágenes de peticiones concurrentes en un solo forward del modelo"""
+
+    def __init__(self, encode_fn, max_batch_size=8, max_wait_ms=10):
+        """
+        Args:
+            encode_fn: Función que recibe un tensor [B, 3, H, W] y devuelve [B, dim]
+            max_batch_size: Número máximo de imágenes por forward
+            max_wait_ms: Tiempo máximo que se espera para completar un batch
+        """
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+        # Estadísticas
+        self._batches = 0
+        self._images = 0
+        self._max_queue_depth = 0
+        self._batch_sizes = {}
+        self._total_wait = 0.0
+        self._total_forward = 0.0
+
+    def _ensure_worker(self):
+        # El hilo se arranca bajo demanda y se vuelve a crear tras un fork
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != pid or not self._thread.is_alive():
+                if self._pid != pid:
+                    self._queue = queue.Queue()
+                self._pid = pid
+                self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, image_tensor):
+        """Encola un tensor [3, H, W] y devuelve un Future con su embedding [dim]"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((image_tensor, future, time.perf_counter()))
+        depth = self._queue.qsize()
+        if depth > self._max_queue_depth:
+            self._max_queue_depth = depth
+        return future
+
+    def encode(self, image_tensor, timeout=None):
+        """Versión bloqueante de submit()"""
+        return self.submit(image_tensor).result(timeout=timeout)
+
+    def _collect(self):
+        items = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            start = time.perf_counter()
+            try:
+                features = self.encode_fn(torch.stack([item[0] for item in items]))
+            except Exception as e:
+                for _, future, _ in items:
+                    future.set_exception(e)
+                continue
+            end = time.perf_counter()
+
+            for i, (_, future, _) in enumerate(items):
+                future.set_result(features[i])
+
+            size = len(items)
+            with self._lock:
+                self._batches += 1
+                self._images += size
+                self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+                self._total_wait += sum(start - enqueued for _, _, enqueued in items)
+                self._total_forward += end - start
+
+    def stats(self):
+        """Estadísticas de cola y tamaño de batch para ajustar latencia/throughput"""
+        with self._lock:
+            batches = self._batches
+            images = self._images
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "batches": batches,
+                "images": images,
+                "avg_batch_size": images / batches if batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "avg_queue_wait_ms": 1000.0 * self._total_wait / images if images else 0.0,
+                "avg_forward_ms": 1000.0 * self._total_forward / batches if batches else 0.0
+            }
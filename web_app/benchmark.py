@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Benchmark de latencia y throughput del clasificador.
+
+Usa las imágenes de ../uploads como corpus y mide, para cada nivel de
+concurrencia, la latencia p50/p95/p99 y las imágenes por segundo de:
+
+- predict: POST /predict
+- predict_realtime: POST /predict_realtime (sin sesión: cada frame completo)
+- functions: validate_fish_presence + detect_species + classify_fish
+
+Además desglosa el coste por etapa (decodificación, preprocesado, codificación
+de imagen, codificación de texto y puntuación) y guarda todo en un JSON con el
+commit y la configuración, para comparar ejecuciones:
+
+    python benchmark.py --concurrency 1 4 --requests 200
+    python benchmark.py --url http://localhost:5000 --scenarios predict predict_realtime
+    python benchmark.py --compare benchmarks/antes.json benchmarks/despues.json
+
+Sin --url se ejecuta en proceso con el cliente de pruebas de Flask, sin la
+caché de embeddings de imagen ni la de predicciones y guardando las subidas
+en un directorio temporal. Contra un servidor real conviene arrancarlo con
+EMBEDDING_STORE=0 y RESULT_CACHE_SIZE=0: si no, las imágenes repetidas del
+corpus no se vuelven a codificar.
+"""
+
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+SCENARIOS = ("predict", "predict_realtime", "functions")
+ENDPOINTS = {"predict": "/predict", "predict_realtime": "/predict_realtime"}
+# Variables de entorno que afectan al rendimiento y se guardan con los resultados
+CONFIG_VARS = (
+    "INFERENCE_BACKEND", "BACKEND_MODEL_PATH", "FAST_PREPROCESS", "BATCH_MAX_SIZE", "BATCH_MAX_WAIT_MS",
+    "EMBEDDING_STORE", "RESULT_CACHE_SIZE", "TRACKING", "WEB_WORKERS", "TORCH_THREADS", "INFERENCE_THREADS",
+    "IMAGE_ONLY"
+)
+
+
+class Rejected(Exception):
+    """El servidor descartó la petición por el control de admisión (429, o 503 con Retry-After)"""
+
+
+def is_rejection(status, headers):
+    return status == 429 or (status == 503 and 'Retry-After' in headers)
+
+
+def summarize(latencies, errors, wall_seconds, rejected=0):
+    """Percentiles de latencia (ms) y throughput de una ejecución"""
+    ok = len(latencies)
+    lat = np.array(latencies) * 1000.0 if ok else np.zeros(1)
+    return {
+        "requests": ok + errors + rejected,
+        "errors": errors,
+        "rejected": rejected,
+        "wall_seconds": wall_seconds,
+        "images_per_s": ok / wall_seconds if wall_seconds > 0 else 0.0,
+        "latency_ms": {
+            "mean": float(lat.mean()),
+            "p50": float(np.percentile(lat, 50)),
+            "p95": float(np.percentile(lat, 95)),
+            "p99": float(np.percentile(lat, 99)),
+            "max": float(lat.max())
+        }
+    }
+
+
+def run_load(call, corpus, concurrency, num_requests, warmup=0):
+    """
+    Lanza num_requests llamadas call(path, data) repartidas entre concurrency hilos.
+
+    El corpus se recorre en orden y de forma cíclica, así que dos ejecuciones
+    con los mismos parámetros envían la misma secuencia de imágenes.
+    """
+    for i in range(warmup):
+        call(*corpus[i % len(corpus)])
+
+    counter = itertools.count()
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+    rejected = [0]
+
+    def worker():
+        while True:
+            i = next(counter)
+            if i >= num_requests:
+                return
+            path, data = corpus[i % len(corpus)]
+            start = time.perf_counter()
+            try:
+                call(path, data)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+            except Rejected:
+                # Descartes por saturación: ni latencia válida ni error
+                with lock:
+                    rejected[0] += 1
+            except Exception as e:
+                with lock:
+                    errors[0] += 1
+                    if errors[0] == 1:
+                        print(f"  Error: {e}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    return summarize(latencies, errors[0], time.perf_counter() - start, rejected[0])
+
+
+def http_post_image(url, field, filename, data, timeout=120):
+    """
+    POST multipart con una imagen; los 4xx (p. ej. 'no hay pez') cuentan como
+    respuesta válida y los descartes del control de admisión lanzan Rejected.
+    """
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'
+    ).encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    request = urllib.request.Request(url, body, {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        if is_rejection(e.code, e.headers):
+            raise Rejected(f"{url} respondió {e.code}") from e
+        if e.code >= 500:
+            raise
+        return e.code
+
+
+class InProcessTarget:
+    """Ejecuta los escenarios contra la app importada en este proceso"""
+
+    def __init__(self, keep_cache=False):
+        import app
+        from upload_store import UploadStore
+
+        if app.model is None:
+            raise RuntimeError("no se pudo cargar el modelo")
+        self.app = app
+        self.upload_dir = tempfile.mkdtemp(prefix='benchmark-uploads-')
+        app.upload_store = UploadStore(self.upload_dir, app.upload_writer)
+        if not keep_cache:
+            app.embedding_store = None
+            app.result_cache.max_entries = 0
+        self._local = threading.local()
+
+    def _client(self):
+        # Un cliente de pruebas por hilo
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.app.app.test_client()
+        return self._local.client
+
+    def call(self, scenario):
+        if scenario == "functions":
+            def run(path, data):
+                self.app.validate_fish_presence(path)
+                _, species_id, _ = self.app.detect_species(path)
+                self.app.classify_fish(path, species_id)
+            return run
+
+        endpoint = ENDPOINTS[scenario]
+
+        def run(path, data):
+            response = self._client().post(
+                endpoint, data={'image': (io.BytesIO(data), os.path.basename(path))},
+                content_type='multipart/form-data'
+            )
+            if is_rejection(response.status_code, response.headers):
+                raise Rejected(f"{endpoint} respondió {response.status_code}")
+            if response.status_code >= 500:
+                raise RuntimeError(f"{endpoint} respondió {response.status_code}")
+        return run
+
+    def info(self):
+        return {"target": "in-process", "backend": self.app.backend_name, "device": self.app.device}
+
+    def close(self):
+        self.app.upload_writer.flush()
+        shutil.rmtree(self.upload_dir, ignore_errors=True)
+
+
+class HttpTarget:
+    """Ejecuta los escenarios HTTP contra un servidor arrancado"""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def call(self, scenario):
+        if scenario not in ENDPOINTS:
+            raise ValueError(f"El escenario {scenario} sólo está disponible en proceso")
+        url = self.url + ENDPOINTS[scenario]
+        return lambda path, data: http_post_image(url, 'image', os.path.basename(path), data)
+
+    def info(self):
+        info = {"target": self.url}
+        try:
+            with urllib.request.urlopen(self.url + '/health', timeout=10) as response:
+                health = json.load(response)
+            info.update(backend=health.get("backend"), device=health.get("device"))
+        except Exception as e:
+            print(f"Aviso: no se pudo consultar /health: {e}")
+        return info
+
+    def close(self):
+        pass
+
+
+def stage_breakdown(app, corpus, limit=32, text_repeats=3):
+    """
+    Tiempo medio por imagen (ms) de cada etapa del pipeline, imagen a imagen.
+
+    La codificación de texto no está en el camino de la petición (los prompts
+    se codifican una vez y se cachean); se mide lo que cuesta codificar todos
+    los conjuntos de prompts de una vez.
+    """
+    import torch
+    from prompt_cache import encode_prompts, has_text_tower
+
+    pipeline = app.pipeline
+    timings = {"decode": [], "preprocess": [], "image_encode": [], "scoring": []}
+    for path, data in corpus[:limit]:
+        start = time.perf_counter()
+        image = pipeline.decode(data)
+        decoded = time.perf_counter()
+        image_input = pipeline.preprocess_images([image])
+        preprocessed = time.perf_counter()
+        features = pipeline.encode(image_input)
+        encoded = time.perf_counter()
+        pipeline.score(features)
+        scored = time.perf_counter()
+        timings["decode"].append(decoded - start)
+        timings["preprocess"].append(preprocessed - decoded)
+        timings["image_encode"].append(encoded - preprocessed)
+        timings["scoring"].append(scored - encoded)
+
+    prompts = [prompt for prompts in app.PROMPT_SETS.values() for prompt in prompts]
+    timings["text_encode"] = []
+    # En modo sólo imagen no hay torre de texto que medir
+    for _ in range(text_repeats if has_text_tower(app.model) else 0):
+        start = time.perf_counter()
+        with torch.no_grad():
+            encode_prompts(app.model, prompts, app.device)
+        timings["text_encode"].append(time.perf_counter() - start)
+
+    breakdown = {
+        stage: {"mean_ms": 1000.0 * float(np.mean(values)), "p50_ms": 1000.0 * float(np.median(values))}
+        for stage, values in timings.items() if values
+    }
+    if "text_encode" in breakdown:
+        breakdown["text_encode"]["prompts"] = len(prompts)
+    return breakdown
+
+
+def git_commit():
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=directory,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=directory,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def environment_info():
+    import torch
+
+    commit, dirty = git_commit()
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "cpu_count": os.cpu_count(),
+        "machine": platform.machine(),
+        "config": {name: os.environ[name] for name in CONFIG_VARS if name in os.environ}
+    }
+
+
+def print_results(results):
+    print(f"\n{'Escenario':<18}{'Conc.':>6}{'img/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errores':>9}{'descart.':>10}")
+    for run in results["runs"]:
+        lat = run["latency_ms"]
+        print(f"{run['scenario']:<18}{run['concurrency']:>6}{run['images_per_s']:>9.2f}"
+              f"{lat['p50']:>10.1f}{lat['p95']:>10.1f}{lat['p99']:>10.1f}{run['errors']:>9}{run.get('rejected', 0):>10}")
+    if results.get("stages"):
+        print("\nDesglose por etapa (ms por imagen):")
+        for stage, values in results["stages"].items():
+            print(f"  {stage:<14} media {values['mean_ms']:8.2f}   p50 {values['p50_ms']:8.2f}")
+
+
+def compare(before_path, after_path):
+    """Compara dos ejecuciones guardadas escenario a escenario"""
+    with open(before_path, encoding='utf-8') as f:
+        before = json.load(f)
+    with open(after_path, encoding='utf-8') as f:
+        after = json.load(f)
+
+    def key(run):
+        return run["scenario"], run["concurrency"]
+
+    previous = {key(run): run for run in before["runs"]}
+    print(f"Antes: {before['environment'].get('commit')}  Después: {after['environment'].get('commit')}")
+    print(f"\n{'Escenario':<18}{'Conc.':>6}{'img/s':>18}{'p50 ms':>20}{'p95 ms':>20}")
+    for run in after["runs"]:
+        old = previous.get(key(run))
+        if old is None:
+            continue
+
+        def delta(new, prev):
+            return f"{prev:.1f}->{new:.1f} ({(new - prev) / prev:+.0%})" if prev else f"{new:.1f}"
+
+        print(f"{run['scenario']:<18}{run['concurrency']:>6}"
+              f"{delta(run['images_per_s'], old['images_per_s']):>18}"
+              f"{delta(run['latency_ms']['p50'], old['latency_ms']['p50']):>20}"
+              f"{delta(run['latency_ms']['p95'], old['latency_ms']['p95']):>20}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de latencia y throughput del clasificador")
+    parser.add_argument("--corpus", default=os.path.join('..', 'uploads'), help="Directorio de imágenes")
+    parser.add_argument("--limit", type=int, default=None, help="Máximo de imágenes del corpus")
+    parser.add_argument("--url", default=None, help="Servidor a medir (por defecto, en proceso)")
+    parser.add_argument("--scenarios", nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", nargs='+', type=int, default=[1, 4], help="Niveles de concurrencia")
+    parser.add_argument("--requests", type=int, default=100, help="Peticiones por escenario y concurrencia")
+    parser.add_argument("--warmup", type=int, default=5, help="Peticiones de calentamiento no medidas")
+    parser.add_argument("--no-stages", action="store_true", help="No medir el desglose por etapa")
+    parser.add_argument("--keep-cache", action="store_true",
+                        help="En proceso, mantener las cachés de embeddings y de predicciones")
+    parser.add_argument("--output", default=None, help="JSON de resultados (por defecto benchmarks/<fecha>-<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("ANTES", "DESPUES"), help="Comparar dos JSON de resultados")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    from parity import list_images
+
+    paths = list_images(args.corpus, args.limit)
+    if not paths:
+        print(f"Error: no hay imágenes en {args.corpus}")
+        return 1
+    corpus = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            corpus.append((path, f.read()))
+
+    if args.url:
+        target = HttpTarget(args.url)
+        scenarios = [s for s in args.scenarios if s in ENDPOINTS]
+    else:
+        target = InProcessTarget(args.keep_cache)
+        scenarios = args.scenarios
+
+    results = {
+        "environment": {**environment_info(), **target.info()},
+        "corpus": {"directory": os.path.abspath(args.corpus), "images": len(corpus)},
+        "runs": [],
+        "stages": None
+    }
+    try:
+        for scenario in scenarios:
+            call = target.call(scenario)
+            for concurrency in args.concurrency:
+                print(f"{scenario} (concurrencia {concurrency}, {args.requests} peticiones)...")
+                run = run_load(call, corpus, concurrency, args.requests, args.warmup)
+                results["runs"].append({"scenario": scenario, "concurrency": concurrency, **run})
+        if not args.url and not args.no_stages:
+            print("Desglose por etapa...")
+            results["stages"] = stage_breakdown(target.app, corpus)
+    finally:
+        target.close()
+
+    print_results(results)
+
+    output = args.output
+    if output is None:
+        commit = results["environment"]["commit"] or "sin-commit"
+        output = os.path.join('benchmarks', f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResultados guardados en {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Clasificación masiva offline de un directorio de imágenes.
+
+Reutiliza el modelo y el pipeline de app.py sin arrancar el servidor Flask.
+La decodificación y el preprocess se reparten en un pool de procesos y el
+modelo recibe batches de tensores. Las imágenes cuyo embedding ya está en el
+almacén de embeddings de la aplicación no se vuelven a codificar. El informe
+CSV se escribe de forma incremental y sirve también de checkpoint: al
+relanzar el comando se saltan las imágenes ya procesadas.
+
+Uso (desde web_app/):
+    python bulk_classify.py ../uploads --output report.csv
+    python bulk_classify.py /data/archivo --output report.parquet --workers 8
+"""
+
+import argparse
+import csv
+import hashlib
+import io
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from fast_preprocess import FastPreprocessor
+from upload_store import IMAGE_EXTENSIONS, INDEX_NAME, list_archive
+
+FIELDS = [
+    "path", "is_fish", "fish_confidence",
+    "species", "species_confidence", "prob_dorada", "prob_lubina",
+    "classification", "classification_confidence", "prob_cultivada", "prob_salvaje",
+    "error"
+]
+
+# Preprocess de CLIP y hashes ya codificados, en cada proceso trabajador
+_preprocess = None
+_known_hashes = frozenset()
+
+
+def _init_worker(preprocess, known_hashes):
+    global _preprocess, _known_hashes
+    _preprocess = preprocess
+    _known_hashes = known_hashes
+    # Cada trabajador sólo decodifica: un hilo de torch es suficiente
+    torch.set_num_threads(1)
+
+
+def _load_image(path):
+    """
+    Decodifica y preprocesa una imagen en un proceso trabajador.
+
+    Returns:
+        tuple: (path, sha256, tensor o None si ya está en el almacén, error)
+    """
+    try:
+        with open(path, 'rb') as f:
+            image_data = f.read()
+        image_hash = hashlib.sha256(image_data).hexdigest()
+        if image_hash in _known_hashes:
+            return path, image_hash, None, None
+        if isinstance(_preprocess, FastPreprocessor):
+            image = _preprocess.decode(image_data)
+        else:
+            image = Image.open(io.BytesIO(image_data)).convert('RGB')
+        return path, image_hash, _preprocess(image).numpy(), None
+    except Exception as e:
+        return path, None, None, str(e)
+
+
+def find_images(root):
+    """Lista ordenada de imágenes bajo root (de un almacén de subidas, por su índice)"""
+    if os.path.exists(os.path.join(root, INDEX_NAME)):
+        return list_archive(root)
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(dirpath, name))
+    return sorted(paths)
+
+
+def read_checkpoint(path):
+    """Rutas ya procesadas según el CSV existente"""
+    if not os.path.exists(path):
+        return set()
+    with open(path, newline='', encoding='utf-8') as f:
+        return {row["path"] for row in csv.DictReader(f)}
+
+
+def checkpoint_path(output):
+    """CSV de checkpoint: el propio informe o, con salida Parquet, uno que se convierte al final"""
+    return output + '.checkpoint.csv' if output.endswith('.parquet') else output
+
+
+def pending_images(directory, csv_path):
+    """
+    Imágenes de directory que aún no están en el checkpoint.
+
+    Returns:
+        tuple: (rutas ya procesadas, rutas pendientes en orden)
+    """
+    done = read_checkpoint(csv_path)
+    return done, [path for path in find_images(directory) if path not in done]
+
+
+def score_row(app, path, scores):
+    return {
+        "path": path,
+        "is_fish": scores["is_fish"],
+        "fish_confidence": f"{scores['fish_confidence']:.6f}",
+        "species": app.SPECIES_NAMES[scores["species_id"]],
+        "species_confidence": f"{scores['species_confidence']:.6f}",
+        "prob_dorada": f"{scores['species_probabilities']['dorada']:.6f}",
+        "prob_lubina": f"{scores['species_probabilities']['lubina']:.6f}",
+        "classification": app.CLASS_NAMES[scores["predicted_class"]],
+        "classification_confidence": f"{scores['confidence']:.6f}",
+        "prob_cultivada": f"{scores['probabilities']['cultivada']:.6f}",
+        "prob_salvaje": f"{scores['probabilities']['salvaje']:.6f}",
+        "error": ""
+    }
+
+
+def write_parquet(csv_path, parquet_path):
+    try:
+        import pandas as pd
+    except ImportError:
+        print("Para exportar a Parquet instala pandas y pyarrow: pip install pandas pyarrow")
+        return False
+    pd.read_csv(csv_path).to_parquet(parquet_path, index=False)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clasificación masiva de imágenes de peces")
+    parser.add_argument("directory", help="Directorio con las imágenes a clasificar")
+    parser.add_argument("--output", default="report.csv",
+                        help="Informe de salida (.csv o .parquet)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Procesos de decodificación")
+    parser.add_argument("--batch-size", type=int, default=32,
+                        help="Imágenes por forward del modelo")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignorar el checkpoint y empezar de cero")
+    parser.add_argument("--no-store", action="store_true",
+                        help="No reutilizar el almacén de embeddings")
+    args = parser.parse_args()
+
+    csv_path = checkpoint_path(args.output)
+    if args.restart and os.path.exists(csv_path):
+        os.remove(csv_path)
+
+    done, paths = pending_images(args.directory, csv_path)
+    print(f"{len(done)} imágenes ya procesadas, {len(paths)} pendientes")
+
+    import app
+    if app.model is None:
+        print("Error: no se pudo cargar el modelo")
+        return 1
+    pipeline = app.pipeline
+    store = None if args.no_store else app.embedding_store
+    known_hashes = frozenset(store.known_hashes()) if store is not None else frozenset()
+
+    # 'spawn' evita heredar por fork el estado de los hilos de torch del proceso principal
+    context = multiprocessing.get_context('spawn')
+    new_file = not os.path.exists(csv_path)
+    processed = 0
+    start = time.perf_counter()
+
+    with open(csv_path, 'a', newline='', encoding='utf-8') as f, \
+            context.Pool(args.workers, initializer=_init_worker,
+                         initargs=(pipeline.preprocess, known_hashes)) as pool:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        if new_file:
+            writer.writeheader()
+
+        batch_paths, batch_tensors = [], []
+        cached_paths, cached_features = [], []
+        reused = 0
+
+        def flush():
+            nonlocal processed, reused
+            if batch_tensors:
+                image_input = torch.from_numpy(np.stack(batch_tensors))
+                all_scores = pipeline.score(pipeline.encode(image_input))
+                for path, scores in zip(batch_paths, all_scores):
+                    writer.writerow(score_row(app, path, scores))
+                processed += len(batch_paths)
+                batch_paths.clear()
+                batch_tensors.clear()
+            if cached_features:
+                all_scores = pipeline.score(torch.stack(cached_features))
+                for path, scores in zip(cached_paths, all_scores):
+                    writer.writerow(score_row(app, path, scores))
+                processed += len(cached_paths)
+                reused += len(cached_paths)
+                cached_paths.clear()
+                cached_features.clear()
+            f.flush()
+
+        for path, image_hash, tensor, error in pool.imap(_load_image, paths, chunksize=4):
+            if error is not None:
+                writer.writerow({"path": path, "error": error})
+                continue
+            if tensor is None:
+                cached_paths.append(path)
+                cached_features.append(app.cached_embedding(image_hash))
+            else:
+                batch_paths.append(path)
+                batch_tensors.append(tensor)
+            if len(batch_tensors) + len(cached_features) >= args.batch_size:
+                flush()
+                elapsed = time.perf_counter() - start
+                print(f"  {processed}/{len(paths)} imágenes ({processed / elapsed:.1f} img/s)")
+        flush()
+
+    elapsed = time.perf_counter() - start
+    print(f"Procesadas {processed} imágenes en {elapsed:.1f}s "
+          f"({reused} desde el almacén) -> {csv_path}")
+
+    if csv_path != args.output:
+        if not write_parquet(csv_path, args.output):
+            return 1
+        print(f"Informe Parquet guardado en: {args.output}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Cascada de dos niveles para el modo en tiempo real.
+
+La mayoría de frames de la cámara no muestran ningún pez ("Buscando pez...")
+y aun así cada uno paga un forward completo de ViT-B/32 a 224×224. El primer
+nivel ejecuta el mismo codificador de imagen de CLIP a una resolución
+reducida (por defecto 96×96: 9 parches en lugar de 49), con los embeddings
+posicionales interpolados y los mismos pesos, y puntúa el resultado contra
+los prompts de validación. Si la probabilidad de pez queda por debajo del
+umbral, el frame se descarta sin pasar al segundo nivel, la cascada completa
+(validación de pez, especie y cultivada/salvaje) a resolución completa.
+
+A resolución reducida CLIP está peor calibrado, así que el umbral del primer
+nivel debe ser conservador: sólo debe rechazar frames claramente sin pez.
+Para elegirlo sobre un directorio de imágenes:
+
+    python cascade.py --check ../uploads --threshold 0.1
+"""
+
+import argparse
+import sys
+import threading
+import time
+
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+from observability import CASCADE_FRAMES, stage
+
+
+def interpolate_positional_embedding(positional_embedding, grid):
+    """Embeddings posicionales [1 + g*g, width] de CLIP reescalados a una rejilla grid×grid"""
+    class_position = positional_embedding[:1]
+    patches = positional_embedding[1:]
+    side = int(round(patches.shape[0] ** 0.5))
+    patches = patches.reshape(1, side, side, -1).permute(0, 3, 1, 2).float()
+    patches = F.interpolate(patches, size=(grid, grid), mode='bicubic', align_corners=False)
+    patches = patches.permute(0, 2, 3, 1).reshape(grid * grid, -1).to(positional_embedding.dtype)
+    return torch.cat([class_position, patches])
+
+
+class FishGate:
+    """Primer nivel: probabilidad de pez con el codificador de CLIP a baja resolución"""
+
+    def __init__(self, model, validation_embeddings, resolution=96, threshold=0.1):
+        """
+        Args:
+            model: Modelo CLIP de PyTorch (su torre de imagen debe ser un ViT)
+            validation_embeddings: Embeddings normalizados de los prompts de validación
+            resolution: Lado de la entrada del primer nivel (múltiplo del tamaño de parche)
+            threshold: Probabilidad de pez por debajo de la cual se rechaza el frame
+        """
+        visual = model.visual
+        if not hasattr(visual, 'positional_embedding'):
+            raise ValueError("La cascada necesita un codificador de imagen ViT")
+        patch = visual.conv1.kernel_size[0]
+        if resolution % patch or resolution >= visual.input_resolution:
+            raise ValueError(f"Resolución del primer nivel no válida: {resolution} "
+                             f"(múltiplo de {patch} y menor que {visual.input_resolution})")
+
+        self.visual = visual
+        self.dtype = model.dtype
+        self.resolution = resolution
+        self.threshold = threshold
+        self.validation_embeddings = validation_embeddings
+        with torch.no_grad():
+            self.positional_embedding = interpolate_positional_embedding(
+                visual.positional_embedding, resolution // patch)
+
+    def encode(self, image_input):
+        """Forward de la torre ViT de CLIP a baja resolución -> embeddings normalizados"""
+        visual = self.visual
+        x = F.interpolate(image_input, size=(self.resolution, self.resolution), mode='area')
+        x = visual.conv1(x.type(self.dtype))
+        x = x.reshape(x.shape[0], x.shape[1], -1).permute(0, 2, 1)
+        class_token = visual.class_embedding.to(x.dtype).expand(x.shape[0], 1, -1)
+        x = torch.cat([class_token, x], dim=1) + self.positional_embedding.to(x.dtype)
+        x = visual.ln_pre(x).permute(1, 0, 2)
+        x = visual.transformer(x).permute(1, 0, 2)
+        x = visual.ln_post(x[:, 0, :])
+        if visual.proj is not None:
+            x = x @ visual.proj
+        x = x.float()
+        return x / x.norm(dim=-1, keepdim=True)
+
+    def fish_confidence(self, image_input):
+        """Probabilidad de pez [B] de un batch preprocesado a resolución completa"""
+        with torch.no_grad(), stage('gate'):
+            features = self.encode(image_input)
+            embeddings = self.validation_embeddings.to(features.device, features.dtype)
+            probs = (100.0 * features @ embeddings.T).softmax(dim=-1)
+        return probs[:, 0]
+
+
+class CascadeStats:
+    """Frames evaluados, rechazados y tiempo de cada nivel de la cascada"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tiers = {
+            "gate": {"frames": 0, "rejected": 0, "seconds": 0.0},
+            "full": {"frames": 0, "seconds": 0.0}
+        }
+
+    def record(self, tier, seconds, rejected=False):
+        with self._lock:
+            counters = self._tiers[tier]
+            counters["frames"] += 1
+            counters["seconds"] += seconds
+            if rejected:
+                counters["rejected"] += 1
+        CASCADE_FRAMES.inc(tier=tier, outcome='rejected' if rejected else 'passed')
+
+    def snapshot(self):
+        with self._lock:
+            gate = dict(self._tiers["gate"])
+            full = dict(self._tiers["full"])
+        full_mean = full["seconds"] / full["frames"] if full["frames"] else 0.0
+        return {
+            "gate": gate,
+            "full": full,
+            "rejection_rate": gate["rejected"] / gate["frames"] if gate["frames"] else 0.0,
+            # Forwards completos evitados y su coste estimado, descontando el del primer nivel
+            "saved_full_passes": gate["rejected"],
+            "estimated_saved_seconds": gate["rejected"] * full_mean - gate["seconds"]
+        }
+
+
+class Cascade:
+    """Clasifica frames pasando sólo al pipeline completo los que superan el primer nivel"""
+
+    def __init__(self, pipeline, gate, stats=None):
+        self.pipeline = pipeline
+        self.gate = gate
+        self.stats = stats if stats is not None else CascadeStats()
+
+    def predict(self, image_data):
+        """
+        Mismo resultado que FishPipeline.predict; los frames rechazados por el
+        primer nivel devuelven sólo is_fish, fish_confidence y gated=True.
+        """
+        image_tensor = self.pipeline.preprocess_input(image_data)
+
+        start = time.perf_counter()
+        fish_confidence = float(self.gate.fish_confidence(image_tensor.unsqueeze(0).to(self.pipeline.device))[0])
+        rejected = fish_confidence < self.gate.threshold
+        self.stats.record("gate", time.perf_counter() - start, rejected)
+        if rejected:
+            return {"is_fish": False, "fish_confidence": fish_confidence, "gated": True}
+
+        start = time.perf_counter()
+        scores = self.pipeline.score(self.pipeline.encode_one(image_tensor))[0]
+        self.stats.record("full", time.perf_counter() - start)
+        return scores
+
+
+def check_threshold(directory, resolution, threshold, limit=None, batch_size=32):
+    """
+    Compara el primer nivel con la validación de pez completa sobre un directorio.
+
+    Un falso rechazo es una imagen con pez según el pipeline completo que el
+    primer nivel descartaría.
+    """
+    import app
+    from parity import list_images
+
+    if app.model is None:
+        print("Error: no se pudo cargar el modelo")
+        return None
+
+    pipeline = app.pipeline
+    gate = FishGate(app.model, app.text_embeddings["validation"], resolution, threshold)
+    paths = list_images(directory, limit)
+
+    images = fish = rejected = false_rejects = 0
+    gate_seconds = full_seconds = 0.0
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        image_input = pipeline.preprocess_images([Image.open(p).convert('RGB') for p in chunk])
+
+        begin = time.perf_counter()
+        gate_confidence = gate.fish_confidence(image_input)
+        gate_seconds += time.perf_counter() - begin
+        begin = time.perf_counter()
+        scores = pipeline.score(pipeline.encode(image_input))
+        full_seconds += time.perf_counter() - begin
+
+        for confidence, row in zip(gate_confidence.tolist(), scores):
+            images += 1
+            fish += int(row["is_fish"])
+            if confidence < threshold:
+                rejected += 1
+                false_rejects += int(row["is_fish"])
+
+    return {
+        "images": images,
+        "fish": fish,
+        "resolution": resolution,
+        "threshold": threshold,
+        "rejected": rejected,
+        "false_rejects": false_rejects,
+        "false_reject_rate": false_rejects / fish if fish else 0.0,
+        "gate_cost_ratio": gate_seconds / full_seconds if full_seconds else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibración del primer nivel de la cascada")
+    parser.add_argument("--check", metavar="DIR", required=True, help="Directorio de imágenes de referencia")
+    parser.add_argument("--resolution", type=int, default=96, help="Lado de la entrada del primer nivel")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Umbral de rechazo del primer nivel")
+    parser.add_argument("--limit", type=int, default=None, help="Máximo de imágenes a comparar")
+    parser.add_argument("--max-false-rejects", type=float, default=0.01,
+                        help="Fracción máxima de imágenes con pez rechazadas para dar el umbral por bueno")
+    args = parser.parse_args()
+
+    report = check_threshold(args.check, args.resolution, args.threshold, args.limit)
+    if report is None:
+        return 1
+
+    print(f"Imágenes: {report['images']} ({report['fish']} con pez según el pipeline completo)")
+    print(f"Rechazadas por el primer nivel ({args.resolution}px, umbral {args.threshold}): {report['rejected']}")
+    print(f"Falsos rechazos: {report['false_rejects']} ({report['false_reject_rate']:.2%})")
+    print(f"Coste del primer nivel: {report['gate_cost_ratio']:.0%} del forward completo")
+    if report["false_reject_rate"] > args.max_false_rejects:
+        print(f"✗ Demasiados falsos rechazos (> {args.max_false_rejects:.0%})")
+        return 1
+    print("✓ Umbral correcto")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""
+Almacén persistente de embeddings de imagen indexado por hash de contenido.
+
+Cada imagen subida guarda su embedding CLIP normalizado en un archivo binario
+append-only (float32, una fila por imagen) que se lee con np.memmap. Un índice
+de texto (una línea "sha256<TAB>nombre" por fila) relaciona cada hash con su
+fila, de modo que una imagen repetida no vuelve a pasar por encode_image. Los
+nombres de archivo adicionales de un contenido ya guardado se anotan en un
+índice de alias. Las imágenes que la retención del almacén de subidas borra se
+anotan como filas eliminadas (también append-only): dejan de encontrarse y de
+aparecer en las búsquedas, aunque su fila siga ocupando sitio en el archivo.
+
+La búsqueda de vecinos recorre el memmap por bloques, sin cargar todo el
+archivo en RAM.
+"""
+
+import os
+import threading
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class EmbeddingStore:
+    """Embeddings normalizados de las imágenes subidas, en disco y append-only"""
+
+    def __init__(self, directory, dim, dtype=np.float32):
+        self.directory = directory
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.row_bytes = self.dim * self.dtype.itemsize
+
+        os.makedirs(directory, exist_ok=True)
+        self.data_path = os.path.join(directory, 'embeddings.f32')
+        self.index_path = os.path.join(directory, 'index.tsv')
+        self.alias_path = os.path.join(directory, 'aliases.tsv')
+        self.removed_path = os.path.join(directory, 'removed.tsv')
+        self.lock_path = os.path.join(directory, '.lock')
+        for path in (self.data_path, self.index_path, self.alias_path, self.removed_path):
+            if not os.path.exists(path):
+                open(path, 'ab').close()
+
+        self._lock = threading.Lock()
+        self._rows = {}          # sha256 -> fila
+        self._hashes = []        # fila -> sha256
+        self._filenames = []     # fila -> nombre de archivo
+        self._by_filename = {}   # nombre de archivo -> fila
+        self._removed = set()    # filas eliminadas
+        self._index_offset = 0
+        self._alias_offset = 0
+        self._removed_offset = 0
+        self._memmap = None
+        self.hits = 0
+        self.misses = 0
+
+        with self._lock:
+            self._refresh()
+
+    def __len__(self):
+        return len(self._hashes) - len(self._removed)
+
+    def _refresh(self):
+        """Lee las líneas nuevas de los índices (añadidas por este u otros procesos)"""
+        self._refresh_index()
+        self._refresh_removed()
+        if os.path.getsize(self.alias_path) == self._alias_offset:
+            return
+        with open(self.alias_path, 'rb') as f:
+            f.seek(self._alias_offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                self._alias_offset += len(line)
+                content_hash, _, filename = line.decode('utf-8').rstrip('\n').partition('\t')
+                row = self._rows.get(content_hash)
+                if row is not None:
+                    self._by_filename[filename] = row
+
+    def _refresh_index(self):
+        if os.path.getsize(self.index_path) == self._index_offset:
+            return
+        # Sólo se consideran filas cuyo embedding ya está escrito por completo
+        max_rows = os.path.getsize(self.data_path) // self.row_bytes
+        with open(self.index_path, 'rb') as f:
+            f.seek(self._index_offset)
+            for line in f:
+                if not line.endswith(b'\n') or len(self._hashes) >= max_rows:
+                    break
+                self._index_offset += len(line)
+                content_hash, _, filename = line.decode('utf-8').rstrip('\n').partition('\t')
+                row = len(self._hashes)
+                self._hashes.append(content_hash)
+                self._filenames.append(filename)
+                if row in self._removed:
+                    continue
+                self._rows.setdefault(content_hash, row)
+                self._by_filename[filename] = row
+
+    def _refresh_removed(self):
+        if os.path.getsize(self.removed_path) == self._removed_offset:
+            return
+        removed = set()
+        with open(self.removed_path, 'rb') as f:
+            f.seek(self._removed_offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                self._removed_offset += len(line)
+                content_hash, _, row = line.decode('utf-8').rstrip('\n').partition('\t')
+                row = int(row)
+                removed.add(row)
+                if self._rows.get(content_hash) == row:
+                    del self._rows[content_hash]
+        self._removed |= removed
+        self._by_filename = {name: row for name, row in self._by_filename.items() if row not in removed}
+
+    def _matrix(self):
+        """Memmap de solo lectura con todas las filas conocidas"""
+        rows = len(self._hashes)
+        if rows == 0:
+            return np.empty((0, self.dim), dtype=self.dtype)
+        if self._memmap is None or self._memmap.shape[0] != rows:
+            self._memmap = np.memmap(self.data_path, dtype=self.dtype, mode='r', shape=(rows, self.dim))
+        return self._memmap
+
+    def get(self, content_hash):
+        """Embedding guardado para un hash, o None si no existe"""
+        with self._lock:
+            row = self._rows.get(content_hash)
+            if row is None:
+                self._refresh()
+                row = self._rows.get(content_hash)
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return np.array(self._matrix()[row])
+
+    def known_hashes(self):
+        """Hashes de todos los contenidos guardados"""
+        with self._lock:
+            self._refresh()
+            return list(self._rows)
+
+    def hash_for_filename(self, filename):
+        """Hash de contenido de un archivo ya indexado, o None"""
+        with self._lock:
+            self._refresh()
+            row = self._by_filename.get(filename)
+            return self._hashes[row] if row is not None else None
+
+    def add(self, content_hash, embedding, filename):
+        """
+        Añade un embedding normalizado. Si el hash ya existe sólo se anota
+        filename como alias del contenido guardado.
+        """
+        embedding = np.asarray(embedding, dtype=self.dtype).reshape(self.dim)
+        with self._lock:
+            lock_file = open(self.lock_path, 'a')
+            try:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._refresh()
+                if content_hash in self._rows:
+                    row = self._rows[content_hash]
+                    if filename not in self._by_filename:
+                        with open(self.alias_path, 'ab') as f:
+                            f.write(f"{content_hash}\t{filename}\n".encode('utf-8'))
+                        self._refresh()
+                    return row
+
+                row = len(self._hashes)
+                fd = os.open(self.data_path, os.O_WRONLY)
+                try:
+                    os.pwrite(fd, embedding.tobytes(), row * self.row_bytes)
+                finally:
+                    os.close(fd)
+                with open(self.index_path, 'ab') as f:
+                    f.write(f"{content_hash}\t{filename}\n".encode('utf-8'))
+                self._refresh()
+                return row
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+    def remove(self, content_hashes):
+        """
+        Elimina los embeddings de los hashes indicados (los que no estén se ignoran).
+
+        Returns:
+            int: embeddings eliminados
+        """
+        with self._lock:
+            lock_file = open(self.lock_path, 'a')
+            try:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._refresh()
+                rows = [(content_hash, self._rows[content_hash])
+                        for content_hash in set(content_hashes) if content_hash in self._rows]
+                if rows:
+                    with open(self.removed_path, 'ab') as f:
+                        f.write(''.join(f"{content_hash}\t{row}\n" for content_hash, row in rows).encode('utf-8'))
+                    self._refresh()
+                return len(rows)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+    def nearest(self, query, k=5, chunk_rows=65536, exclude_hash=None):
+        """
+        Busca los k embeddings más parecidos (similitud coseno) a query.
+
+        Returns:
+            list de dicts con hash, filename y similarity, de mayor a menor
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        query = query / np.linalg.norm(query)
+
+        with self._lock:
+            self._refresh()
+            matrix = self._matrix()
+            hashes = list(self._hashes)
+            filenames = list(self._filenames)
+            removed = np.array(sorted(self._removed), dtype=np.int64)
+
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, matrix.shape[0], chunk_rows):
+            scores = np.asarray(matrix[start:start + chunk_rows], dtype=np.float32) @ query
+            rows = np.arange(start, start + scores.shape[0])
+            # Las filas eliminadas no pueden quedar entre las mejores
+            dead = removed[(removed >= start) & (removed < start + scores.shape[0])]
+            scores[dead - start] = -np.inf
+            best_rows = np.concatenate([best_rows, rows])
+            best_scores = np.concatenate([best_scores, scores])
+            if best_scores.shape[0] > k + 1:
+                keep = np.argpartition(-best_scores, k + 1)[:k + 1]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+
+        removed_rows = set(removed.tolist())
+        results = []
+        for i in np.argsort(-best_scores):
+            row = int(best_rows[i])
+            if row in removed_rows or (exclude_hash is not None and hashes[row] == exclude_hash):
+                continue
+            results.append({
+                "hash": hashes[row],
+                "filename": filenames[row],
+                "similarity": float(best_scores[i])
+            })
+            if len(results) >= k:
+                break
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                "images": len(self._hashes) - len(self._removed),
+                "removed": len(self._removed),
+                "bytes": len(self._hashes) * self.row_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
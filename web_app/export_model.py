@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Exporta el codificador de imagen de CLIP a ONNX y/o TFLite.
+
+Formatos:
+- onnx: ONNX fp32 (torch.onnx.export, batch dinámico)
+- onnx-int8: ONNX con cuantización dinámica int8 de los pesos
+- tflite: TFLite fp32 (ONNX -> SavedModel con onnx2tf -> TFLiteConverter)
+- tflite-int8: TFLite con cuantización de rango dinámico
+
+Cada modelo exportado se compara con el modelo PyTorch sobre un corpus de
+imágenes (por defecto ../uploads) y se escribe un informe <modelo>.parity.json.
+Si la coincidencia de decisiones no llega al mínimo el modelo se marca como
+no apto y el servidor no lo cargará.
+
+Uso:
+    python export_model.py --format onnx onnx-int8 --output-dir exported_models
+    INFERENCE_BACKEND=onnx BACKEND_MODEL_PATH=exported_models/clip-ViT-B-32-visual.onnx python app.py
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import torch
+
+FORMATS = ("onnx", "onnx-int8", "tflite", "tflite-int8")
+ONNX_OPSET = 17
+
+
+class VisualEncoder(torch.nn.Module):
+    """Envuelve model.encode_image para exportarlo como un módulo independiente"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, image):
+        return self.model.encode_image(image)
+
+
+def export_onnx(model, path):
+    n_px = model.visual.input_resolution
+    encoder = VisualEncoder(model).float().eval()
+    dummy = torch.randn(1, 3, n_px, n_px)
+    with torch.no_grad():
+        torch.onnx.export(
+            encoder, dummy, path,
+            input_names=['image'], output_names=['features'],
+            dynamic_axes={'image': {0: 'batch'}, 'features': {0: 'batch'}},
+            opset_version=ONNX_OPSET, dynamo=False
+        )
+
+
+def quantize_onnx(source_path, path):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(source_path, path, weight_type=QuantType.QInt8)
+
+
+def export_tflite(onnx_path, path, int8=False):
+    import onnx2tf
+    import tensorflow as tf
+
+    saved_model_dir = tempfile.mkdtemp(prefix='clip-savedmodel-')
+    try:
+        onnx2tf.convert(input_onnx_file_path=onnx_path, output_folder_path=saved_model_dir, non_verbose=True)
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+        if int8:
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        with open(path, 'wb') as f:
+            f.write(converter.convert())
+    finally:
+        shutil.rmtree(saved_model_dir, ignore_errors=True)
+
+
+def check_parity(app, backend, paths, batch_size=16, min_agreement=0.98):
+    """Compara el backend exportado con el modelo PyTorch sobre las imágenes dadas"""
+    from parity import compare_encoders
+
+    return compare_encoders(app.model, backend, app.preprocess, paths, app.pipeline.score,
+                            app.device, batch_size, min_agreement)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta el codificador de imagen de CLIP a ONNX/TFLite")
+    parser.add_argument("--format", nargs='+', choices=FORMATS, default=["onnx"], help="Formatos a exportar")
+    parser.add_argument("--output-dir", default="exported_models", help="Directorio de salida")
+    parser.add_argument("--corpus", default=os.path.join('..', 'uploads'),
+                        help="Imágenes para la comprobación de paridad")
+    parser.add_argument("--limit", type=int, default=None, help="Máximo de imágenes a comparar")
+    parser.add_argument("--min-agreement", type=float, default=0.98,
+                        help="Coincidencia mínima de decisiones para aceptar el modelo")
+    args = parser.parse_args()
+
+    # El exportador siempre parte del modelo PyTorch
+    os.environ['INFERENCE_BACKEND'] = 'torch'
+    import app
+    from backends import OnnxBackend, TFLiteBackend, parity_report_path
+    from parity import list_images, print_summary
+
+    if app.model is None:
+        print("Error: no se pudo cargar el modelo")
+        return 1
+
+    paths = list_images(args.corpus, args.limit)
+    if not paths:
+        print(f"Error: no hay imágenes en {args.corpus} para comprobar la paridad")
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    base = os.path.join(args.output_dir, f"clip-{app.MODEL_NAME.replace('/', '-')}-visual")
+    onnx_path = base + '.onnx'
+    # Los formatos cuantizados y TFLite se generan a partir del ONNX fp32
+    print(f"Exportando ONNX: {onnx_path}")
+    export_onnx(app.model, onnx_path)
+
+    failed = False
+    for fmt in args.format:
+        if fmt == "onnx":
+            path = onnx_path
+        elif fmt == "onnx-int8":
+            path = base + '-int8.onnx'
+            print(f"Cuantizando ONNX int8: {path}")
+            quantize_onnx(onnx_path, path)
+        else:
+            path = base + ('-int8.tflite' if fmt == 'tflite-int8' else '.tflite')
+            print(f"Convirtiendo a TFLite: {path}")
+            try:
+                export_tflite(onnx_path, path, int8=fmt == 'tflite-int8')
+            except ImportError as e:
+                print(f"Error: la exportación a TFLite requiere onnx2tf y tensorflow ({e})")
+                failed = True
+                continue
+
+        backend = OnnxBackend(path) if path.endswith('.onnx') else TFLiteBackend(path)
+        print(f"\nParidad de {fmt} frente a PyTorch:")
+        report = check_parity(app, backend, paths, min_agreement=args.min_agreement)
+        report["format"] = fmt
+        report["model_name"] = app.MODEL_NAME
+        report["size_bytes"] = os.path.getsize(path)
+        print_summary(report)
+        with open(parity_report_path(path), 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+        if report["passed"]:
+            print(f"Usar con: INFERENCE_BACKEND={fmt.split('-')[0]} BACKEND_MODEL_PATH={path}")
+        else:
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
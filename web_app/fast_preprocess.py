@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Preprocesado rápido equivalente al `preprocess` de CLIP.
+
+- Decodificación reducida: en JPEG se usa Image.draft() para que libjpeg
+  decodifique directamente a 1/2, 1/4 u 1/8 de resolución, sin bajar del
+  tamaño necesario para el recorte de entrada del modelo.
+- Resize + center crop + normalize vectorizados con torch: las imágenes del
+  mismo tamaño se procesan juntas en un solo batch.
+
+La salida debe coincidir con la de CLIP salvo pequeñas diferencias de
+interpolación. Para comprobarlo sobre un directorio de imágenes:
+
+    python fast_preprocess.py --check ../uploads
+"""
+
+import argparse
+import io
+import math
+import sys
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+# Normalización de CLIP
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+class FastPreprocessor:
+    """Sustituto de `preprocess` con decodificación reducida y batch vectorizado"""
+
+    def __init__(self, n_px=224):
+        self.n_px = n_px
+        self.mean = torch.tensor(CLIP_MEAN).view(1, 3, 1, 1)
+        self.std = torch.tensor(CLIP_STD).view(1, 3, 1, 1)
+
+    def decode(self, image_data):
+        """Decodifica bytes, una ruta o un archivo a RGB, a resolución reducida si es JPEG"""
+        if isinstance(image_data, (bytes, bytearray)):
+            image_data = io.BytesIO(image_data)
+        image = Image.open(image_data)
+        width, height = image.size
+        short = min(width, height)
+        if short > self.n_px:
+            # draft() elige la mayor reducción que mantiene ambos lados >= lo pedido
+            image.draft('RGB', (math.ceil(self.n_px * width / short), math.ceil(self.n_px * height / short)))
+        return image.convert('RGB')
+
+    def _resize_crop(self, batch):
+        """batch uint8 [B, H, W, 3] del mismo tamaño -> float [B, 3, n_px, n_px] en [0, 1]"""
+        _, height, width, _ = batch.shape
+        x = batch.permute(0, 3, 1, 2).float()
+
+        # Como torchvision Resize(n_px): el lado corto pasa a n_px
+        if width <= height:
+            new_w, new_h = self.n_px, int(self.n_px * height / width)
+        else:
+            new_w, new_h = int(self.n_px * width / height), self.n_px
+        if (new_h, new_w) != (height, width):
+            x = F.interpolate(x, size=(new_h, new_w), mode='bicubic', align_corners=False, antialias=True)
+            # PIL redondea y satura a uint8 tras interpolar
+            x = x.round().clamp(0, 255)
+
+        # Como torchvision CenterCrop(n_px)
+        top = int(round((new_h - self.n_px) / 2.0))
+        left = int(round((new_w - self.n_px) / 2.0))
+        x = x[:, :, top:top + self.n_px, left:left + self.n_px]
+        return x / 255.0
+
+    def batch(self, images):
+        """Preprocesa una lista de imágenes PIL RGB y devuelve [B, 3, n_px, n_px]"""
+        out = torch.empty(len(images), 3, self.n_px, self.n_px)
+
+        # Agrupar por tamaño para hacer cada resize en un solo batch
+        groups = {}
+        for i, image in enumerate(images):
+            groups.setdefault(image.size, []).append(i)
+        for indices in groups.values():
+            pixels = torch.from_numpy(np.stack([np.asarray(images[i].convert('RGB')) for i in indices]))
+            out[indices] = self._resize_crop(pixels)
+
+        return (out - self.mean) / self.std
+
+    def __call__(self, image):
+        """Misma interfaz que `preprocess`: imagen PIL -> tensor [3, n_px, n_px]"""
+        return self.batch([image])[0]
+
+
+def check_parity(directory, limit=None, batch_size=32, min_agreement=None):
+    """
+    Compara FastPreprocessor con el preprocess de CLIP sobre un directorio.
+
+    Reporta diferencias de los tensores, similitud coseno de los embeddings y
+    coincidencia de las decisiones (pez, especie y cultivada/salvaje).
+    """
+    import app
+    from parity import ParityReport, list_images
+
+    if app.model is None:
+        print("Error: no se pudo cargar el modelo")
+        return None
+
+    paths = list_images(directory, limit)
+    fast = FastPreprocessor(app.model.visual.input_resolution)
+    pipeline = app.pipeline
+    parity = ParityReport(pipeline.score)
+
+    max_diff = 0.0
+    mean_diffs = []
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        reference = torch.stack([app.preprocess(Image.open(p).convert('RGB')) for p in chunk])
+        candidate = fast.batch([fast.decode(p) for p in chunk])
+
+        diff = (reference - candidate).abs()
+        max_diff = max(max_diff, float(diff.max()))
+        mean_diffs.extend(diff.flatten(1).mean(dim=1).tolist())
+        parity.add(pipeline.encode(reference), pipeline.encode(candidate))
+
+    report = parity.summary(min_agreement)
+    report["tensor_max_abs_diff"] = max_diff
+    report["tensor_mean_abs_diff"] = float(np.mean(mean_diffs)) if mean_diffs else 0.0
+    return report
+
+
+def main():
+    from parity import print_summary
+
+    parser = argparse.ArgumentParser(description="Paridad del preprocesado rápido frente al de CLIP")
+    parser.add_argument("--check", metavar="DIR", required=True, help="Directorio de imágenes de referencia")
+    parser.add_argument("--limit", type=int, default=None, help="Máximo de imágenes a comparar")
+    parser.add_argument("--min-agreement", type=float, default=0.98,
+                        help="Coincidencia mínima de decisiones para dar la paridad por buena")
+    args = parser.parse_args()
+
+    report = check_parity(args.check, args.limit, min_agreement=args.min_agreement)
+    if report is None:
+        return 1
+
+    print(f"Diferencia de tensores - máx: {report['tensor_max_abs_diff']:.4f}, media: {report['tensor_mean_abs_diff']:.5f}")
+    print_summary(report)
+    return 0 if report["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
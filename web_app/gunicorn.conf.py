@@ -0,0 +1,48 @@
+"""
+Configuración de gunicorn para producción:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+El modelo se carga una sola vez en el proceso maestro (preload_app) y los
+workers lo heredan con el fork, compartiendo los pesos copy-on-write.
+"""
+
+import gc
+import os
+
+import serving
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+
+cpus = serving.available_cpus()
+workers = int(os.environ.get('WEB_WORKERS', '0')) or serving.default_workers(cpus)
+# Hilos por worker para atender peticiones (las WebSocket ocupan uno mientras duran).
+# Las codificaciones se agrupan en el hilo del MicroBatcher, así que no compiten entre sí.
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', '8'))
+torch_threads = int(os.environ.get('TORCH_THREADS', '0')) or serving.threads_per_worker(workers, cpus)
+
+preload_app = True
+timeout = int(os.environ.get('WEB_TIMEOUT', '120'))
+graceful_timeout = 30
+accesslog = '-'
+
+# Antes de cargar la app: el maestro ya usa el número de hilos de un worker,
+# también para el backend ONNX/TFLite si INFERENCE_THREADS no está fijado
+serving.configure_torch_threads(torch_threads)
+
+
+def when_ready(server):
+    # Mover los objetos ya creados (modelo, prompts...) a la generación permanente:
+    # el recolector no los recorre en los workers y sus páginas siguen compartidas
+    gc.freeze()
+    server.log.info(f"{workers} workers × {torch_threads} hilos de torch ({cpus} núcleos disponibles)")
+
+
+def post_fork(server, worker):
+    serving.configure_torch_threads(torch_threads)
+    # Calentar los pools de hilos del worker (y la sesión ONNX/TFLite) antes de aceptar peticiones
+    import app as web_app
+    if web_app.WARMUP and web_app.ready:
+        # Si el forward falla en el worker, su /readyz responde 503
+        web_app.ready = web_app.warmup()
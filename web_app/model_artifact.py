@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Artefacto serializado del modelo CLIP para arrancar en frío rápido.
+
+clip.load descarga el archivo TorchScript de OpenAI, lo carga y reconstruye
+el modelo cada vez que arranca el servidor. El artefacto es el modelo ya
+construido y en modo eval guardado con torch.save; se carga con mmap, así que
+arrancar apenas lee el disco y los workers comparten las páginas del archivo.
+
+Con IMAGE_ONLY=1 se guarda además un artefacto sin la torre de texto
+(models/clip-ViT-B-32-image-only.pt). Liberar la torre de un modelo cargado con
+mmap apenas reduce el RSS, porque sus páginas nunca se llegaron a leer; cargar
+directamente el artefacto sólo imagen sí evita tenerla en memoria.
+
+Para generarlos (lo hace el Dockerfile al construir la imagen), junto con la
+caché de embeddings de texto:
+
+    MODEL_ARTIFACT=models/clip-ViT-B-32.pt IMAGE_ONLY=1 python model_artifact.py
+"""
+
+import os
+import sys
+
+import torch
+from clip.clip import _transform
+
+
+def image_only_path(path):
+    """Ruta del artefacto sin torre de texto que corresponde a un artefacto completo"""
+    root, ext = os.path.splitext(path)
+    return f"{root}-image-only{ext}"
+
+
+def save_artifact(model, path):
+    """Guarda el modelo completo de forma atómica"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    torch.save(model, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_artifact(path, device):
+    """
+    Carga un artefacto guardado con save_artifact.
+
+    Returns:
+        tuple: (model, preprocess), como clip.load
+    """
+    model = torch.load(path, map_location='cpu', mmap=True, weights_only=False)
+    if str(device) == 'cpu':
+        # Igual que clip.load en CPU (no copia si ya está en float32)
+        model.float()
+    else:
+        model.to(device)
+    model.eval()
+    return model, _transform(model.visual.input_resolution)
+
+
+def main():
+    if not os.environ.get('MODEL_ARTIFACT'):
+        print("Error: define MODEL_ARTIFACT con la ruta del artefacto a generar")
+        return 1
+    # Importar la app carga el modelo con clip.load, guarda el artefacto y
+    # precalcula la caché de embeddings de texto
+    import app
+
+    if app.model is None:
+        return 1
+    print(f"Artefacto del modelo: {app.MODEL_ARTIFACT}")
+    if app.IMAGE_ONLY:
+        print(f"Artefacto sólo imagen: {image_only_path(app.MODEL_ARTIFACT)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
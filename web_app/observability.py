@@ -0,0 +1,231 @@
+"""
+Métricas en formato Prometheus y logging estructurado con muestreo.
+
+Las métricas se registran a nivel de módulo (como en prometheus_client) y se
+exponen en texto plano en /metrics. Con gunicorn cada worker lleva las suyas y
+cada consulta las devuelve de un worker; el pid de ese worker aparece en la
+etiqueta `pid` de fish_model_info.
+
+El log de cada petición es una línea JSON que sólo se emite para una fracción
+de las peticiones (LOG_SAMPLE_RATE), para no frenar el camino caliente con
+escrituras a stdout. Los errores se registran siempre.
+"""
+
+import bisect
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items
+        ]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items
+        ]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, ([*state[0]], state[1], state[2])) for key, state in self._values.items())
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    'fish_http_requests_total', 'Peticiones HTTP atendidas', ('endpoint', 'method', 'status')))
+HTTP_ERRORS = REGISTRY.register(Counter(
+    'fish_http_request_errors_total', 'Peticiones HTTP con error del servidor (5xx)', ('endpoint',)))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    'fish_http_request_duration_seconds', 'Latencia de las peticiones HTTP', ('endpoint',)))
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    'fish_stage_duration_seconds', 'Duración de cada etapa del pipeline de inferencia', ('stage',)))
+BATCH_SIZE = REGISTRY.register(Histogram(
+    'fish_encode_batch_size', 'Imágenes por forward del codificador de imagen', buckets=BATCH_BUCKETS))
+UPLOAD_WRITE_LATENCY = REGISTRY.register(Histogram(
+    'fish_upload_write_duration_seconds', 'Duración de la escritura de cada imagen subida'))
+RESULT_CACHE_REQUESTS = REGISTRY.register(Counter(
+    'fish_result_cache_requests_total', 'Consultas a la caché de predicciones', ('result',)))
+RESULT_CACHE_EVICTIONS = REGISTRY.register(Counter(
+    'fish_result_cache_evictions_total', 'Entradas descartadas de la caché de predicciones', ('reason',)))
+CASCADE_FRAMES = REGISTRY.register(Counter(
+    'fish_cascade_frames_total', 'Frames evaluados por cada nivel de la cascada de tiempo real', ('tier', 'outcome')))
+ADMISSION_WAIT = REGISTRY.register(Histogram(
+    'fish_admission_wait_seconds', 'Espera hasta obtener un hueco de inferencia', ('priority',)))
+ADMISSION_SHED = REGISTRY.register(Counter(
+    'fish_admission_shed_total', 'Peticiones descartadas por falta de capacidad de inferencia', ('priority',)))
+MODEL_INFO = REGISTRY.register(Gauge(
+    'fish_model_info', 'Modelo cargado (valor 1)', ('model', 'device', 'backend', 'pid')))
+STATE = REGISTRY.register(Gauge(
+    'fish_state', 'Estado interno en el momento de la consulta', ('name',)))
+
+
+def rss_bytes():
+    """Memoria residente (RSS) del proceso en bytes, o None si no hay /proc"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def stage(name):
+    """Context manager que mide una etapa del pipeline (decode, preprocess, encode_image...)"""
+    return STAGE_LATENCY.time(stage=name)
+
+
+def render(state=None):
+    """
+    Texto de /metrics.
+
+    Args:
+        state: dict nombre -> valor con el estado actual (colas, almacén...)
+    """
+    for name, value in (state or {}).items():
+        if value is not None:
+            STATE.set(value, name=name)
+    return REGISTRY.render()
+
+
+# Logging estructurado con muestreo
+
+logger = logging.getLogger('fish')
+_sample_rate = 1.0
+
+
+def configure_logging(sample_rate):
+    """Fija la fracción de peticiones que se registran (0 lo desactiva)"""
+    global _sample_rate
+    _sample_rate = sample_rate
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+
+def log_event(event, sampled=True, level=logging.INFO, exc_info=False, **fields):
+    """
+    Emite una línea JSON con el evento y sus campos.
+
+    Los eventos muestreados sólo se emiten con probabilidad LOG_SAMPLE_RATE;
+    los no muestreados (errores) siempre.
+    """
+    if sampled and (_sample_rate <= 0 or (_sample_rate < 1 and random.random() >= _sample_rate)):
+        return
+    record = {"ts": round(time.time(), 3), "event": event, "pid": os.getpid(), **fields}
+    logger.log(level, json.dumps(record, ensure_ascii=False, default=str), exc_info=exc_info)
@@ -0,0 +1,101 @@
+"""
+Comprobación de paridad de decisiones entre dos variantes de inferencia.
+
+Compara los embeddings de imagen de una variante de referencia (el modelo
+PyTorch fp32 con el preprocess de CLIP) con los de una candidata (otro
+preprocesado, un modelo exportado, cuantizado...) y cuenta cuántas veces
+coinciden las decisiones de la aplicación: hay pez, especie y
+cultivada/salvaje.
+"""
+
+import numpy as np
+import torch
+from PIL import Image
+
+from upload_store import list_archive
+
+DECISIONS = ("is_fish", "species_id", "predicted_class")
+
+
+def list_images(directory, limit=None):
+    """Imágenes de un directorio de subidas (archivos sueltos y almacén por hash), en orden"""
+    paths = list_archive(directory)
+    return paths[:limit] if limit else paths
+
+
+class ParityReport:
+    """Acumula la comparación de embeddings y decisiones batch a batch"""
+
+    def __init__(self, score_fn):
+        """
+        Args:
+            score_fn: Función embeddings [B, dim] -> list de dicts de FishPipeline.score
+        """
+        self.score_fn = score_fn
+        self.cosines = []
+        self.agree = {key: 0 for key in DECISIONS}
+        self.images = 0
+
+    def add(self, reference_features, candidate_features):
+        reference_features = reference_features.float()
+        candidate_features = candidate_features.float().to(reference_features.device)
+        self.cosines.extend((reference_features * candidate_features).sum(dim=-1).cpu().tolist())
+        for ref, new in zip(self.score_fn(reference_features), self.score_fn(candidate_features)):
+            for key in DECISIONS:
+                self.agree[key] += int(ref[key] == new[key])
+        self.images += reference_features.shape[0]
+
+    def summary(self, min_agreement=None):
+        """Dict con similitud coseno, coincidencia por decisión y si pasa el umbral"""
+        total = self.images
+        agreement = {key: value / total if total else 1.0 for key, value in self.agree.items()}
+        summary = {
+            "images": total,
+            "embedding_cosine_min": float(np.min(self.cosines)) if total else 1.0,
+            "embedding_cosine_mean": float(np.mean(self.cosines)) if total else 1.0,
+            "agreement": agreement
+        }
+        if min_agreement is not None:
+            summary["min_agreement"] = min_agreement
+            summary["passed"] = min(agreement.values()) >= min_agreement
+        return summary
+
+
+def print_summary(summary):
+    print(f"Imágenes comparadas: {summary['images']}")
+    print(f"Similitud coseno de embeddings - mín: {summary['embedding_cosine_min']:.5f}, media: {summary['embedding_cosine_mean']:.5f}")
+    for key, value in summary["agreement"].items():
+        print(f"Coincidencia {key}: {value:.2%}")
+    if "passed" in summary:
+        if summary["passed"]:
+            print("✓ Paridad correcta")
+        else:
+            print(f"✗ Paridad insuficiente (< {summary['min_agreement']:.0%})")
+
+
+def compare_encoders(reference, candidate, preprocess, paths, score_fn, device='cpu', batch_size=16,
+                     min_agreement=None):
+    """
+    Compara dos codificadores de imagen (con encode_image) sobre unas imágenes.
+
+    Args:
+        reference: Codificador de referencia (el modelo CLIP fp32)
+        candidate: Codificador a validar
+        preprocess: Preprocesado común a ambos
+        score_fn: Función embeddings -> list de dicts de FishPipeline.score
+
+    Returns:
+        dict: ParityReport.summary
+    """
+    parity = ParityReport(score_fn)
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        image_input = torch.stack([preprocess(Image.open(p).convert('RGB')) for p in chunk]).to(device)
+        with torch.no_grad():
+            reference_features = reference.encode_image(image_input).float()
+            candidate_features = candidate.encode_image(image_input).float().to(reference_features.device)
+        parity.add(
+            reference_features / reference_features.norm(dim=-1, keepdim=True),
+            candidate_features / candidate_features.norm(dim=-1, keepdim=True)
+        )
+    return parity.summary(min_agreement)
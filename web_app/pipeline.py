@@ -0,0 +1,188 @@
+"""
+Pipeline de inferencia fusionado.
+
+Cada imagen se decodifica y se codifica con CLIP una sola vez. Las tres etapas
+(validación de pez, detección de especie y clasificación cultivada/salvaje) se
+puntúan con una única multiplicación contra la matriz apilada de embeddings de
+clase, aplicando después el softmax por separado sobre el tramo de cada etapa.
+
+Además de archivos de imagen, predict acepta el formato compacto de tiempo
+real: píxeles RGB uint8 crudos de n_px×n_px ya recortados al centro, que se
+normalizan directamente sin decodificar ni redimensionar.
+"""
+
+import io
+import math
+
+import numpy as np
+import torch
+from PIL import Image
+
+from fast_preprocess import CLIP_MEAN, CLIP_STD, FastPreprocessor
+from observability import BATCH_SIZE, stage
+
+# Orden de los tramos dentro de la matriz apilada de embeddings
+STAGES = ("validation", "species", "dorada", "lubina")
+
+# Umbral de confianza para considerar que hay un pez
+FISH_THRESHOLD = 0.5
+
+# Cabeceras de los formatos de imagen aceptados; el resto se interpreta como RGB crudo
+IMAGE_SIGNATURES = (b'\xff\xd8', b'\x89PNG', b'BM', b'RIFF', b'GIF8')
+
+
+def raw_frame_size(image_data):
+    """Lado n si image_data son píxeles RGB uint8 crudos de n×n; None si es un archivo de imagen"""
+    if not isinstance(image_data, (bytes, bytearray)) or image_data.startswith(IMAGE_SIGNATURES):
+        return None
+    side = math.isqrt(len(image_data) // 3)
+    if side > 0 and side * side * 3 == len(image_data):
+        return side
+    return None
+
+
+class RawFrameSizeError(ValueError):
+    """Frame RGB crudo con un lado distinto al de entrada del modelo"""
+
+
+class FishPipeline:
+    """Decodifica, codifica y puntúa imágenes contra todos los prompts a la vez"""
+
+    def __init__(self, model, preprocess, device, text_embeddings, num_dorada_prompts, encoder=None):
+        self.model = model
+        # Codificador de imagen: el propio modelo o un backend exportado (ver backends.py)
+        self.encoder = encoder if encoder is not None else model
+        self.preprocess = preprocess
+        self.device = device
+        self.num_dorada_prompts = num_dorada_prompts
+        self.input_resolution = model.visual.input_resolution
+        self.mean = torch.tensor(CLIP_MEAN).view(3, 1, 1)
+        self.std = torch.tensor(CLIP_STD).view(3, 1, 1)
+        # MicroBatcher opcional que agrupa las codificaciones concurrentes
+        self.batcher = None
+
+        # Matriz [n_prompts_total, dim] con todos los conjuntos apilados
+        self.class_embeddings = torch.cat([text_embeddings[name] for name in STAGES])
+        self.slices = {}
+        offset = 0
+        for name in STAGES:
+            size = text_embeddings[name].shape[0]
+            self.slices[name] = slice(offset, offset + size)
+            offset += size
+
+    def decode(self, image_data):
+        """Decodifica bytes, una ruta o un archivo abierto a una imagen RGB"""
+        with stage('decode'):
+            if isinstance(self.preprocess, FastPreprocessor):
+                return self.preprocess.decode(image_data)
+            if isinstance(image_data, (bytes, bytearray)):
+                image_data = io.BytesIO(image_data)
+            return Image.open(image_data).convert('RGB')
+
+    def preprocess_images(self, images):
+        """Aplica el preprocess de CLIP y apila las imágenes en un batch"""
+        with stage('preprocess'):
+            if isinstance(self.preprocess, FastPreprocessor):
+                return self.preprocess.batch(images).to(self.device)
+            return torch.stack([self.preprocess(image) for image in images]).to(self.device)
+
+    def preprocess_one(self, image):
+        """Aplica el preprocess a una imagen y devuelve un tensor [3, H, W]"""
+        with stage('preprocess'):
+            return self.preprocess(image)
+
+    def preprocess_raw(self, image_data):
+        """Píxeles RGB uint8 crudos de n_px×n_px -> tensor normalizado [3, n_px, n_px]"""
+        side = raw_frame_size(image_data)
+        if side != self.input_resolution:
+            raise RawFrameSizeError(f"Frame RGB crudo de {side}x{side}; el modelo espera "
+                             f"{self.input_resolution}x{self.input_resolution}")
+        with stage('preprocess'):
+            pixels = torch.frombuffer(bytearray(image_data), dtype=torch.uint8).view(side, side, 3)
+            return (pixels.permute(2, 0, 1).float() / 255.0 - self.mean) / self.std
+
+    def encode(self, image_input):
+        """Codifica un batch preprocesado y devuelve embeddings normalizados"""
+        BATCH_SIZE.observe(image_input.shape[0])
+        with torch.no_grad(), stage('encode_image'):
+            image_features = self.encoder.encode_image(image_input.to(self.device))
+            image_features = image_features.to(self.device, self.class_embeddings.dtype)
+            image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+        return image_features
+
+    def encode_one(self, image_tensor):
+        """Codifica un tensor [3, H, W], pasando por el batcher si está activo"""
+        if self.batcher is not None:
+            return self.batcher.encode(image_tensor).unsqueeze(0)
+        return self.encode(image_tensor.unsqueeze(0))
+
+    def score(self, image_features):
+        """
+        Puntúa un batch de embeddings contra todas las etapas.
+
+        Returns:
+            list de dicts (uno por imagen) con los resultados de las tres etapas
+        """
+        with torch.no_grad(), stage('score'):
+            logits = (100.0 * image_features @ self.class_embeddings.T).float()
+            stage_probs = {
+                name: logits[:, self.slices[name]].softmax(dim=-1).cpu().numpy()
+                for name in STAGES
+            }
+
+        return [
+            self._score_row({name: probs[i] for name, probs in stage_probs.items()})
+            for i in range(logits.shape[0])
+        ]
+
+    def _score_row(self, probs):
+        fish_confidence = float(probs["validation"][0])
+
+        # Promediar las probabilidades de cada especie (ensemble) y normalizar
+        dorada_prob = np.mean(probs["species"][:self.num_dorada_prompts])
+        lubina_prob = np.mean(probs["species"][self.num_dorada_prompts:])
+        total = dorada_prob + lubina_prob
+        dorada_prob_norm = dorada_prob / total
+        lubina_prob_norm = lubina_prob / total
+
+        if dorada_prob_norm > lubina_prob_norm:
+            species_id = 0
+            species_confidence = float(dorada_prob_norm)
+        else:
+            species_id = 1
+            species_confidence = float(lubina_prob_norm)
+
+        # Clasificar con los prompts de la especie detectada
+        class_probs = probs["dorada"] if species_id == 0 else probs["lubina"]
+        predicted_class = int(np.argmax(class_probs))
+
+        return {
+            "is_fish": fish_confidence > FISH_THRESHOLD,
+            "fish_confidence": fish_confidence,
+            "species_id": species_id,
+            "species_confidence": species_confidence,
+            "species_probabilities": {
+                "dorada": species_confidence if species_id == 0 else (1 - species_confidence),
+                "lubina": species_confidence if species_id == 1 else (1 - species_confidence)
+            },
+            "predicted_class": predicted_class,
+            "confidence": float(class_probs[predicted_class]),
+            "probabilities": {
+                "cultivada": float(class_probs[0]),
+                "salvaje": float(class_probs[1])
+            }
+        }
+
+    def predict_images(self, images):
+        """Preprocesa, codifica y puntúa una lista de imágenes PIL"""
+        return self.score(self.encode(self.preprocess_images(images)))
+
+    def preprocess_input(self, image_data):
+        """Decodifica y preprocesa una sola imagen (archivo o RGB crudo) a un tensor [3, H, W]"""
+        if raw_frame_size(image_data) is not None:
+            return self.preprocess_raw(image_data)
+        return self.preprocess_one(self.decode(image_data))
+
+    def predict(self, image_data):
+        """Ejecuta el pipeline completo sobre una sola imagen (archivo o RGB crudo)"""
+        return self.score(self.encode_one(self.preprocess_input(image_data)))[0]
@@ -0,0 +1,155 @@
+"""
+Almacén persistente de embeddings de texto de CLIP.
+
+Los prompts de la aplicación son fijos, así que sus embeddings se calculan una
+sola vez y se guardan en disco como un array float32 ya normalizado. El nombre
+del archivo incluye el modelo y un hash del texto de todos los prompts, de modo
+que un reinicio reutiliza el archivo y sólo se recalcula cuando algún prompt
+cambia.
+
+Como los prompts no cambian en ejecución, en modo sólo imagen
+(drop_text_tower) la torre de texto de CLIP se libera tras calcular los
+embeddings y el servicio responde sólo con ellos.
+"""
+
+import ctypes
+import gc
+import hashlib
+import os
+
+import clip
+import numpy as np
+import torch
+
+from observability import rss_bytes, stage
+
+# Atributos del modelo CLIP que sólo usa encode_text
+TEXT_TOWER = ("transformer", "token_embedding", "positional_embedding", "ln_final", "text_projection")
+
+
+def prompt_key(model_name, prompt_sets):
+    """Hash estable del modelo y de los conjuntos de prompts (en orden)"""
+    digest = hashlib.sha256()
+    digest.update(model_name.encode('utf-8'))
+    for name, prompts in prompt_sets.items():
+        digest.update(b'\x00' + name.encode('utf-8'))
+        for prompt in prompts:
+            digest.update(b'\x01' + prompt.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _cache_prefix(model_name):
+    slug = model_name.replace('/', '-').replace('@', '-')
+    return f"text-embeddings-{slug}-"
+
+
+def encode_prompts(model, prompts, device):
+    """Codifica una lista de prompts y devuelve un array float32 normalizado"""
+    if not has_text_tower(model):
+        raise RuntimeError("El modelo no tiene torre de texto (modo sólo imagen, IMAGE_ONLY=1)")
+    text_tokens = clip.tokenize(prompts).to(device)
+    with torch.no_grad(), stage('encode_text'):
+        text_features = model.encode_text(text_tokens).float()
+        text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+    return text_features.cpu().numpy()
+
+
+def load_text_embeddings(model, model_name, prompt_sets, cache_dir, device):
+    """
+    Devuelve los embeddings normalizados de cada conjunto de prompts.
+
+    Args:
+        model: Modelo CLIP cargado
+        model_name: Nombre del modelo (forma parte de la clave de caché)
+        prompt_sets: dict nombre -> lista de prompts
+        cache_dir: Carpeta donde se guardan los arrays
+        device: Dispositivo donde dejar los tensores
+
+    Returns:
+        dict nombre -> tensor [n_prompts, dim] en el dispositivo y dtype del modelo
+    """
+    key = prompt_key(model_name, prompt_sets)
+    prefix = _cache_prefix(model_name)
+    cache_path = os.path.join(cache_dir, f"{prefix}{key[:16]}.npy")
+
+    all_prompts = [prompt for prompts in prompt_sets.values() for prompt in prompts]
+    embeddings = None
+
+    if os.path.exists(cache_path):
+        try:
+            embeddings = np.load(cache_path)
+            if embeddings.shape[0] != len(all_prompts):
+                embeddings = None
+        except (OSError, ValueError):
+            embeddings = None
+        if embeddings is not None:
+            print(f"Embeddings de texto cargados desde caché: {cache_path}")
+
+    if embeddings is None:
+        print("Calculando embeddings de texto de los prompts...")
+        embeddings = encode_prompts(model, all_prompts, device)
+
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, embeddings)
+        os.replace(tmp_path, cache_path)
+
+        # Eliminar cachés antiguas del mismo modelo (prompts anteriores)
+        for name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, name)
+            if name.startswith(prefix) and name.endswith('.npy') and path != cache_path:
+                os.remove(path)
+        print(f"Embeddings de texto guardados en: {cache_path}")
+
+    tensor = torch.from_numpy(embeddings).to(device=device, dtype=model.dtype)
+
+    text_embeddings = {}
+    offset = 0
+    for name, prompts in prompt_sets.items():
+        text_embeddings[name] = tensor[offset:offset + len(prompts)]
+        offset += len(prompts)
+    return text_embeddings
+
+
+def has_text_tower(model):
+    return getattr(model, "transformer", None) is not None
+
+
+def drop_text_tower(model):
+    """
+    Libera la torre de texto del modelo (transformer, embeddings de tokens y
+    posicionales, ln_final y proyección). Después el modelo sólo sirve para
+    encode_image; los embeddings de texto deben estar ya calculados.
+
+    Con un artefacto cargado con mmap, los pesos de texto que nunca se leyeron
+    no estaban en memoria, así que el ahorro de RSS puede ser casi nulo; para
+    eso está el artefacto sólo imagen (ver model_artifact.py).
+
+    Returns:
+        dict con los bytes de parámetros liberados y el RSS antes y después
+    """
+    rss_before = rss_bytes()
+    freed = 0
+    for name in TEXT_TOWER:
+        value = getattr(model, name, None)
+        if value is None:
+            continue
+        tensors = value.parameters() if isinstance(value, torch.nn.Module) else [value]
+        freed += sum(t.numel() * t.element_size() for t in tensors)
+        setattr(model, name, None)
+
+    gc.collect()
+    # Devolver al sistema la memoria liberada que glibc retiene en sus arenas
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+    rss_after = rss_bytes()
+
+    return {
+        "parameters_freed_bytes": freed,
+        "rss_before_bytes": rss_before,
+        "rss_after_bytes": rss_after,
+        "rss_saved_bytes": rss_before - rss_after if rss_before is not None and rss_after is not None else None
+    }
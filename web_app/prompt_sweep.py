@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Evaluación vectorizada de conjuntos de prompts sobre imágenes etiquetadas.
+
+Sustituye a ajustar a mano TEXT_LABELS_DORADA, TEXT_LABELS_LUBINA y los
+prompts de especie en el notebook: las imágenes se codifican una sola vez
+(con caché en disco, sólo se codifican las nuevas) y cada prompt distinto se
+codifica una vez aunque aparezca en muchos candidatos. La similitud de todas
+las imágenes con todos los prompts es una sola multiplicación de matrices; a
+partir de ella cada candidato se puntúa con índices sobre esa matriz, con el
+mismo criterio que FishPipeline (ensemble de especie y prompts de
+cultivada/salvaje de la especie detectada).
+
+El conjunto etiquetado sigue la estructura del dataset del notebook: la
+especie en una carpeta (S_Aurata/dorada, D_labrax/lubina) y la clase en la
+carpeta de la imagen (C/cultivada, S/salvaje), p. ej. D_labrax/test/C/x.jpg.
+
+Los candidatos son un JSON con una lista de conjuntos o un dict de
+alternativas cuyo producto cartesiano se evalúa. Claves: dorada y lubina
+([cultivada, salvaje]), species_dorada y species_lubina (ensemble); las que
+falten toman los prompts actuales de app.py:
+
+    python prompt_sweep.py /data/Dataset_I_Seg --candidates candidates.json --top 10
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+from upload_store import IMAGE_EXTENSIONS
+
+# Carpetas de especie y clase (en minúsculas) -> id, como SPECIES_NAMES y CLASS_NAMES de app.py
+SPECIES_DIRS = {"s_aurata": 0, "dorada": 0, "d_labrax": 1, "lubina": 1}
+CLASS_DIRS = {"c": 0, "cultivada": 0, "s": 1, "salvaje": 1}
+
+PROMPT_KEYS = ("dorada", "lubina", "species_dorada", "species_lubina")
+
+
+def find_labelled_images(root):
+    """Lista ordenada de (ruta, species_id, class_id) de las imágenes etiquetadas bajo root"""
+    items = []
+    for dirpath, _, filenames in os.walk(root):
+        parts = [part.lower() for part in os.path.relpath(dirpath, root).split(os.sep)]
+        species = next((SPECIES_DIRS[part] for part in parts if part in SPECIES_DIRS), None)
+        label = CLASS_DIRS.get(parts[-1])
+        if species is None or label is None:
+            continue
+        for name in filenames:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                items.append((os.path.join(dirpath, name), species, label))
+    return sorted(items)
+
+
+def load_candidates(path, defaults):
+    """
+    Candidatos del JSON completados con los prompts actuales.
+
+    Returns:
+        list de dicts con name y las cuatro listas de prompts
+    """
+    with open(path, encoding='utf-8') as f:
+        spec = json.load(f)
+
+    if isinstance(spec, dict):
+        keys = [key for key in PROMPT_KEYS if key in spec]
+        spec = [dict(zip(keys, values)) for values in itertools.product(*(spec[key] for key in keys))]
+
+    candidates = [dict(defaults, name="actual")]
+    for i, candidate in enumerate(spec):
+        unknown = set(candidate) - set(PROMPT_KEYS) - {"name"}
+        if unknown:
+            raise ValueError(f"Claves desconocidas en el candidato {i}: {sorted(unknown)}")
+        for key in ("dorada", "lubina"):
+            if key in candidate and len(candidate[key]) != 2:
+                raise ValueError(f"El candidato {i} debe tener 2 prompts en '{key}' (cultivada, salvaje)")
+        candidates.append(dict(defaults, name=f"candidato-{i}", **candidate))
+    return candidates
+
+
+def encode_images(pipeline, paths, cache_path, batch_size=32):
+    """
+    Embeddings normalizados [N, dim] de las imágenes, reutilizando la caché.
+
+    La caché es un .npz con el SHA-256 de cada imagen y su embedding; sólo se
+    codifican las imágenes que no están en ella.
+    """
+    hashes = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            hashes.append(hashlib.sha256(f.read()).hexdigest())
+
+    known = {}
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            known = dict(zip(cached["hashes"].tolist(), cached["features"]))
+
+    missing = [(path, image_hash) for path, image_hash in zip(paths, hashes) if image_hash not in known]
+    if missing:
+        print(f"Codificando {len(missing)} imágenes ({len(paths) - len(missing)} en caché)...")
+        for start in range(0, len(missing), batch_size):
+            chunk = missing[start:start + batch_size]
+            images = [Image.open(path).convert('RGB') for path, _ in chunk]
+            features = pipeline.encode(pipeline.preprocess_images(images)).float().cpu().numpy()
+            known.update(zip((image_hash for _, image_hash in chunk), features))
+
+        os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+        tmp_path = cache_path + '.tmp.npz'
+        np.savez(tmp_path, hashes=np.array(list(known)), features=np.stack(list(known.values())))
+        os.replace(tmp_path, cache_path)
+
+    return torch.from_numpy(np.stack([known[image_hash] for image_hash in hashes]))
+
+
+def prompt_indices(candidates):
+    """
+    Prompts distintos de todos los candidatos e índices de cada candidato en ellos.
+
+    Returns:
+        tuple: (lista de prompts, índices de clase [C, 2, 2] (dorada/lubina x
+        cultivada/salvaje), índices de especie [C, P], especie de cada columna
+        [C, P] (0 dorada, 1 lubina, -1 relleno))
+    """
+    prompts = {}
+
+    def index(prompt):
+        return prompts.setdefault(prompt, len(prompts))
+
+    class_idx = [[[index(p) for p in c["dorada"]], [index(p) for p in c["lubina"]]] for c in candidates]
+    width = max(len(c["species_dorada"]) + len(c["species_lubina"]) for c in candidates)
+    species_idx = np.zeros((len(candidates), width), dtype=np.int64)
+    species_group = np.full((len(candidates), width), -1, dtype=np.int64)
+    for i, c in enumerate(candidates):
+        row = [index(p) for p in c["species_dorada"]] + [index(p) for p in c["species_lubina"]]
+        species_idx[i, :len(row)] = row
+        species_group[i, :len(c["species_dorada"])] = 0
+        species_group[i, len(c["species_dorada"]):len(row)] = 1
+    return (list(prompts), torch.tensor(class_idx), torch.from_numpy(species_idx),
+            torch.from_numpy(species_group))
+
+
+def confusion(true, pred):
+    """Matrices de confusión 2x2 [C, 2, 2] (fila = real) de predicciones [C, N]"""
+    cells = F.one_hot(true.unsqueeze(0) * 2 + pred, 4).sum(dim=1)
+    return cells.view(-1, 2, 2)
+
+
+def sweep(image_features, species_true, class_true, text_features, class_idx, species_idx, species_group):
+    """
+    Puntúa todos los candidatos a la vez.
+
+    Args:
+        image_features: [N, dim] normalizados
+        species_true, class_true: etiquetas [N]
+        text_features: [U, dim] normalizados, uno por prompt distinto
+
+    Returns:
+        dict de tensores con predicciones [C, N] y matrices de confusión
+    """
+    with torch.no_grad():
+        logits = 100.0 * image_features @ text_features.T                       # [N, U]
+
+        # Especie: softmax conjunto sobre el ensemble y media por especie
+        species_logits = logits[:, species_idx].permute(1, 0, 2)                 # [C, N, P]
+        valid = (species_group >= 0).unsqueeze(1)
+        probs = species_logits.masked_fill(~valid, float('-inf')).softmax(dim=-1)
+        dorada = (probs * (species_group == 0).unsqueeze(1)).sum(-1) / (species_group == 0).sum(-1, keepdim=True)
+        lubina = (probs * (species_group == 1).unsqueeze(1)).sum(-1) / (species_group == 1).sum(-1, keepdim=True)
+        species_pred = (lubina >= dorada).long()                                 # [C, N]
+
+        # Cultivada/salvaje con los prompts de cada especie: [C, N, especie, clase]
+        class_logits = logits[:, class_idx].permute(1, 0, 2, 3)
+        class_by_species = class_logits.argmax(dim=-1)                           # [C, N, 2]
+        # Con la especie detectada (como la aplicación) y con la real (aísla los prompts de clase)
+        class_pred = class_by_species.gather(2, species_pred.unsqueeze(-1)).squeeze(-1)
+        oracle = species_true.view(1, -1, 1).expand(class_by_species.shape[0], -1, 1)
+        class_oracle = class_by_species.gather(2, oracle).squeeze(-1)
+
+    return {
+        "species_pred": species_pred,
+        "class_pred": class_pred,
+        "class_oracle": class_oracle,
+        "species_confusion": confusion(species_true, species_pred),
+        "class_confusion": [confusion(class_true[species_true == s], class_oracle[:, species_true == s])
+                            for s in (0, 1)]
+    }
+
+
+def accuracy(matrix):
+    total = int(matrix.sum())
+    return float(matrix.trace()) / total if total else 0.0
+
+
+def recall(matrix):
+    return [float(matrix[i, i]) / float(matrix[i].sum()) if matrix[i].sum() else 0.0 for i in range(2)]
+
+
+def report(candidates, result, species_true, class_true, species_names, class_names):
+    """Métricas por candidato, ordenadas de mayor a menor acierto completo (especie y clase)"""
+    species_correct = result["species_pred"] == species_true
+    rows = []
+    for i, candidate in enumerate(candidates):
+        per_species = {}
+        for s, species in species_names.items():
+            matrix = result["class_confusion"][s][i]
+            per_species[species] = {
+                "class_accuracy": accuracy(matrix),
+                "recall": dict(zip(class_names.values(), recall(matrix))),
+                "confusion": matrix.tolist()
+            }
+        species_matrix = result["species_confusion"][i]
+        rows.append({
+            "name": candidate["name"],
+            "accuracy": float((species_correct[i] & (result["class_pred"][i] == class_true)).float().mean()),
+            "species_accuracy": accuracy(species_matrix),
+            "species_recall": dict(zip(species_names.values(), recall(species_matrix))),
+            "species_confusion": species_matrix.tolist(),
+            "class_accuracy": float((result["class_oracle"][i] == class_true).float().mean()),
+            "per_species": per_species,
+            "prompts": {key: candidate[key] for key in PROMPT_KEYS}
+        })
+    rows.sort(key=lambda row: row["accuracy"], reverse=True)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Barrido de prompts sobre imágenes etiquetadas")
+    parser.add_argument("dataset", help="Directorio con <especie>/.../<C|S>/imagen")
+    parser.add_argument("--candidates", required=True, help="JSON con los conjuntos de prompts a evaluar")
+    parser.add_argument("--cache", default=None, help="Caché de embeddings de imagen (.npz)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Imágenes por forward del modelo")
+    parser.add_argument("--top", type=int, default=10, help="Candidatos a mostrar")
+    parser.add_argument("--output", default=None, help="Guardar las métricas de todos los candidatos en JSON")
+    args = parser.parse_args()
+
+    items = find_labelled_images(args.dataset)
+    if not items:
+        print(f"Error: no hay imágenes etiquetadas en {args.dataset}")
+        return 1
+
+    import app
+    from prompt_cache import encode_prompts, has_text_tower
+
+    if app.model is None:
+        print("Error: no se pudo cargar el modelo")
+        return 1
+    if not has_text_tower(app.model):
+        print("Error: el barrido necesita la torre de texto; ejecútalo sin IMAGE_ONLY=1")
+        return 1
+
+    defaults = {
+        "dorada": app.TEXT_LABELS_DORADA,
+        "lubina": app.TEXT_LABELS_LUBINA,
+        "species_dorada": app.DORADA_PROMPTS,
+        "species_lubina": app.LUBINA_PROMPTS
+    }
+    candidates = load_candidates(args.candidates, defaults)
+
+    # Una caché por modelo, backend y preprocesado: sus embeddings no son idénticos
+    cache_path = args.cache or os.path.join(
+        app.CACHE_FOLDER, "prompt-sweep",
+        f"{app.MODEL_NAME.replace('/', '-')}-{app.backend_name}{'-fast' if app.FAST_PREPROCESS else ''}.npz")
+
+    start = time.perf_counter()
+    image_features = encode_images(app.pipeline, [path for path, _, _ in items], cache_path, args.batch_size)
+    species_true = torch.tensor([species for _, species, _ in items])
+    class_true = torch.tensor([label for _, _, label in items])
+    image_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    prompts, class_idx, species_idx, species_group = prompt_indices(candidates)
+    text_features = torch.from_numpy(encode_prompts(app.model, prompts, app.device))
+    text_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = sweep(image_features.float(), species_true, class_true, text_features.float(),
+                   class_idx, species_idx, species_group)
+    rows = report(candidates, result, species_true, class_true, app.SPECIES_NAMES, app.CLASS_NAMES)
+    sweep_seconds = time.perf_counter() - start
+
+    print(f"{len(items)} imágenes, {len(candidates)} candidatos, {len(prompts)} prompts distintos")
+    print(f"Tiempo - imágenes: {image_seconds:.1f}s, prompts: {text_seconds:.1f}s, barrido: {sweep_seconds:.2f}s")
+    print(f"{'candidato':<16} {'completo':>9} {'especie':>8} {'clase':>7} "
+          f"{'dor.cult':>9} {'dor.salv':>9} {'lub.cult':>9} {'lub.salv':>9}")
+    for row in rows[:args.top]:
+        dorada = row["per_species"][app.SPECIES_NAMES[0]]["recall"]
+        lubina = row["per_species"][app.SPECIES_NAMES[1]]["recall"]
+        print(f"{row['name']:<16} {row['accuracy']:>9.2%} {row['species_accuracy']:>8.2%} "
+              f"{row['class_accuracy']:>7.2%} "
+              + " ".join(f"{value:>9.2%}" for value in (*dorada.values(), *lubina.values())))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"images": len(items), "candidates": rows}, f, indent=2, ensure_ascii=False)
+        print(f"Métricas guardadas en: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
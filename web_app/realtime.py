@@ -0,0 +1,118 @@
+"""
+Sesiones de detección en tiempo real sobre WebSocket.
+
+El cliente envía frames (JPEG en mensajes binarios) por una conexión
+persistente. Por cada sesión el servidor guarda sólo el último frame aún no
+procesado: si llega uno nuevo mientras el modelo está ocupado, el anterior se
+descarta. Cada resultado se envía al cliente en cuanto está listo, de modo
+que la cadencia de frames se adapta a la carga del servidor.
+"""
+
+import json
+import threading
+
+
+class LatestFrameSlot:
+    """Hueco de un solo frame: el más reciente sustituye al pendiente"""
+
+    def __init__(self, stats=None):
+        self._cond = threading.Condition()
+        self._frame = None
+        self._closed = False
+        self._stats = stats
+
+    def put(self, frame):
+        with self._cond:
+            if self._frame is not None and self._stats is not None:
+                self._stats.increment("frames_dropped")
+            self._frame = frame
+            self._cond.notify()
+
+    def take(self):
+        """Espera al siguiente frame; devuelve None si la sesión se cerró"""
+        with self._cond:
+            while self._frame is None and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                return None
+            frame, self._frame = self._frame, None
+            return frame
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class RealtimeStats:
+    """Contadores globales de las sesiones en tiempo real"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {
+            "sessions_active": 0,
+            "sessions_total": 0,
+            "frames_received": 0,
+            "frames_processed": 0,
+            "frames_dropped": 0
+        }
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+def serve_session(ws, process_frame, stats):
+    """
+    Atiende una conexión WebSocket hasta que el cliente la cierra.
+
+    Args:
+        ws: Conexión con métodos receive() y send()
+        process_frame: Función bytes -> dict con el resultado del frame
+        stats: RealtimeStats donde acumular contadores
+    """
+    slot = LatestFrameSlot(stats)
+
+    def worker():
+        while True:
+            frame = slot.take()
+            if frame is None:
+                return
+            try:
+                result = process_frame(frame)
+            except Exception as e:
+                result = {"success": False, "error": f"Error: {str(e)}"}
+            stats.increment("frames_processed")
+            try:
+                ws.send(json.dumps(result))
+            except Exception:
+                # La conexión se cerró mientras se procesaba el frame
+                slot.close()
+                return
+
+    thread = threading.Thread(target=worker, name="realtime-session", daemon=True)
+    stats.increment("sessions_active")
+    stats.increment("sessions_total")
+    thread.start()
+    try:
+        while True:
+            try:
+                message = ws.receive()
+            except Exception:
+                # ConnectionClosed u otro error del transporte: fin de sesión
+                break
+            if message is None:
+                break
+            if isinstance(message, str):
+                # Los mensajes de texto (p. ej. keep-alive) se ignoran
+                continue
+            stats.increment("frames_received")
+            slot.put(message)
+    finally:
+        slot.close()
+        stats.increment("sessions_active", -1)
+        thread.join(timeout=5)
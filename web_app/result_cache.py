@@ -0,0 +1,127 @@
+"""
+Caché en memoria de predicciones por hash de contenido.
+
+Los clientes móviles reintentan las subidas cuando la conexión falla y los
+operarios vuelven a enviar la misma foto desde la galería. La caché guarda las
+puntuaciones del pipeline por SHA-256 de los bytes subidos, de modo que una
+imagen repetida no se decodifica ni pasa por el modelo.
+
+La clave incluye una versión que resume el modelo, el backend y los prompts
+(ver result_version): si alguno cambia, las entradas anteriores dejan de
+coincidir y se descartan. Está acotada por número de entradas (LRU) y por
+antigüedad (TTL). Con gunicorn cada worker tiene la suya.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from observability import RESULT_CACHE_EVICTIONS, RESULT_CACHE_REQUESTS
+
+
+def result_version(*parts):
+    """Hash corto de todo lo que determina una predicción (modelo, backend, prompts...)"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(b'\x00' + str(part).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class ResultCache:
+    """LRU con TTL, segura entre hilos, de hash de imagen -> puntuaciones"""
+
+    def __init__(self, max_entries=1024, ttl=3600, version=None):
+        """
+        Args:
+            max_entries: Número máximo de entradas (0 desactiva la caché)
+            ttl: Segundos que vive una entrada (0 = sin caducidad)
+            version: Versión del modelo y los prompts (ver result_version)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = version
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = {"capacity": 0, "ttl": 0, "invalidated": 0}
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def set_version(self, version):
+        """Cambia la versión; las entradas de otra versión se descartan"""
+        with self._lock:
+            if version == self.version:
+                return
+            self.version = version
+            self._evict_all('invalidated')
+
+    def get(self, image_hash, now=None):
+        """Puntuaciones guardadas para una imagen, o None"""
+        if not self.enabled:
+            return None
+        now = time.monotonic() if now is None else now
+        key = (self.version, image_hash)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl > 0 and now - entry[0] > self.ttl:
+                del self._entries[key]
+                self._count_eviction('ttl')
+                entry = None
+            if entry is None:
+                self._misses += 1
+                RESULT_CACHE_REQUESTS.inc(result='miss')
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+        RESULT_CACHE_REQUESTS.inc(result='hit')
+        return entry[1]
+
+    def put(self, image_hash, scores, now=None):
+        """Guarda las puntuaciones de una imagen (no deben modificarse después)"""
+        if not self.enabled:
+            return
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            key = (self.version, image_hash)
+            self._entries[key] = (now, scores)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._count_eviction('capacity')
+
+    def clear(self):
+        with self._lock:
+            self._evict_all('invalidated')
+
+    def _evict_all(self, reason):
+        if self._entries:
+            self._count_eviction(reason, len(self._entries))
+            self._entries.clear()
+
+    def _count_eviction(self, reason, count=1):
+        self._evictions[reason] += count
+        RESULT_CACHE_EVICTIONS.inc(count, reason=reason)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "version": self.version,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "evictions": dict(self._evictions)
+            }
@@ -0,0 +1,57 @@
+"""
+Dimensionado de procesos e hilos para el servidor de producción (gunicorn).
+
+Los workers comparten los pesos del modelo (se cargan antes del fork) y cada
+uno usa una parte de los núcleos para los hilos intra-op de torch, de forma
+que workers × hilos no supere los núcleos disponibles.
+"""
+
+import os
+
+
+def available_cpus():
+    """Núcleos utilizables por el proceso, respetando la afinidad y la cuota del cgroup"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    # Límite de CPU de Docker (--cpus) en cgroup v2 y v1
+    quota = None
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            value, period = f.read().split()
+        if value != 'max':
+            quota = int(value) / int(period)
+    except (OSError, ValueError):
+        try:
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+                value = int(f.read())
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+                period = int(f.read())
+            if value > 0:
+                quota = value / period
+        except (OSError, ValueError):
+            pass
+
+    if quota is not None:
+        cpus = min(cpus, max(1, int(quota)))
+    return max(1, cpus)
+
+
+def default_workers(cpus=None):
+    """Un worker por cada dos núcleos (máximo 4): cada worker necesita varios hilos para el forward"""
+    cpus = cpus or available_cpus()
+    return max(1, min(4, cpus // 2))
+
+
+def threads_per_worker(workers, cpus=None):
+    """Hilos intra-op de torch por worker para no sobresuscribir los núcleos"""
+    cpus = cpus or available_cpus()
+    return max(1, cpus // max(1, workers))
+
+
+def configure_torch_threads(threads):
+    import torch
+
+    torch.set_num_threads(threads)
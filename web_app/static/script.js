@@ -1,9 +1,24 @@
 const BACKEND_URL = 'http://localhost:5000/predict';
 const REALTIME_URL = 'http://localhost:5000/predict_realtime';
+const REALTIME_WS_URL = 'ws://localhost:5000/ws/realtime';
+const MODEL_INFO_URL = 'http://localhost:5000/model_info';
+
+// Intervalo mínimo entre frames por WebSocket; el ritmo real lo marca el servidor
+const MIN_FRAME_INTERVAL = 250;
+// Si un resultado tarda más que esto, se envía otro frame igualmente
+const FRAME_TIMEOUT = 5000;
 
 let videoStream;
 let realtimeInterval = null;
 let isRealtimeActive = false;
+let realtimeSocket = null;
+let realtimeTimer = null;
+// Identificador de sesión para que el servidor siga los frames de esta cámara
+const realtimeSessionId = Math.random().toString(36).slice(2) + Date.now().toString(36);
+// Tamaño de entrada del modelo (de /model_info): los frames se envían ya
+// recortados al centro y reducidos a ese tamaño en lugar de a resolución de vídeo
+let modelInputSize = null;
+const REALTIME_JPEG_QUALITY = 0.8;
 
 // Elementos del DOM
 const imageUpload = document.getElementById('imageUpload');
@@ -252,29 +267,98 @@ cameraButton.addEventListener('click', async () => {
 
 // ======= DETECCIÓN EN TIEMPO REAL =======
 
-// Capturar frame del video y clasificar
-async function captureAndClassifyFrame() {
-    console.log('captureAndClassifyFrame iniciada');
-    if (!videoFeed.videoWidth || !videoFeed.videoHeight) {
-        console.log('Video no está listo:', videoFeed.videoWidth, videoFeed.videoHeight);
-        return; // Video aún no está listo
+// Consultar al servidor el tamaño de entrada del modelo (una vez)
+async function loadModelInputSize() {
+    if (modelInputSize) return;
+    try {
+        const response = await fetch(MODEL_INFO_URL);
+        const info = await response.json();
+        modelInputSize = info.input_resolution || null;
+    } catch (err) {
+        console.warn('No se pudo consultar /model_info, se envían frames completos:', err);
     }
+}
 
-    console.log('Capturando frame del video...');
-    try {
-        // Crear canvas temporal para capturar frame
-        const tempCanvas = document.createElement('canvas');
-        tempCanvas.width = videoFeed.videoWidth;
-        tempCanvas.height = videoFeed.videoHeight;
-        const ctx = tempCanvas.getContext('2d');
+// Capturar el frame actual del video como JPEG (null si el video no está listo)
+async function captureFrameBlob() {
+    const width = videoFeed.videoWidth;
+    const height = videoFeed.videoHeight;
+    if (!width || !height) {
+        console.log('Video no está listo:', width, height);
+        return null; // Video aún no está listo
+    }
+
+    const tempCanvas = document.createElement('canvas');
+    const ctx = tempCanvas.getContext('2d');
+
+    if (!modelInputSize) {
+        // Sin /model_info: frame completo con calidad alta
+        tempCanvas.width = width;
+        tempCanvas.height = height;
         ctx.drawImage(videoFeed, 0, 0);
+        return new Promise(resolve => tempCanvas.toBlob(resolve, 'image/jpeg', 0.95));
+    }
 
-        // Convertir a blob con mayor calidad
-        const blob = await new Promise(resolve => tempCanvas.toBlob(resolve, 'image/jpeg', 0.95));
+    // Recorte cuadrado central reducido al tamaño de entrada del modelo,
+    // el mismo recorte que hace el preprocesado de CLIP en el servidor
+    const side = Math.min(width, height);
+    tempCanvas.width = modelInputSize;
+    tempCanvas.height = modelInputSize;
+    ctx.imageSmoothingQuality = 'high';
+    ctx.drawImage(videoFeed, (width - side) / 2, (height - side) / 2, side, side,
+                  0, 0, modelInputSize, modelInputSize);
+    return new Promise(resolve => tempCanvas.toBlob(resolve, 'image/jpeg', REALTIME_JPEG_QUALITY));
+}
+
+// Mostrar en el overlay la respuesta del backend para un frame
+function handleRealtimeResult(data) {
+    if (data.busy) {
+        // Servidor saturado: el frame se descartó, se mantiene el último resultado
+        return;
+    }
+    if (data.success && data.is_fish) {
+        // Pez detectado con éxito
+        updateRealtimeOverlay(data, true);
+    } else if (data.is_fish === false) {
+        // No se detectó pez
+        updateRealtimeOverlay({
+            status: 'searching',
+            species: 'Buscando pez...',
+            classification: '',
+            fish_confidence: data.fish_confidence || 0,
+            message: data.message || 'Enfoca un pez en la cámara'
+        }, false);
+    } else {
+        // Error en la detección
+        updateRealtimeOverlay({
+            status: 'error',
+            species: 'Error',
+            classification: data.error || 'No detectado',
+            fish_confidence: 0
+        }, false);
+    }
+}
+
+function showRealtimeConnectionError() {
+    updateRealtimeOverlay({
+        status: 'error',
+        species: 'Error de conexión',
+        classification: '',
+        fish_confidence: 0,
+        message: 'Verifica la conexión con el servidor'
+    }, false);
+}
+
+// Capturar frame del video y clasificar (modo HTTP, usado si no hay WebSocket)
+async function captureAndClassifyFrame() {
+    try {
+        const blob = await captureFrameBlob();
+        if (!blob) return;
 
         // Enviar al backend usando endpoint optimizado para tiempo real
         const formData = new FormData();
         formData.append('image', blob, 'frame.jpg');
+        formData.append('session_id', realtimeSessionId);
 
         const response = await fetch(REALTIME_URL, {
             method: 'POST',
@@ -282,39 +366,96 @@ async function captureAndClassifyFrame() {
         });
 
         const data = await response.json();
-        console.log('Respuesta del backend:', data);
-
-        if (data.success && data.is_fish) {
-            // Pez detectado con éxito
-            updateRealtimeOverlay(data, true);
-        } else if (data.is_fish === false) {
-            // No se detectó pez
-            updateRealtimeOverlay({
-                status: 'searching',
-                species: 'Buscando pez...',
-                classification: '',
-                fish_confidence: data.fish_confidence || 0,
-                message: data.message || 'Enfoca un pez en la cámara'
-            }, false);
-        } else {
-            // Error en la detección
-            updateRealtimeOverlay({
-                status: 'error',
-                species: 'Error',
-                classification: data.error || 'No detectado',
-                fish_confidence: 0
-            }, false);
-        }
+        handleRealtimeResult(data);
     } catch (err) {
         console.error('Error en detección en tiempo real:', err);
-        updateRealtimeOverlay({
-            status: 'error',
-            species: 'Error de conexión',
-            classification: '',
-            fish_confidence: 0,
-            message: 'Verifica la conexión con el servidor'
-        }, false);
+        showRealtimeConnectionError();
+    }
+}
+
+// ----- Modo WebSocket -----
+
+// Programar el envío del siguiente frame
+function scheduleNextFrame(delay) {
+    clearTimeout(realtimeTimer);
+    realtimeTimer = setTimeout(sendFrameOverSocket, delay);
+}
+
+// Enviar un frame por el WebSocket. Sólo hay un frame en vuelo: el siguiente
+// se envía al recibir el resultado, así el ritmo se adapta a la carga del servidor
+async function sendFrameOverSocket() {
+    if (!isRealtimeActive || !realtimeSocket || realtimeSocket.readyState !== WebSocket.OPEN) return;
+
+    const blob = await captureFrameBlob();
+    if (!blob || !isRealtimeActive || realtimeSocket.readyState !== WebSocket.OPEN) {
+        scheduleNextFrame(MIN_FRAME_INTERVAL);
+        return;
+    }
+
+    realtimeSocket.send(blob);
+    // Si el resultado no llega a tiempo se envía otro frame (el servidor descarta los antiguos)
+    scheduleNextFrame(FRAME_TIMEOUT);
+}
+
+// Abrir el WebSocket; si falla antes de conectar se usa el modo HTTP
+function startRealtimeSocket() {
+    let opened = false;
+    let socket;
+
+    try {
+        socket = new WebSocket(REALTIME_WS_URL);
+    } catch (err) {
+        console.warn('WebSocket no disponible, usando HTTP:', err);
+        startRealtimePolling();
+        return;
     }
+    realtimeSocket = socket;
+
+    socket.onopen = () => {
+        opened = true;
+        console.log('WebSocket de tiempo real conectado');
+        sendFrameOverSocket();
+    };
+
+    socket.onmessage = (event) => {
+        let delay = MIN_FRAME_INTERVAL;
+        try {
+            const data = JSON.parse(event.data);
+            handleRealtimeResult(data);
+            // Si el servidor descartó el frame por carga, esperar lo que indica
+            if (data.busy && data.retry_after) {
+                delay = Math.max(delay, data.retry_after * 1000);
+            }
+        } catch (err) {
+            console.error('Respuesta no válida del servidor:', err);
+        }
+        scheduleNextFrame(delay);
+    };
+
+    socket.onclose = () => {
+        // Ignorar el cierre de una conexión que ya fue sustituida o detenida
+        if (realtimeSocket !== socket) return;
+        realtimeSocket = null;
+        clearTimeout(realtimeTimer);
+        if (!isRealtimeActive) return;
+        if (!opened) {
+            console.warn('No se pudo abrir el WebSocket, usando HTTP');
+            startRealtimePolling();
+        } else {
+            showRealtimeConnectionError();
+            // Reintentar la conexión
+            realtimeTimer = setTimeout(() => {
+                if (isRealtimeActive) startRealtimeSocket();
+            }, 2000);
+        }
+    };
+}
+
+// Modo HTTP: un POST cada 1.5 segundos
+function startRealtimePolling() {
+    if (!isRealtimeActive || realtimeInterval) return;
+    captureAndClassifyFrame(); // Primera ejecución inmediata
+    realtimeInterval = setInterval(captureAndClassifyFrame, 1500);
 }
 
 // Actualizar overlay con resultados mejorado con más información visual
@@ -458,10 +599,15 @@ function startRealtimeDetection() {
     hideElement(resultsDiv);
     hideElement(errorDiv);
 
-    // Ejecutar cada 1.5 segundos para mejor respuesta en tiempo real
-    console.log('Ejecutando primera captura...');
-    captureAndClassifyFrame(); // Primera ejecución inmediata
-    realtimeInterval = setInterval(captureAndClassifyFrame, 1500);
+    // Los primeros frames pueden salir a resolución completa hasta que llegue la respuesta
+    loadModelInputSize();
+
+    // Enviar frames por WebSocket (con vuelta al modo HTTP si no está disponible)
+    if ('WebSocket' in window) {
+        startRealtimeSocket();
+    } else {
+        startRealtimePolling();
+    }
 }
 
 // Detener detección en tiempo real
@@ -477,6 +623,14 @@ function stopRealtimeDetection() {
         realtimeInterval = null;
     }
 
+    clearTimeout(realtimeTimer);
+    realtimeTimer = null;
+    if (realtimeSocket) {
+        const socket = realtimeSocket;
+        realtimeSocket = null;
+        socket.close();
+    }
+
     realtimeOverlay.classList.remove('active');
     clearRealtimeOverlay();
 }
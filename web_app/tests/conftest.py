@@ -0,0 +1,6 @@
+"""Los módulos de la app se importan como de primer nivel, como al ejecutar desde web_app/"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,84 @@
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, Overloaded
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "la condición no se cumplió a tiempo"
+        time.sleep(0.005)
+
+
+def test_realtime_cannot_take_reserved_slots():
+    admission = AdmissionController(max_concurrent=2, reserved=1)
+    with admission.admit("realtime"):
+        with pytest.raises(Overloaded) as excinfo:
+            with admission.admit("realtime"):
+                pass
+        # El hueco reservado sigue libre para predict
+        with admission.admit("predict"):
+            pass
+
+    assert excinfo.value.priority == "realtime"
+    assert admission.stats()["priorities"]["realtime"]["shed"] == 1
+
+
+def test_realtime_is_shed_while_requests_wait():
+    admission = AdmissionController(max_concurrent=2, reserved=0)
+    # Justo tras liberarse un hueco, antes de que despierte la petición en espera
+    admission._waiting["predict"] = 1
+    with pytest.raises(Overloaded):
+        with admission.admit("realtime"):
+            pass
+
+    admission._waiting["predict"] = 0
+    with admission.admit("realtime"):
+        pass
+
+
+def test_predict_gives_up_after_budget():
+    admission = AdmissionController(max_concurrent=1, reserved=0,
+                                    predict_budget=0.05, retry_after=3)
+    with admission.admit("batch"):
+        start = time.perf_counter()
+        with pytest.raises(Overloaded) as excinfo:
+            with admission.admit("predict"):
+                pass
+
+    assert time.perf_counter() - start >= 0.05
+    assert excinfo.value.retry_after == 3
+    assert admission.stats()["priorities"]["predict"]["shed"] == 1
+    assert admission.stats()["in_flight"] == 0
+
+
+def test_batch_yields_to_waiting_predict():
+    admission = AdmissionController(max_concurrent=1, reserved=0, predict_budget=5)
+    order = []
+
+    def run(priority):
+        with admission.admit(priority):
+            order.append(priority)
+
+    with admission.admit("batch"):
+        batch = threading.Thread(target=run, args=("batch",))
+        batch.start()
+        wait_until(lambda: admission.stats()["priorities"]["batch"]["waiting"] == 1)
+        predict = threading.Thread(target=run, args=("predict",))
+        predict.start()
+        wait_until(lambda: admission.stats()["priorities"]["predict"]["waiting"] == 1)
+    batch.join()
+    predict.join()
+
+    assert order == ["predict", "batch"]
+
+
+def test_disabled_controller_admits_everything():
+    admission = AdmissionController(max_concurrent=0)
+    with admission.admit("realtime"), admission.admit("realtime"), admission.admit("predict"):
+        pass
+
+    assert not admission.stats()["enabled"]
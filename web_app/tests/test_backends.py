@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+
+from backends import (  # noqa: E402
+    TFLiteBackend, check_parity_report, create_backend, parity_report_path
+)
+from parity import ParityReport  # noqa: E402
+
+
+def write_report(model_path, passed):
+    with open(parity_report_path(model_path), 'w', encoding='utf-8') as f:
+        json.dump({"passed": passed}, f)
+
+
+def test_parity_report_is_required(tmp_path):
+    model_path = str(tmp_path / "clip.onnx")
+    with pytest.raises(RuntimeError, match="Falta el informe"):
+        check_parity_report(model_path)
+
+    write_report(model_path, False)
+    with pytest.raises(RuntimeError, match="no superó"):
+        check_parity_report(model_path)
+
+    write_report(model_path, True)
+    assert check_parity_report(model_path)["passed"]
+
+
+def test_create_backend():
+    model = object()
+    assert create_backend("torch", model) is model
+    with pytest.raises(ValueError):
+        create_backend("coreml", model, "modelo.mlmodel")
+    with pytest.raises(RuntimeError):
+        create_backend("onnx", model, "/no/existe.onnx")
+
+
+def decisions(features):
+    return [{"is_fish": bool(row[0] > 0), "species_id": int(row[1] > 0), "predicted_class": 0}
+            for row in features.tolist()]
+
+
+def test_parity_report_agreement():
+    reference = torch.nn.functional.normalize(torch.tensor([[1.0, 1.0], [1.0, -1.0]]), dim=-1)
+    report = ParityReport(decisions)
+    report.add(reference, reference.clone())
+    assert report.summary(0.98)["passed"]
+    assert report.summary()["embedding_cosine_min"] == pytest.approx(1.0)
+
+    # La candidata cambia la especie de una de las dos imágenes
+    report = ParityReport(decisions)
+    report.add(reference, torch.tensor([[1.0, 0.0], [1.0, 0.0]]))
+    summary = report.summary(0.98)
+    assert summary["agreement"] == {"is_fish": 1.0, "species_id": 0.5, "predicted_class": 1.0}
+    assert not summary["passed"]
+
+
+class FakeInterpreter:
+    """Intérprete que falla si dos hilos lo usan a la vez, como el de TFLite"""
+
+    def __init__(self):
+        self.active = 0
+        self.overlaps = 0
+        self.tensor = None
+
+    def resize_tensor_input(self, index, shape):
+        pass
+
+    def allocate_tensors(self):
+        pass
+
+    def set_tensor(self, index, value):
+        self.active += 1
+        self.overlaps += self.active > 1
+        self.tensor = value
+
+    def invoke(self):
+        time.sleep(0.001)
+
+    def get_tensor(self, index):
+        output = self.tensor.reshape(self.tensor.shape[0], -1).copy()
+        self.active -= 1
+        return output
+
+
+def test_tflite_calls_are_serialized():
+    backend = TFLiteBackend.__new__(TFLiteBackend)
+    backend._interpreter = FakeInterpreter()
+    backend._pid = os.getpid()
+    backend._lock = threading.Lock()
+    backend._batch_size = 1
+    backend.input_detail = {"index": 0, "dtype": np.float32}
+    backend.output_index = 1
+    backend.channels_last = False
+
+    errors = []
+
+    def run(value, batch_size):
+        for _ in range(20):
+            features = backend.encode_image(torch.full((batch_size, 3, 2, 2), float(value)))
+            if features.shape != (batch_size, 12) or not bool((features == value).all()):
+                errors.append((value, batch_size))
+
+    threads = [threading.Thread(target=run, args=(i, 1 + i % 3)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert backend._interpreter.overlaps == 0
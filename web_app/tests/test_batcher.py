@@ -0,0 +1,47 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from batcher import MicroBatcher  # noqa: E402
+
+
+def test_concurrent_images_share_one_forward():
+    sizes = []
+
+    def encode(batch):
+        sizes.append(batch.shape[0])
+        return batch.flatten(1).sum(dim=1, keepdim=True)
+
+    batcher = MicroBatcher(encode, max_batch_size=4, max_wait_ms=500)
+    tensors = [torch.full((3, 2, 2), float(i)) for i in range(4)]
+    futures = [batcher.submit(tensor) for tensor in tensors]
+
+    for i, future in enumerate(futures):
+        torch.testing.assert_close(future.result(timeout=5), torch.tensor([12.0 * i]))
+    # El batch se cierra al llenarse, sin esperar max_wait
+    assert sizes == [4]
+    stats = batcher.stats()
+    assert (stats["batches"], stats["images"], stats["batch_size_histogram"]) == (1, 4, {4: 1})
+
+
+def test_batch_closes_after_max_wait():
+    batcher = MicroBatcher(lambda batch: batch.flatten(1), max_batch_size=8, max_wait_ms=1)
+
+    result = batcher.encode(torch.ones(3, 2, 2), timeout=5)
+    assert result.shape == (12,)
+    assert batcher.stats()["avg_batch_size"] == 1.0
+
+
+def test_encode_error_reaches_every_caller():
+    def encode(batch):
+        raise RuntimeError("fallo del modelo")
+
+    batcher = MicroBatcher(encode, max_batch_size=2, max_wait_ms=200)
+    futures = [batcher.submit(torch.zeros(3, 2, 2)) for _ in range(2)]
+
+    for future in futures:
+        with pytest.raises(RuntimeError, match="fallo del modelo"):
+            future.result(timeout=5)
+    # El hilo sigue atendiendo peticiones tras el error
+    batcher.encode_fn = lambda batch: batch.flatten(1)
+    assert batcher.encode(torch.zeros(3, 2, 2), timeout=5).shape == (12,)
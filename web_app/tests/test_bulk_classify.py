@@ -0,0 +1,103 @@
+import csv
+import hashlib
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+Image = pytest.importorskip("PIL.Image")
+
+import bulk_classify  # noqa: E402
+
+
+def write_image(path, color=(10, 20, 30)):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new('RGB', (16, 16), color).save(path, 'JPEG')
+    return str(path)
+
+
+def write_checkpoint(csv_path, rows):
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=bulk_classify.FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def test_checkpoint_path():
+    assert bulk_classify.checkpoint_path("report.csv") == "report.csv"
+    assert bulk_classify.checkpoint_path("report.parquet") == "report.parquet.checkpoint.csv"
+
+
+def test_find_images_walks_subdirectories_in_order(tmp_path):
+    second = write_image(tmp_path / "b" / "2.jpg")
+    first = write_image(tmp_path / "a" / "1.JPG")
+    (tmp_path / "notas.txt").write_text("no es una imagen")
+
+    assert bulk_classify.find_images(str(tmp_path)) == [first, second]
+
+
+def test_resume_skips_processed_images(tmp_path):
+    images = [write_image(tmp_path / "imgs" / f"{i}.jpg") for i in range(3)]
+    csv_path = str(tmp_path / "report.csv")
+
+    assert bulk_classify.pending_images(str(tmp_path / "imgs"), csv_path) == (set(), images)
+
+    # Una ejecución interrumpida tras la primera imagen; las que fallaron tampoco se repiten
+    write_checkpoint(csv_path, [
+        {"path": images[0], "is_fish": True},
+        {"path": images[1], "error": "ilegible"}
+    ])
+    done, pending = bulk_classify.pending_images(str(tmp_path / "imgs"), csv_path)
+    assert done == set(images[:2])
+    assert pending == images[2:]
+
+
+def test_known_hashes_are_not_decoded(tmp_path, monkeypatch):
+    known = write_image(tmp_path / "known.jpg", (0, 0, 0))
+    new = write_image(tmp_path / "new.jpg", (255, 255, 255))
+    with open(known, 'rb') as f:
+        known_hash = hashlib.sha256(f.read()).hexdigest()
+    monkeypatch.setattr(bulk_classify, "_preprocess", lambda image: torch.zeros(3, 4, 4))
+    monkeypatch.setattr(bulk_classify, "_known_hashes", frozenset({known_hash}))
+
+    assert bulk_classify._load_image(known) == (known, known_hash, None, None)
+    path, image_hash, tensor, error = bulk_classify._load_image(new)
+    assert (path, error) == (new, None)
+    assert tensor.shape == (3, 4, 4)
+
+    path, image_hash, tensor, error = bulk_classify._load_image(str(tmp_path / "missing.jpg"))
+    assert image_hash is None and tensor is None and error
+
+
+def test_score_row():
+    app = SimpleNamespace(SPECIES_NAMES={0: "Dorada", 1: "Lubina"},
+                          CLASS_NAMES={0: "Cultivada", 1: "Salvaje"})
+    scores = {
+        "is_fish": True, "fish_confidence": 0.9, "species_id": 1, "species_confidence": 0.8,
+        "species_probabilities": {"dorada": 0.2, "lubina": 0.8},
+        "predicted_class": 0, "confidence": 0.7,
+        "probabilities": {"cultivada": 0.7, "salvaje": 0.3}
+    }
+
+    row = bulk_classify.score_row(app, "x.jpg", scores)
+    assert set(row) == set(bulk_classify.FIELDS)
+    assert row["species"] == "Lubina"
+    assert row["classification"] == "Cultivada"
+    assert row["prob_lubina"] == "0.800000"
+
+
+def test_parquet_output(tmp_path):
+    pd = pytest.importorskip("pandas")
+    pytest.importorskip("pyarrow")
+    csv_path = str(tmp_path / "report.parquet.checkpoint.csv")
+    write_checkpoint(csv_path, [{"path": "a.jpg", "is_fish": True, "fish_confidence": "0.900000"}])
+
+    assert bulk_classify.write_parquet(csv_path, str(tmp_path / "report.parquet"))
+    assert pd.read_parquet(tmp_path / "report.parquet")["path"].tolist() == ["a.jpg"]
+
+
+def test_parquet_without_pandas(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "pandas", None)
+    csv_path = str(tmp_path / "report.csv")
+    assert not bulk_classify.write_parquet(csv_path, str(tmp_path / "report.parquet"))
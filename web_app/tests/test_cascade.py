@@ -0,0 +1,130 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("PIL")
+
+from cascade import Cascade, CascadeStats, FishGate, interpolate_positional_embedding  # noqa: E402
+
+WIDTH = 8
+PATCH = 4
+N_PX = 16
+
+
+class TinyViT(torch.nn.Module):
+    """Torre de imagen con la misma estructura que el ViT de CLIP, en miniatura"""
+
+    def __init__(self):
+        super().__init__()
+        grid = N_PX // PATCH
+        self.input_resolution = N_PX
+        self.conv1 = torch.nn.Conv2d(3, WIDTH, kernel_size=PATCH, stride=PATCH, bias=False)
+        self.class_embedding = torch.nn.Parameter(torch.randn(WIDTH))
+        self.positional_embedding = torch.nn.Parameter(torch.randn(1 + grid * grid, WIDTH))
+        self.ln_pre = torch.nn.LayerNorm(WIDTH)
+        self.transformer = torch.nn.Identity()
+        self.ln_post = torch.nn.LayerNorm(WIDTH)
+        self.proj = torch.nn.Parameter(torch.randn(WIDTH, 2))
+
+
+class TinyCLIP:
+    dtype = torch.float32
+
+    def __init__(self):
+        torch.manual_seed(0)
+        self.visual = TinyViT()
+
+
+def test_interpolation_to_same_grid_is_identity():
+    positional = torch.randn(1 + 7 * 7, WIDTH)
+
+    torch.testing.assert_close(interpolate_positional_embedding(positional, 7), positional)
+
+
+def test_interpolation_keeps_class_position():
+    positional = torch.randn(1 + 7 * 7, WIDTH)
+
+    resized = interpolate_positional_embedding(positional, 3)
+    assert resized.shape == (1 + 3 * 3, WIDTH)
+    torch.testing.assert_close(resized[0], positional[0])
+
+
+def test_gate_rejects_invalid_resolution():
+    with pytest.raises(ValueError):
+        FishGate(TinyCLIP(), torch.eye(2), resolution=6)
+    with pytest.raises(ValueError):
+        FishGate(TinyCLIP(), torch.eye(2), resolution=N_PX)
+
+
+def test_gate_scores_low_resolution_embeddings():
+    gate = FishGate(TinyCLIP(), torch.eye(2), resolution=8)
+    images = torch.randn(3, 3, N_PX, N_PX)
+
+    features = gate.encode(images)
+    assert features.shape == (3, 2)
+    torch.testing.assert_close(features.norm(dim=-1), torch.ones(3))
+
+    confidence = gate.fish_confidence(images)
+    assert confidence.shape == (3,)
+    torch.testing.assert_close(confidence, (100.0 * features).softmax(dim=-1)[:, 0])
+
+
+class FakeGate:
+    threshold = 0.5
+
+    def __init__(self, confidence):
+        self.confidence = confidence
+
+    def fish_confidence(self, image_input):
+        return torch.full((image_input.shape[0],), self.confidence)
+
+
+class FakePipeline:
+    device = 'cpu'
+
+    def __init__(self):
+        self.encoded = 0
+
+    def preprocess_input(self, image_data):
+        return torch.zeros(3, N_PX, N_PX)
+
+    def encode_one(self, image_tensor):
+        self.encoded += 1
+        return torch.zeros(1, 2)
+
+    def score(self, features):
+        return [{"is_fish": True, "fish_confidence": 0.9}]
+
+
+def test_cascade_skips_full_pass_for_rejected_frames():
+    pipeline = FakePipeline()
+    cascade = Cascade(pipeline, FakeGate(0.1))
+
+    result = cascade.predict(b'frame')
+    assert result == {"is_fish": False, "fish_confidence": pytest.approx(0.1), "gated": True}
+    assert pipeline.encoded == 0
+
+    snapshot = cascade.stats.snapshot()
+    assert snapshot["gate"]["frames"] == 1 and snapshot["gate"]["rejected"] == 1
+    assert snapshot["full"]["frames"] == 0
+
+
+def test_cascade_runs_full_pipeline_for_passed_frames():
+    pipeline = FakePipeline()
+    cascade = Cascade(pipeline, FakeGate(0.9))
+
+    assert cascade.predict(b'frame') == {"is_fish": True, "fish_confidence": 0.9}
+    assert pipeline.encoded == 1
+    assert cascade.stats.snapshot()["full"]["frames"] == 1
+
+
+def test_stats_estimate_saved_time():
+    stats = CascadeStats()
+    for _ in range(3):
+        stats.record("gate", 0.01, rejected=True)
+    stats.record("gate", 0.01)
+    stats.record("full", 0.2)
+
+    snapshot = stats.snapshot()
+    assert snapshot["rejection_rate"] == pytest.approx(0.75)
+    assert snapshot["saved_full_passes"] == 3
+    assert snapshot["estimated_saved_seconds"] == pytest.approx(3 * 0.2 - 4 * 0.01)
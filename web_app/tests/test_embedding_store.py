@@ -0,0 +1,82 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from embedding_store import EmbeddingStore  # noqa: E402
+
+DIM = 4
+
+
+def unit(*values):
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_add_and_get(tmp_path):
+    store = EmbeddingStore(str(tmp_path), DIM)
+    store.add("h1", unit(1, 0, 0, 0), "h1.jpg")
+
+    np.testing.assert_allclose(store.get("h1"), unit(1, 0, 0, 0))
+    assert store.get("otro") is None
+    assert (store.stats()["hits"], store.stats()["misses"]) == (1, 1)
+
+
+def test_repeated_hash_is_an_alias(tmp_path):
+    store = EmbeddingStore(str(tmp_path), DIM)
+    row = store.add("h1", unit(1, 0, 0, 0), "a.jpg")
+
+    assert store.add("h1", unit(1, 0, 0, 0), "b.jpg") == row
+    assert len(store) == 1
+    assert store.hash_for_filename("b.jpg") == "h1"
+
+
+def test_rows_appended_by_another_process_are_visible(tmp_path):
+    # Dos instancias sobre el mismo directorio, como dos workers de gunicorn
+    first = EmbeddingStore(str(tmp_path), DIM)
+    second = EmbeddingStore(str(tmp_path), DIM)
+    first.add("h1", unit(1, 0, 0, 0), "h1.jpg")
+    second.add("h2", unit(0, 1, 0, 0), "h2.jpg")
+
+    np.testing.assert_allclose(second.get("h1"), unit(1, 0, 0, 0))
+    np.testing.assert_allclose(first.get("h2"), unit(0, 1, 0, 0))
+    assert sorted(first.known_hashes()) == ["h1", "h2"]
+
+
+def test_incomplete_row_is_ignored(tmp_path):
+    store = EmbeddingStore(str(tmp_path), DIM)
+    # Línea de índice sin su embedding escrito
+    with open(store.index_path, 'ab') as f:
+        f.write(b"h1\th1.jpg\n")
+
+    assert store.get("h1") is None
+    assert len(store) == 0
+
+
+def test_nearest(tmp_path):
+    store = EmbeddingStore(str(tmp_path), DIM)
+    store.add("x", unit(1, 0, 0, 0), "x.jpg")
+    store.add("xy", unit(1, 1, 0, 0), "xy.jpg")
+    store.add("y", unit(0, 1, 0, 0), "y.jpg")
+
+    results = store.nearest(unit(1, 0.1, 0, 0), k=2, chunk_rows=1)
+    assert [r["hash"] for r in results] == ["x", "xy"]
+    results = store.nearest(unit(1, 0.1, 0, 0), k=2, exclude_hash="x")
+    assert [r["hash"] for r in results] == ["xy", "y"]
+
+
+def test_remove(tmp_path):
+    store = EmbeddingStore(str(tmp_path), DIM)
+    store.add("x", unit(1, 0, 0, 0), "x.jpg")
+    store.add("y", unit(0, 1, 0, 0), "y.jpg")
+
+    assert store.remove(["x", "desconocido"]) == 1
+    assert store.get("x") is None
+    assert store.hash_for_filename("x.jpg") is None
+    assert [r["hash"] for r in store.nearest(unit(1, 0, 0, 0), k=5)] == ["y"]
+    assert len(store) == 1
+
+    # Otra instancia ve la eliminación, y el contenido puede volver a añadirse
+    other = EmbeddingStore(str(tmp_path), DIM)
+    assert other.get("x") is None
+    other.add("x", unit(1, 0, 0, 0), "x.jpg")
+    np.testing.assert_allclose(store.get("x"), unit(1, 0, 0, 0))
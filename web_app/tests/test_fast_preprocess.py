@@ -0,0 +1,63 @@
+import io
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+Image = pytest.importorskip("PIL.Image")
+
+from fast_preprocess import CLIP_MEAN, CLIP_STD, FastPreprocessor  # noqa: E402
+
+N_PX = 32
+
+
+def clip_preprocess(image, n_px=N_PX):
+    """El preprocess de CLIP (Resize bicúbico del lado corto, CenterCrop, Normalize) con PIL"""
+    width, height = image.size
+    if width <= height:
+        size = (n_px, int(n_px * height / width))
+    else:
+        size = (int(n_px * width / height), n_px)
+    image = image.resize(size, Image.BICUBIC)
+    left = int(round((size[0] - n_px) / 2.0))
+    top = int(round((size[1] - n_px) / 2.0))
+    image = image.crop((left, top, left + n_px, top + n_px))
+    pixels = torch.from_numpy(np.asarray(image, dtype=np.float32) / 255.0).permute(2, 0, 1)
+    return (pixels - torch.tensor(CLIP_MEAN).view(3, 1, 1)) / torch.tensor(CLIP_STD).view(3, 1, 1)
+
+
+def gradient(width, height):
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)
+    pixels = np.stack([np.add.outer(y, x) / 2, np.tile(x, (height, 1)),
+                       np.tile(y[:, None], (1, width))], -1)
+    return Image.fromarray(pixels.astype(np.uint8), 'RGB')
+
+
+@pytest.mark.parametrize("size", [(80, 60), (45, 90), (32, 32)])
+def test_matches_clip_preprocess(size):
+    image = gradient(*size)
+    fast = FastPreprocessor(N_PX)(image)
+
+    assert fast.shape == (3, N_PX, N_PX)
+    assert float((fast - clip_preprocess(image)).abs().mean()) < 0.02
+
+
+def test_batch_groups_sizes_and_keeps_order():
+    images = [gradient(80, 60), gradient(45, 90), gradient(80, 60).transpose(Image.FLIP_LEFT_RIGHT)]
+    preprocessor = FastPreprocessor(N_PX)
+
+    batch = preprocessor.batch(images)
+    assert batch.shape == (3, 3, N_PX, N_PX)
+    for i, image in enumerate(images):
+        torch.testing.assert_close(batch[i], preprocessor(image))
+
+
+def test_jpeg_is_decoded_at_reduced_scale():
+    buffer = io.BytesIO()
+    gradient(400, 300).save(buffer, 'JPEG')
+
+    image = FastPreprocessor(N_PX).decode(buffer.getvalue())
+    assert image.mode == 'RGB'
+    # draft() elige la mayor reducción (1/8) que no baja del lado corto necesario
+    assert image.size == (50, 38)
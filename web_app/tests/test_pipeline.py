@@ -0,0 +1,113 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("PIL")
+
+from pipeline import FishPipeline, RawFrameSizeError, raw_frame_size  # noqa: E402
+
+DIM = 9
+N_PX = 4
+
+
+class FakeVisual:
+    input_resolution = N_PX
+
+
+class FakeModel:
+    """Codificador de imagen que devuelve los embeddings indicados (sin normalizar)"""
+
+    visual = FakeVisual()
+
+    def __init__(self, features=None):
+        self.features = features
+
+    def encode_image(self, image_input):
+        return self.features[:image_input.shape[0]]
+
+
+def basis(*indices):
+    vector = torch.zeros(DIM)
+    for i in indices:
+        vector[i] = 1.0
+    return vector
+
+
+def text_embeddings():
+    # validation: pez / no pez; species: 2 de dorada y 1 de lubina;
+    # dorada y lubina: cultivada / salvaje
+    return {
+        "validation": torch.stack([basis(0), basis(1)]),
+        "species": torch.stack([basis(2), basis(3), basis(4)]),
+        "dorada": torch.stack([basis(5), basis(6)]),
+        "lubina": torch.stack([basis(7), basis(8)])
+    }
+
+
+def make_pipeline(features=None):
+    return FishPipeline(FakeModel(features), None, 'cpu', text_embeddings(), num_dorada_prompts=2)
+
+
+def normalized(vector):
+    return (vector / vector.norm()).unsqueeze(0)
+
+
+def test_score_dorada_salvaje():
+    scores = make_pipeline().score(normalized(basis(0, 2, 6)))[0]
+
+    assert scores["is_fish"]
+    assert scores["fish_confidence"] == pytest.approx(1.0)
+    assert scores["species_id"] == 0
+    assert scores["species_probabilities"]["dorada"] == pytest.approx(1.0, abs=1e-4)
+    assert scores["predicted_class"] == 1
+    assert scores["probabilities"]["salvaje"] == pytest.approx(1.0)
+    assert scores["confidence"] == scores["probabilities"]["salvaje"]
+
+
+def test_score_uses_the_detected_species_prompts():
+    # Prompts de clase de dorada apuntan a cultivada, los de lubina a salvaje
+    scores = make_pipeline().score(normalized(basis(0, 4, 5, 8)))[0]
+
+    assert scores["species_id"] == 1
+    assert scores["predicted_class"] == 1
+    assert scores["species_probabilities"]["lubina"] == pytest.approx(scores["species_confidence"])
+
+
+def test_score_without_fish():
+    scores = make_pipeline().score(normalized(basis(1, 2)))[0]
+
+    assert not scores["is_fish"]
+    assert scores["fish_confidence"] == pytest.approx(0.0, abs=1e-6)
+
+
+def test_score_batch_matches_single_rows():
+    pipeline = make_pipeline()
+    rows = torch.cat([normalized(basis(0, 2, 6)), normalized(basis(1, 4, 7))])
+
+    batch = pipeline.score(rows)
+    assert batch == [pipeline.score(rows[i:i + 1])[0] for i in range(2)]
+
+
+def test_encode_normalizes_features():
+    features = torch.stack([basis(0, 2, 6) * 5, basis(1, 4) * 0.1])
+    encoded = make_pipeline(features).encode(torch.zeros(2, 3, N_PX, N_PX))
+
+    torch.testing.assert_close(encoded.norm(dim=-1), torch.ones(2))
+
+
+def test_predict_raw_frame():
+    pipeline = make_pipeline(normalized(basis(0, 2, 5)))
+    frame = bytes(range(N_PX * N_PX * 3))
+
+    assert raw_frame_size(frame) == N_PX
+    assert pipeline.preprocess_raw(frame).shape == (3, N_PX, N_PX)
+    assert pipeline.predict(frame)["predicted_class"] == 0
+
+
+def test_raw_frame_of_wrong_size_is_rejected():
+    with pytest.raises(RawFrameSizeError):
+        make_pipeline().preprocess_raw(bytes(8 * 8 * 3))
+
+
+def test_image_files_are_not_raw_frames():
+    assert raw_frame_size(b'\xff\xd8' + bytes(46)) is None
+    assert raw_frame_size(bytes(10)) is None
@@ -0,0 +1,108 @@
+import json
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+
+from prompt_sweep import (confusion, find_labelled_images, load_candidates,  # noqa: E402
+                          prompt_indices, report, sweep)
+
+DEFAULTS = {
+    "dorada": ["dorada cultivada", "dorada salvaje"],
+    "lubina": ["lubina cultivada", "lubina salvaje"],
+    "species_dorada": ["dorada"],
+    "species_lubina": ["lubina"]
+}
+
+# Dirección de cada prompt: 0 dorada, 1 lubina, 2 cultivada, 3 salvaje
+DIRECTIONS = {
+    "dorada": 0, "lubina": 1,
+    "dorada cultivada": 2, "lubina cultivada": 2, "cultivada": 2,
+    "dorada salvaje": 3, "lubina salvaje": 3, "salvaje": 3
+}
+
+
+def write_candidates(tmp_path, spec):
+    path = tmp_path / "candidates.json"
+    path.write_text(json.dumps(spec), encoding='utf-8')
+    return str(path)
+
+
+def test_finds_images_by_species_and_class_folders(tmp_path):
+    for relative in ("S_Aurata/test/C/a.jpg", "D_labrax/train/S/b.PNG", "D_labrax/S/notes.txt",
+                     "otros/C/c.jpg"):
+        path = tmp_path / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'')
+
+    items = [(path.replace(str(tmp_path), ''), species, label)
+             for path, species, label in find_labelled_images(str(tmp_path))]
+    assert items == [("/D_labrax/train/S/b.PNG", 1, 1), ("/S_Aurata/test/C/a.jpg", 0, 0)]
+
+
+def test_candidates_from_alternatives_are_cartesian_product(tmp_path):
+    path = write_candidates(tmp_path, {
+        "dorada": [["a", "b"], ["c", "d"]],
+        "species_lubina": [["x"], ["y"], ["z"]]
+    })
+
+    candidates = load_candidates(path, DEFAULTS)
+    assert len(candidates) == 1 + 2 * 3
+    assert candidates[0] == dict(DEFAULTS, name="actual")
+    assert candidates[1]["dorada"] == ["a", "b"] and candidates[1]["species_lubina"] == ["x"]
+    assert candidates[-1]["dorada"] == ["c", "d"] and candidates[-1]["species_lubina"] == ["z"]
+    assert all(c["lubina"] == DEFAULTS["lubina"] for c in candidates)
+
+
+def test_candidates_are_validated(tmp_path):
+    with pytest.raises(ValueError):
+        load_candidates(write_candidates(tmp_path, [{"dorda": ["a", "b"]}]), DEFAULTS)
+    with pytest.raises(ValueError):
+        load_candidates(write_candidates(tmp_path, [{"lubina": ["a", "b", "c"]}]), DEFAULTS)
+
+
+def test_prompt_indices_share_repeated_prompts():
+    candidates = [dict(DEFAULTS), dict(DEFAULTS, species_dorada=["dorada", "sparus aurata"])]
+
+    prompts, class_idx, species_idx, species_group = prompt_indices(candidates)
+    assert len(prompts) == len(set(prompts)) == 7
+    assert class_idx.shape == (2, 2, 2)
+    assert [prompts[i] for i in class_idx[0, 1]] == DEFAULTS["lubina"]
+    # El primer candidato tiene un prompt de especie menos: su última columna es relleno
+    assert species_group.tolist() == [[0, 1, -1], [0, 0, 1]]
+    assert [prompts[i] for i in species_idx[1]] == ["dorada", "sparus aurata", "lubina"]
+
+
+def test_confusion_counts_rows_by_true_label():
+    true = torch.tensor([0, 0, 1, 1, 1])
+    pred = torch.tensor([[0, 1, 1, 1, 0]])
+
+    assert confusion(true, pred).tolist() == [[[1, 1], [1, 2]]]
+
+
+def test_sweep_ranks_candidates_by_accuracy():
+    swapped = dict(DEFAULTS, name="invertido", dorada=["dorada salvaje", "dorada cultivada"])
+    candidates = [dict(DEFAULTS, name="actual"), swapped]
+    prompts, class_idx, species_idx, species_group = prompt_indices(candidates)
+    text_features = torch.eye(4)[[DIRECTIONS[p] for p in prompts]]
+
+    # Una imagen de cada especie y clase
+    species_true = torch.tensor([0, 0, 1, 1])
+    class_true = torch.tensor([0, 1, 0, 1])
+    image_features = torch.nn.functional.normalize(
+        torch.eye(4)[species_true] + torch.eye(4)[class_true + 2], dim=-1)
+
+    result = sweep(image_features, species_true, class_true, text_features,
+                   class_idx, species_idx, species_group)
+    assert result["species_pred"].tolist() == [[0, 0, 1, 1], [0, 0, 1, 1]]
+    assert result["class_pred"].tolist() == [[0, 1, 0, 1], [1, 0, 0, 1]]
+
+    rows = report(candidates, result, species_true, class_true, {0: "dorada", 1: "lubina"},
+                  {0: "cultivada", 1: "salvaje"})
+    assert [row["name"] for row in rows] == ["actual", "invertido"]
+    assert rows[0]["accuracy"] == 1.0
+    assert rows[1]["accuracy"] == 0.5 and rows[1]["species_accuracy"] == 1.0
+    assert rows[1]["per_species"]["dorada"]["class_accuracy"] == 0.0
+    assert rows[1]["per_species"]["lubina"]["recall"] == {"cultivada": 1.0, "salvaje": 1.0}
@@ -0,0 +1,60 @@
+from result_cache import ResultCache, result_version
+
+
+def test_lru_evicts_least_recently_used():
+    cache = ResultCache(max_entries=2, ttl=0)
+    cache.put("a", {"score": 1})
+    cache.put("b", {"score": 2})
+    assert cache.get("a") == {"score": 1}
+    cache.put("c", {"score": 3})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"score": 1}
+    assert cache.get("c") == {"score": 3}
+    assert cache.stats()["evictions"]["capacity"] == 1
+
+
+def test_ttl_expires_entries():
+    cache = ResultCache(max_entries=8, ttl=10)
+    cache.put("a", {"score": 1}, now=100.0)
+
+    assert cache.get("a", now=109.0) == {"score": 1}
+    assert cache.get("a", now=111.0) is None
+    assert len(cache) == 0
+    assert cache.stats()["evictions"]["ttl"] == 1
+
+
+def test_version_change_invalidates():
+    cache = ResultCache(max_entries=8, ttl=0, version=result_version("ViT-B/32", "torch"))
+    cache.put("a", {"score": 1})
+    cache.set_version(result_version("ViT-B/32", "onnx"))
+
+    assert cache.get("a") is None
+    assert cache.stats()["evictions"]["invalidated"] == 1
+
+
+def test_same_version_keeps_entries():
+    version = result_version("ViT-B/32", "torch")
+    cache = ResultCache(max_entries=8, ttl=0, version=version)
+    cache.put("a", {"score": 1})
+    cache.set_version(version)
+
+    assert cache.get("a") == {"score": 1}
+
+
+def test_disabled_cache_stores_nothing():
+    cache = ResultCache(max_entries=0)
+    cache.put("a", {"score": 1})
+
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == cache.stats()["misses"] == 0
+
+
+def test_hit_rate():
+    cache = ResultCache(max_entries=8, ttl=0)
+    cache.put("a", {"score": 1})
+    cache.get("a")
+    cache.get("b")
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
@@ -0,0 +1,82 @@
+import io
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("torch")
+Image = pytest.importorskip("PIL.Image")
+
+from tracking import SessionTracker, smooth_scores  # noqa: E402
+
+
+def scores(fish, dorada, cultivada, species_id=None):
+    species_id = (0 if dorada > 0.5 else 1) if species_id is None else species_id
+    return {
+        "is_fish": fish > 0.5,
+        "fish_confidence": fish,
+        "species_id": species_id,
+        "species_confidence": dorada if species_id == 0 else 1 - dorada,
+        "species_probabilities": {"dorada": dorada, "lubina": 1 - dorada},
+        "predicted_class": 0 if cultivada >= 0.5 else 1,
+        "confidence": cultivada if cultivada >= 0.5 else 1 - cultivada,
+        "probabilities": {"cultivada": cultivada, "salvaje": 1 - cultivada}
+    }
+
+
+def jpeg(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def test_smooth_scores_is_an_ema():
+    smoothed = smooth_scores(scores(0.9, 0.8, 0.6), scores(0.7, 0.6, 0.2), alpha=0.5)
+
+    assert smoothed["fish_confidence"] == pytest.approx(0.8)
+    assert smoothed["species_probabilities"]["dorada"] == pytest.approx(0.7)
+    assert smoothed["probabilities"]["cultivada"] == pytest.approx(0.4)
+    assert smoothed["predicted_class"] == 1
+
+
+def test_smooth_scores_does_not_mix_species():
+    # La especie suavizada es la del frame nuevo: su cultivada/salvaje no se mezcla
+    smoothed = smooth_scores(scores(0.9, 0.6, 0.9), scores(0.9, 0.1, 0.2), alpha=0.5)
+
+    assert smoothed["species_id"] == 1
+    assert smoothed["probabilities"]["cultivada"] == pytest.approx(0.2)
+
+
+def test_unchanged_frame_reuses_verdict():
+    tracker = SessionTracker(max_reuse=2)
+    calls = []
+
+    def classify(image_data):
+        calls.append(image_data)
+        return scores(0.9, 0.8, 0.7)
+
+    frame = jpeg((40, 80, 120))
+    for _ in range(4):
+        tracker.process("s", frame, classify)
+
+    # Un frame clasificado, dos reutilizados y luego se fuerza la cascada
+    assert len(calls) == 2
+    assert tracker.stats()["reused"] == 2
+
+
+def test_scene_change_resets_smoothing():
+    tracker = SessionTracker()
+    tracker.process("s", jpeg((0, 0, 0)), lambda data: scores(0.9, 0.8, 0.7))
+    result = tracker.process("s", jpeg((255, 255, 255)), lambda data: scores(0.6, 0.3, 0.2))
+
+    assert result["fish_confidence"] == pytest.approx(0.6)
+    assert tracker.stats()["reset"] == 2
+
+
+def test_gated_frames_are_not_smoothed():
+    tracker = SessionTracker(reuse_threshold=0)
+    frame = jpeg((40, 80, 120))
+    gated = {"is_fish": False, "fish_confidence": 0.01, "gated": True}
+    tracker.process("s", frame, lambda data: gated)
+    result = tracker.process("s", frame, lambda data: scores(0.9, 0.8, 0.7))
+
+    assert result["fish_confidence"] == pytest.approx(0.9)
@@ -0,0 +1,134 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+from upload_store import UploadStore, list_archive
+from upload_writer import BackgroundWriter
+
+JPEG = b'\xff\xd8\xff\xe0' + b'\x00' * 64
+
+
+def image(seed):
+    data = JPEG + seed.encode()
+    return hashlib.sha256(data).hexdigest(), data
+
+
+class FailingWriter(BackgroundWriter):
+    def _write(self, path, data):
+        raise OSError("disco lleno")
+
+
+def test_repeated_upload_is_stored_once(tmp_path):
+    writer = BackgroundWriter(workers=1)
+    store = UploadStore(str(tmp_path), writer)
+    image_hash, data = image("a")
+
+    filename = store.save(image_hash, data, "pez.jpg", {"species": "Dorada"})
+    writer.flush()
+    assert store.save(image_hash, data, "otra.jpg") == filename == image_hash + ".jpg"
+
+    entry = store.get(image_hash)
+    assert entry["uploads"] == 2
+    assert entry["species"] == "Dorada"
+    assert store.stats()["deduplicated"] == 1
+    assert list_archive(str(tmp_path)) == [store.path_for(filename)]
+
+
+def test_failed_write_leaves_no_index_entry(tmp_path):
+    writer = FailingWriter(workers=1)
+    store = UploadStore(str(tmp_path), writer)
+    image_hash, data = image("a")
+
+    store.save(image_hash, data)
+    writer.flush()
+    assert store.get(image_hash) is None
+    assert list_archive(str(tmp_path)) == []
+
+    # La siguiente subida vuelve a escribir la imagen en lugar de deduplicarla
+    store.writer = BackgroundWriter(workers=1)
+    filename = store.save(image_hash, data)
+    store.writer.flush()
+    assert os.path.isfile(store.path_for(filename))
+    assert store.get(image_hash)["uploads"] == 1
+    assert store.stats()["deduplicated"] == 0
+
+
+def test_missing_file_is_rewritten_and_skipped_by_list_archive(tmp_path):
+    writer = BackgroundWriter(workers=1)
+    store = UploadStore(str(tmp_path), writer)
+    image_hash, data = image("a")
+    filename = store.save(image_hash, data)
+    writer.flush()
+
+    os.remove(store.path_for(filename))
+    assert list_archive(str(tmp_path)) == []
+
+    store.save(image_hash, data)
+    writer.flush()
+    assert list_archive(str(tmp_path)) == [store.path_for(filename)]
+
+
+def test_save_waits_for_eviction_and_rewrites_the_image(tmp_path):
+    writer = BackgroundWriter(workers=1)
+    store = UploadStore(str(tmp_path), writer)
+    image_hash, data = image("a")
+    filename = store.save(image_hash, data)
+    writer.flush()
+
+    # Una pasada de retención en curso en otra conexión (otro proceso)
+    evictor = sqlite3.connect(store.index_path, isolation_level=None)
+    evictor.execute('BEGIN IMMEDIATE')
+    evictor.execute('DELETE FROM uploads WHERE hash = ?', (image_hash,))
+    os.remove(store.path_for(filename))
+
+    saved = []
+    thread = threading.Thread(target=lambda: saved.append(store.save(image_hash, data)))
+    thread.start()
+    thread.join(0.2)
+    assert thread.is_alive()
+
+    evictor.execute('COMMIT')
+    evictor.close()
+    thread.join()
+    writer.flush()
+    assert saved == [filename]
+    assert os.path.isfile(store.path_for(filename))
+    assert store.get(image_hash)["uploads"] == 1
+    assert store.stats()["deduplicated"] == 0
+
+
+def test_retention_by_age_deletes_files_and_notifies(tmp_path):
+    writer = BackgroundWriter(workers=1)
+    evicted = []
+    store = UploadStore(str(tmp_path), writer, on_evict=evicted.extend)
+    hashes = []
+    for seed in "ab":
+        image_hash, data = image(seed)
+        store.save(image_hash, data)
+        hashes.append(image_hash)
+    writer.flush()
+    store.max_age = 86400.0
+
+    files, freed = store.evict(now=store.get(hashes[0])["last_seen"] + 2 * 86400)
+    assert files == 2
+    assert freed == 2 * len(image("a")[1])
+    assert sorted(evicted) == sorted(hashes)
+    assert list_archive(str(tmp_path)) == []
+
+
+def test_retention_by_size_keeps_most_recent(tmp_path):
+    writer = BackgroundWriter(workers=1)
+    store = UploadStore(str(tmp_path), writer)
+    hashes = []
+    for seed in "abc":
+        image_hash, data = image(seed)
+        store.save(image_hash, data)
+        writer.flush()
+        hashes.append(image_hash)
+    size = len(image("a")[1])
+    store.max_bytes = 2 * size
+
+    assert store.evict() == (1, size)
+    assert store.get(hashes[0]) is None
+    assert store.get(hashes[1]) is not None and store.get(hashes[2]) is not None
@@ -0,0 +1,90 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+
+from video import aggregate, sample_frames  # noqa: E402
+
+
+def frame_scores(is_fish=True, dorada=0.8, cultivada=0.7, fish_confidence=0.9):
+    return {
+        "is_fish": is_fish,
+        "fish_confidence": fish_confidence,
+        "species_id": 0 if dorada > 0.5 else 1,
+        "species_probabilities": {"dorada": dorada, "lubina": 1 - dorada},
+        "probabilities": {"cultivada": cultivada, "salvaje": 1 - cultivada}
+    }
+
+
+def test_aggregate_without_fish_is_none():
+    assert aggregate([]) is None
+    assert aggregate([frame_scores(is_fish=False, fish_confidence=0.1)]) is None
+
+
+def test_aggregate_averages_fish_frames():
+    frames = [
+        frame_scores(dorada=0.9, cultivada=0.8),
+        frame_scores(dorada=0.7, cultivada=0.6),
+        # Sin pez: no cuenta
+        frame_scores(is_fish=False, dorada=0.0, cultivada=0.0, fish_confidence=0.1),
+        # Lubina en un clip de dorada: cuenta para la especie, no para la clase
+        frame_scores(dorada=0.4, cultivada=0.0)
+    ]
+
+    verdict = aggregate(frames)
+    assert verdict["fish_frames"] == 3
+    assert verdict["species_id"] == 0
+    assert verdict["species_confidence"] == pytest.approx(2.0 / 3)
+    assert verdict["predicted_class"] == 0
+    assert verdict["probabilities"]["cultivada"] == pytest.approx(0.7)
+    assert verdict["fish_confidence"] == pytest.approx(0.9)
+
+
+def test_aggregate_predicts_salvaje_below_half():
+    verdict = aggregate([frame_scores(dorada=0.2, cultivada=0.3)])
+
+    assert verdict["species_id"] == 1
+    assert verdict["predicted_class"] == 1
+    assert verdict["confidence"] == pytest.approx(0.7)
+
+
+def write_clip(path, colors, rate=10, side=64):
+    """Clip MPEG-4 con un frame liso de cada color"""
+    av = pytest.importorskip("av")
+    with av.open(str(path), mode='w') as container:
+        stream = container.add_stream('mpeg4', rate=rate)
+        stream.width = stream.height = side
+        stream.pix_fmt = 'yuv420p'
+        for color in colors:
+            pixels = np.zeros((side, side, 3), dtype=np.uint8)
+            pixels[:side // 2] = color
+            frame = av.VideoFrame.from_ndarray(pixels, format='rgb24')
+            container.mux(stream.encode(frame))
+        container.mux(stream.encode())
+
+
+def test_sample_frames_by_rate(tmp_path):
+    path = tmp_path / "clip.mp4"
+    write_clip(path, [(200, 50, 50)] * 20)
+
+    frames = list(sample_frames(str(path), n_px=16, fps=2.0))
+    assert [round(time, 1) for time, _ in frames] == [0.0, 0.5, 1.0, 1.5]
+    assert all(image.size == (16, 16) for _, image in frames)
+
+
+def test_sample_frames_by_scene_change(tmp_path):
+    path = tmp_path / "clip.mp4"
+    write_clip(path, [(255, 255, 255)] * 5 + [(0, 0, 0)] * 5)
+
+    frames = list(sample_frames(str(path), n_px=16, scene_threshold=0.1))
+    assert len(frames) == 2
+    assert round(frames[1][0], 1) == 0.5
+
+
+def test_sample_frames_rejects_invalid_video(tmp_path):
+    pytest.importorskip("av")
+    path = tmp_path / "clip.mp4"
+    path.write_bytes(b'no es un video')
+
+    with pytest.raises(ValueError):
+        list(sample_frames(str(path), n_px=16))
@@ -0,0 +1,168 @@
+"""
+Seguimiento temporal por sesión para el modo en tiempo real.
+
+En vídeo la mayoría de frames consecutivos muestran el mismo pez. Para cada
+frame se calcula una firma perceptual barata (miniatura en escala de grises
+obtenida con decodificación JPEG reducida) y se compara con la del último
+frame clasificado de la sesión:
+
+- Si apenas cambia, se reutiliza el veredicto anterior sin decodificar la
+  imagen completa ni ejecutar el modelo.
+- Si cambia algo, se ejecuta la cascada completa y el resultado se suaviza
+  con una media móvil exponencial (EMA) para estabilizar el overlay.
+- Si cambia mucho (otra escena u otro pez), se ejecuta la cascada y se
+  reinicia el suavizado.
+"""
+
+import io
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from pipeline import FISH_THRESHOLD, raw_frame_size
+
+SIGNATURE_SIZE = 16
+
+
+def image_signature(image, size=SIGNATURE_SIZE):
+    """Miniatura en gris [size*size] con valores en [0, 1] de una imagen PIL"""
+    thumb = image.convert('L').resize((size, size), Image.BILINEAR)
+    return np.asarray(thumb, dtype=np.float32).ravel() / 255.0
+
+
+def frame_signature(image_data, size=SIGNATURE_SIZE):
+    """Firma (ver image_signature) de un frame codificado o en crudo"""
+    side = raw_frame_size(image_data)
+    if side is not None:
+        image = Image.frombuffer('RGB', (side, side), bytes(image_data), 'raw', 'RGB', 0, 1)
+    else:
+        image = Image.open(io.BytesIO(image_data))
+        # En JPEG, draft() decodifica directamente a una escala reducida (1/2 a 1/8)
+        image.draft('L', (size * 4, size * 4))
+    return image_signature(image, size)
+
+
+def signature_distance(a, b):
+    """Diferencia media absoluta entre dos firmas (0 = idénticas)"""
+    return float(np.mean(np.abs(a - b)))
+
+
+def smooth_scores(previous, current, alpha):
+    """
+    Mezcla con EMA los resultados de dos frames y recalcula las decisiones.
+
+    La probabilidad cultivada/salvaje sólo se suaviza si la especie coincide,
+    ya que cada especie usa prompts distintos.
+    """
+    fish_confidence = alpha * current["fish_confidence"] + (1 - alpha) * previous["fish_confidence"]
+    dorada = (alpha * current["species_probabilities"]["dorada"]
+              + (1 - alpha) * previous["species_probabilities"]["dorada"])
+    species_id = 0 if dorada > 0.5 else 1
+    species_confidence = dorada if species_id == 0 else 1 - dorada
+
+    if species_id == previous["species_id"] == current["species_id"]:
+        cultivada = (alpha * current["probabilities"]["cultivada"]
+                     + (1 - alpha) * previous["probabilities"]["cultivada"])
+    elif species_id == current["species_id"]:
+        cultivada = current["probabilities"]["cultivada"]
+    else:
+        cultivada = previous["probabilities"]["cultivada"]
+    predicted_class = 0 if cultivada >= 0.5 else 1
+
+    return {
+        "is_fish": fish_confidence > FISH_THRESHOLD,
+        "fish_confidence": fish_confidence,
+        "species_id": species_id,
+        "species_confidence": species_confidence,
+        "species_probabilities": {"dorada": dorada, "lubina": 1 - dorada},
+        "predicted_class": predicted_class,
+        "confidence": cultivada if predicted_class == 0 else 1 - cultivada,
+        "probabilities": {"cultivada": cultivada, "salvaje": 1 - cultivada}
+    }
+
+
+class SessionTracker:
+    """Estado por sesión: firma del último frame clasificado y veredicto suavizado"""
+
+    def __init__(self, reuse_threshold=0.03, reset_threshold=0.15, ema_alpha=0.5,
+                 max_reuse=10, session_ttl=60.0):
+        """
+        Args:
+            reuse_threshold: Distancia de firma por debajo de la cual se reutiliza el veredicto
+            reset_threshold: Distancia a partir de la cual se reinicia el suavizado
+            ema_alpha: Peso del frame nuevo en la EMA
+            max_reuse: Frames seguidos reutilizados antes de forzar la cascada completa
+            session_ttl: Segundos de inactividad tras los que se olvida una sesión
+        """
+        self.reuse_threshold = reuse_threshold
+        self.reset_threshold = reset_threshold
+        self.ema_alpha = ema_alpha
+        self.max_reuse = max_reuse
+        self.session_ttl = session_ttl
+
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._last_sweep = time.monotonic()
+        self._counters = {"frames": 0, "reused": 0, "smoothed": 0, "reset": 0}
+
+    def process(self, session_id, image_data, classify):
+        """
+        Devuelve el veredicto de un frame, ejecutando classify(image_data)
+        sólo cuando la escena ha cambiado.
+        """
+        signature = frame_signature(image_data)
+        now = time.monotonic()
+
+        with self._lock:
+            self._sweep(now)
+            self._counters["frames"] += 1
+            state = self._sessions.get(session_id)
+            if state is not None:
+                state["last_seen"] = now
+                distance = signature_distance(signature, state["signature"])
+                if distance < self.reuse_threshold and state["reused"] < self.max_reuse:
+                    state["reused"] += 1
+                    self._counters["reused"] += 1
+                    return state["scores"]
+
+        scores = classify(image_data)
+
+        with self._lock:
+            state = self._sessions.get(session_id)
+            # Los frames rechazados por el primer nivel de la cascada (gated) no
+            # tienen puntuaciones de especie con las que suavizar
+            if (state is not None and not scores.get("gated") and not state["scores"].get("gated")
+                    and signature_distance(signature, state["signature"]) < self.reset_threshold):
+                scores = smooth_scores(state["scores"], scores, self.ema_alpha)
+                self._counters["smoothed"] += 1
+            else:
+                self._counters["reset"] += 1
+            self._sessions[session_id] = {
+                "signature": signature,
+                "scores": scores,
+                "reused": 0,
+                "last_seen": now
+            }
+        return scores
+
+    def end(self, session_id):
+        """Olvida una sesión (p. ej. al cerrarse su WebSocket)"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _sweep(self, now):
+        if now - self._last_sweep < self.session_ttl:
+            return
+        self._last_sweep = now
+        expired = [sid for sid, state in self._sessions.items()
+                   if now - state["last_seen"] > self.session_ttl]
+        for sid in expired:
+            del self._sessions[sid]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["sessions"] = len(self._sessions)
+            return stats
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Almacén de imágenes subidas direccionado por contenido.
+
+Cada imagen se guarda una sola vez con el SHA-256 de su contenido como nombre,
+repartida en subdirectorios por los primeros caracteres del hash:
+
+    uploads/ab/cd/abcd1234...ef.jpg
+
+Un índice SQLite (uploads/index.sqlite) guarda por imagen el tamaño, la
+primera y la última vez que se subió, el número de subidas y la última
+predicción. Listar o reprocesar el archivo se hace consultando el índice, sin
+recorrer el directorio.
+
+La retención por antigüedad (última subida) y por tamaño total se aplica en un
+hilo en segundo plano, que borra primero las imágenes subidas hace más tiempo.
+
+Las imágenes del formato antiguo (archivos sueltos en uploads/) se pueden
+importar al almacén:
+
+    python upload_store.py ../uploads --migrate
+    python upload_store.py ../uploads --evict
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from observability import log_event
+
+INDEX_NAME = 'index.sqlite'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+HASH_FILENAME = re.compile(r'^([0-9a-f]{64})(\.[a-z0-9]+)$')
+
+# Cabecera -> extensión
+SIGNATURES = (
+    (b'\xff\xd8', '.jpg'),
+    (b'\x89PNG', '.png'),
+    (b'BM', '.bmp'),
+    (b'GIF8', '.gif'),
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    hash TEXT PRIMARY KEY,
+    ext TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    uploads INTEGER NOT NULL DEFAULT 1,
+    original_name TEXT,
+    is_fish INTEGER,
+    species TEXT,
+    classification TEXT,
+    confidence REAL,
+    fish_confidence REAL
+);
+CREATE INDEX IF NOT EXISTS uploads_last_seen ON uploads (last_seen);
+"""
+
+
+def sniff_extension(image_data, original_name=None):
+    """Extensión según la cabecera del archivo (o el nombre original si no se reconoce)"""
+    for signature, ext in SIGNATURES:
+        if image_data.startswith(signature):
+            return ext
+    if image_data[:4] == b'RIFF' and image_data[8:12] == b'WEBP':
+        return '.webp'
+    ext = os.path.splitext(original_name or '')[1].lower()
+    return ext if re.fullmatch(r'\.[a-z0-9]{1,5}', ext) else '.bin'
+
+
+class UploadStore:
+    """Imágenes subidas por hash de contenido, con índice SQLite y retención"""
+
+    def __init__(self, root, writer=None, max_age_days=0, max_bytes=0, evict_interval=300, on_evict=None):
+        """
+        Args:
+            root: Directorio del almacén
+            writer: BackgroundWriter para las escrituras (None = sólo lectura)
+            max_age_days: Borrar imágenes no subidas en ese tiempo (0 = sin límite)
+            max_bytes: Tamaño total máximo (0 = sin límite)
+            evict_interval: Segundos entre pasadas de retención
+            on_evict: Función opcional on_evict(hashes) que se llama con los
+                hashes de las imágenes que borra la retención
+        """
+        self.root = root
+        self.writer = writer
+        self.on_evict = on_evict
+        self.max_age = max_age_days * 86400.0
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+        self.index_path = os.path.join(root, INDEX_NAME)
+        os.makedirs(root, exist_ok=True)
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._evictor_pid = None
+        self._evicted_files = 0
+        self._evicted_bytes = 0
+        self._deduplicated = 0
+
+        with self._db() as db:
+            db.executescript(SCHEMA)
+
+    def _db(self):
+        # Una conexión por hilo y proceso (las conexiones no sobreviven a un fork)
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            db = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.row_factory = sqlite3.Row
+            self._local.db = db
+            self._local.pid = pid
+        return self._local.db
+
+    @contextmanager
+    def _transaction(self):
+        """Transacción que toma el bloqueo de escritura del índice desde el principio"""
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    @staticmethod
+    def relative_path(filename):
+        """Ruta dentro del almacén de un nombre '<hash><ext>'"""
+        return os.path.join(filename[:2], filename[2:4], filename)
+
+    def path_for(self, filename):
+        """Ruta absoluta de una imagen del almacén, o None si el nombre no es de este formato"""
+        if not HASH_FILENAME.match(filename):
+            return None
+        return os.path.join(self.root, self.relative_path(filename))
+
+    def save(self, image_hash, image_data, original_name=None, prediction=None):
+        """
+        Guarda una imagen (si no estaba ya) y actualiza su entrada del índice.
+
+        Args:
+            prediction: dict opcional con is_fish, species, classification,
+                confidence y fish_confidence
+
+        Returns:
+            str: Nombre '<hash><ext>', o None si la escritura se descartó
+        """
+        self._ensure_evictor()
+        prediction = prediction or {}
+        now = time.time()
+
+        # La comprobación y la nueva subida van en una transacción, igual que la
+        # retención: el evictor no puede borrar la imagen entre una y otra
+        with self._transaction() as db:
+            row = db.execute('SELECT ext FROM uploads WHERE hash = ?', (image_hash,)).fetchone()
+            if row is not None:
+                filename = image_hash + row['ext']
+                path = os.path.join(self.root, self.relative_path(filename))
+                exists = os.path.exists(path)
+                if exists:
+                    # Ya está en el almacén: sólo se anota la nueva subida
+                    self._record(image_hash, filename, len(image_data), now, original_name,
+                                 prediction)
+            else:
+                filename = image_hash + sniff_extension(image_data, original_name)
+                path = os.path.join(self.root, self.relative_path(filename))
+                exists = False
+
+        if exists:
+            with self._lock:
+                self._deduplicated += 1
+            return filename
+
+        # La entrada del índice se crea cuando la imagen ya está en disco: si la
+        # escritura falla no queda una entrada que apunte a un archivo inexistente
+        def on_done(ok):
+            if ok:
+                self._record(image_hash, filename, len(image_data), now, original_name, prediction)
+
+        if not self.writer.submit(path, image_data, on_done):
+            return None
+        return filename
+
+    def _record(self, image_hash, filename, size, now, original_name, prediction):
+        """Inserta la entrada de una imagen o anota una nueva subida con su predicción"""
+        self._db().execute(
+            """
+            INSERT INTO uploads (hash, ext, size, first_seen, last_seen, original_name,
+                                 is_fish, species, classification, confidence, fish_confidence)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (hash) DO UPDATE SET
+                last_seen = excluded.last_seen,
+                uploads = uploads + 1,
+                is_fish = COALESCE(excluded.is_fish, is_fish),
+                species = COALESCE(excluded.species, species),
+                classification = COALESCE(excluded.classification, classification),
+                confidence = COALESCE(excluded.confidence, confidence),
+                fish_confidence = COALESCE(excluded.fish_confidence, fish_confidence)
+            """,
+            (image_hash, filename[len(image_hash):], size, now, now, original_name,
+             prediction.get('is_fish'), prediction.get('species'), prediction.get('classification'),
+             prediction.get('confidence'), prediction.get('fish_confidence'))
+        )
+
+    def get(self, image_hash):
+        """Entrada del índice de una imagen (dict) o None"""
+        row = self._db().execute('SELECT * FROM uploads WHERE hash = ?', (image_hash,)).fetchone()
+        return self._entry(row) if row is not None else None
+
+    def _entry(self, row):
+        entry = dict(row)
+        entry["filename"] = entry["hash"] + entry["ext"]
+        return entry
+
+    def entries(self, since=None, limit=None, offset=0):
+        """Entradas del índice por orden de primera subida"""
+        query = 'SELECT * FROM uploads'
+        params = []
+        if since is not None:
+            query += ' WHERE first_seen >= ?'
+            params.append(since)
+        query += ' ORDER BY first_seen, hash LIMIT ? OFFSET ?'
+        params += [limit if limit is not None else -1, offset]
+        return [self._entry(row) for row in self._db().execute(query, params)]
+
+    def paths(self):
+        """Rutas de todas las imágenes del almacén, sin recorrer el directorio"""
+        rows = self._db().execute('SELECT hash, ext FROM uploads ORDER BY first_seen, hash')
+        return [os.path.join(self.root, self.relative_path(row['hash'] + row['ext'])) for row in rows]
+
+    def _ensure_evictor(self):
+        # El hilo de retención se arranca bajo demanda, uno por proceso
+        if (not self.max_age and not self.max_bytes) or self._evictor_pid == os.getpid():
+            return
+        with self._lock:
+            if self._evictor_pid == os.getpid():
+                return
+            self._evictor_pid = os.getpid()
+            threading.Thread(target=self._evict_loop, name="upload-evictor", daemon=True).start()
+
+    def _evict_loop(self):
+        while True:
+            try:
+                self.evict()
+            except Exception as e:
+                log_event("upload_evict_error", sampled=False, error=str(e))
+            time.sleep(self.evict_interval)
+
+    def evict(self, now=None):
+        """
+        Aplica la retención por antigüedad y por tamaño total.
+
+        Returns:
+            tuple: (imágenes borradas, bytes liberados)
+        """
+        now = now if now is not None else time.time()
+        victims = []
+        freed = 0
+        # Selección y borrado en una sola transacción (ver save)
+        with self._transaction() as db:
+            if self.max_age:
+                victims += db.execute('SELECT hash, ext, size FROM uploads WHERE last_seen < ?',
+                                      (now - self.max_age,)).fetchall()
+            if self.max_bytes:
+                total = db.execute('SELECT COALESCE(SUM(size), 0) FROM uploads').fetchone()[0]
+                total -= sum(row['size'] for row in victims)
+                if total > self.max_bytes:
+                    seen = {row['hash'] for row in victims}
+                    for row in db.execute('SELECT hash, ext, size FROM uploads ORDER BY last_seen'):
+                        if total <= self.max_bytes:
+                            break
+                        if row['hash'] in seen:
+                            continue
+                        victims.append(row)
+                        total -= row['size']
+
+            for row in victims:
+                try:
+                    os.remove(os.path.join(self.root, self.relative_path(row['hash'] + row['ext'])))
+                except FileNotFoundError:
+                    pass
+                db.execute('DELETE FROM uploads WHERE hash = ?', (row['hash'],))
+                freed += row['size']
+
+        with self._lock:
+            self._evicted_files += len(victims)
+            self._evicted_bytes += freed
+        if victims:
+            log_event("upload_evict", sampled=False, files=len(victims), bytes=freed)
+            if self.on_evict is not None:
+                self.on_evict([row['hash'] for row in victims])
+        return len(victims), freed
+
+    def migrate(self, directory):
+        """
+        Importa al almacén las imágenes sueltas de un directorio (formato antiguo).
+
+        Los archivos se mueven a su ruta por hash; los duplicados se borran.
+
+        Returns:
+            tuple: (imágenes importadas, duplicados)
+        """
+        imported = duplicates = 0
+        db = self._db()
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if not os.path.isfile(path) or not name.lower().endswith(IMAGE_EXTENSIONS) or HASH_FILENAME.match(name):
+                continue
+            with open(path, 'rb') as f:
+                image_data = f.read()
+            image_hash = hashlib.sha256(image_data).hexdigest()
+            mtime = os.path.getmtime(path)
+            if db.execute('SELECT 1 FROM uploads WHERE hash = ?', (image_hash,)).fetchone():
+                os.remove(path)
+                duplicates += 1
+                continue
+            filename = image_hash + sniff_extension(image_data, name)
+            target = os.path.join(self.root, self.relative_path(filename))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(path, target)
+            db.execute(
+                'INSERT INTO uploads (hash, ext, size, first_seen, last_seen, original_name) VALUES (?, ?, ?, ?, ?, ?)',
+                (image_hash, filename[len(image_hash):], len(image_data), mtime, mtime, name)
+            )
+            imported += 1
+        return imported, duplicates
+
+    def stats(self):
+        count, total = self._db().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM uploads').fetchone()
+        with self._lock:
+            return {
+                "images": count,
+                "bytes": total,
+                "max_age_days": self.max_age / 86400.0,
+                "max_bytes": self.max_bytes,
+                "deduplicated": self._deduplicated,
+                "evicted_files": self._evicted_files,
+                "evicted_bytes": self._evicted_bytes
+            }
+
+
+def list_archive(directory):
+    """
+    Imágenes de un directorio de subidas: archivos sueltos más las del almacén
+    (por el índice), omitiendo las entradas cuyo archivo ya no existe.
+    """
+    paths = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(os.path.join(directory, name))
+    )
+    if os.path.exists(os.path.join(directory, INDEX_NAME)):
+        paths += [path for path in UploadStore(directory).paths() if os.path.isfile(path)]
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mantenimiento del almacén de imágenes subidas")
+    parser.add_argument("directory", help="Directorio del almacén (uploads)")
+    parser.add_argument("--migrate", action="store_true", help="Importar las imágenes sueltas del formato antiguo")
+    parser.add_argument("--evict", action="store_true", help="Aplicar ahora la retención configurada")
+    parser.add_argument("--max-age-days", type=float, default=float(os.environ.get('UPLOAD_MAX_AGE_DAYS', '0')))
+    parser.add_argument("--max-mb", type=float, default=float(os.environ.get('UPLOAD_MAX_MB', '0')))
+    args = parser.parse_args()
+
+    store = UploadStore(args.directory, max_age_days=args.max_age_days, max_bytes=int(args.max_mb * 1024 * 1024))
+    if args.migrate:
+        imported, duplicates = store.migrate(args.directory)
+        print(f"Importadas: {imported}, duplicadas eliminadas: {duplicates}")
+    if args.evict:
+        files, freed = store.evict()
+        print(f"Borradas: {files} imágenes ({freed / 1024 / 1024:.1f} MB)")
+    stats = store.stats()
+    print(f"Almacén: {stats['images']} imágenes, {stats['bytes'] / 1024 / 1024:.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
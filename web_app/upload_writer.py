@@ -0,0 +1,147 @@
+"""
+Escritura de imágenes subidas en segundo plano.
+
+La inferencia trabaja con los bytes en memoria; guardar la imagen en disco se
+delega a un pool acotado de hilos para que la latencia del disco no se sume
+al tiempo de respuesta. Cuando la cola está llena se aplica una política:
+
+- 'block': la petición espera a que haya hueco (nunca se pierde una imagen)
+- 'drop': la imagen no se guarda y se cuenta como descartada
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+
+from observability import UPLOAD_WRITE_LATENCY, log_event
+
+
+class BackgroundWriter:
+    """Pool acotado de hilos que escribe archivos de forma atómica"""
+
+    def __init__(self, workers=2, max_pending=64, policy='block', fsync=False):
+        if policy not in ('block', 'drop'):
+            raise ValueError(f"Política de escritura no válida: {policy}")
+        self.workers = workers
+        self.max_pending = max_pending
+        self.policy = policy
+        self.fsync = fsync
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._queue = queue.Queue()
+        self._threads = []
+        self._pid = None
+
+        self._pending = 0
+        self._written = 0
+        self._failed = 0
+        self._dropped = 0
+        self._bytes = 0
+        self._write_time = 0.0
+
+    def _ensure_workers(self):
+        # Los hilos se arrancan bajo demanda y se vuelven a crear tras un fork
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._queue = queue.Queue()
+            self._slots = threading.BoundedSemaphore(self.max_pending)
+            self._pending = 0
+            self._threads = [
+                threading.Thread(target=self._run, name=f"upload-writer-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def submit(self, path, data, on_done=None):
+        """
+        Encola la escritura de data en path.
+
+        Args:
+            on_done: Función opcional on_done(ok) que se llama desde el hilo
+                escritor cuando la escritura termina (ok=False si falló)
+
+        Returns:
+            bool: False si la escritura se descartó por estar la cola llena
+        """
+        self._ensure_workers()
+        if not self._slots.acquire(blocking=self.policy == 'block'):
+            with self._lock:
+                self._dropped += 1
+            return False
+        with self._lock:
+            self._pending += 1
+        self._queue.put((path, data, on_done))
+        return True
+
+    def _run(self):
+        while True:
+            path, data, on_done = self._queue.get()
+            start = time.perf_counter()
+            try:
+                self._write(path, data)
+                ok = True
+            except Exception as e:
+                log_event("upload_write_error", sampled=False, level=logging.ERROR, path=path, error=str(e))
+                ok = False
+            elapsed = time.perf_counter() - start
+            if ok:
+                UPLOAD_WRITE_LATENCY.observe(elapsed)
+
+            with self._lock:
+                self._pending -= 1
+                if ok:
+                    self._written += 1
+                    self._bytes += len(data)
+                    self._write_time += elapsed
+                else:
+                    self._failed += 1
+            if on_done is not None:
+                try:
+                    on_done(ok)
+                except Exception as e:
+                    log_event("upload_write_callback_error", sampled=False, level=logging.ERROR,
+                              path=path, error=str(e))
+            self._slots.release()
+            self._queue.task_done()
+
+    def _write(self, path, data):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Escribir en un temporal y renombrar: el archivo aparece completo o no aparece
+        # Temporal único: otro hilo o worker puede estar escribiendo la misma imagen
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def flush(self):
+        """Espera a que terminen todas las escrituras pendientes"""
+        if self._pid == os.getpid():
+            self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "policy": self.policy,
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "written": self._written,
+                "failed": self._failed,
+                "dropped": self._dropped,
+                "bytes_written": self._bytes,
+                "avg_write_ms": 1000.0 * self._write_time / self._written if self._written else 0.0
+            }
@@ -0,0 +1,119 @@
+"""
+Clasificación de clips de vídeo.
+
+El vídeo se decodifica como un stream con PyAV: los frames se generan de uno
+en uno y sólo se conservan los muestreados hasta completar un batch, así que
+un clip de varios segundos no se carga entero en memoria. El muestreo puede
+ser por ritmo (N frames por segundo de vídeo) o por cambio de escena (un
+frame nuevo cuando su firma perceptual se aleja lo suficiente de la del último
+muestreado, con la misma firma y distancia que tracking.py). Los frames
+muestreados se reducen ya en el decodificador a un lado corto de n_px, el
+tamaño de entrada del modelo.
+
+El veredicto del clip agrega los frames con pez: la especie por la media de
+sus probabilidades y cultivada/salvaje por la media de los frames de esa
+especie, igual que el suavizado del modo en tiempo real.
+"""
+
+import numpy as np
+
+from pipeline import FISH_THRESHOLD
+from tracking import image_signature, signature_distance
+
+try:
+    import av
+except ImportError:
+    av = None
+
+# PyAV es opcional: sin él /predict_video responde 501
+VIDEO_SUPPORTED = av is not None
+
+
+def sample_frames(source, n_px, fps=2.0, scene_threshold=None, max_frames=120):
+    """
+    Genera (tiempo en segundos, imagen PIL RGB) de los frames muestreados.
+
+    Args:
+        source: Ruta o archivo abierto con el vídeo
+        n_px: Lado corto al que se reducen los frames (entrada del modelo)
+        fps: Frames por segundo de vídeo a muestrear (modo por ritmo)
+        scene_threshold: Si se indica, se muestrea por cambio de escena con
+            esta distancia mínima de firma entre frames muestreados
+        max_frames: Máximo de frames muestreados
+    """
+    if av is None:
+        raise RuntimeError("La clasificación de vídeo necesita PyAV: pip install av")
+
+    try:
+        container = av.open(source)
+    except Exception as e:
+        raise ValueError(f"No se pudo abrir el vídeo: {e}") from e
+
+    with container:
+        if not container.streams.video:
+            raise ValueError("El archivo no contiene una pista de vídeo")
+        stream = container.streams.video[0]
+        # Decodificación multihilo de FFmpeg
+        stream.thread_type = 'AUTO'
+        rate = float(stream.average_rate) if stream.average_rate else 25.0
+
+        sampled = 0
+        next_time = 0.0
+        last_signature = None
+        for index, frame in enumerate(container.decode(stream)):
+            frame_time = frame.time if frame.time is not None else index / rate
+            if scene_threshold is None and frame_time + 1e-6 < next_time:
+                continue
+
+            scale = n_px / min(frame.width, frame.height)
+            image = frame.to_image(width=max(n_px, round(frame.width * scale)),
+                                   height=max(n_px, round(frame.height * scale)))
+
+            if scene_threshold is not None:
+                signature = image_signature(image)
+                if (last_signature is not None
+                        and signature_distance(signature, last_signature) < scene_threshold):
+                    continue
+                last_signature = signature
+            else:
+                next_time = frame_time + 1.0 / fps
+
+            yield frame_time, image
+            sampled += 1
+            if sampled >= max_frames:
+                return
+
+
+def aggregate(frames):
+    """
+    Veredicto del clip a partir de las puntuaciones de sus frames.
+
+    Args:
+        frames: list de dicts de FishPipeline.score
+
+    Returns:
+        dict con el mismo esquema que FishPipeline.score más fish_frames,
+        o None si ningún frame tiene pez
+    """
+    fish = [scores for scores in frames if scores["is_fish"]]
+    if not fish:
+        return None
+
+    dorada = float(np.mean([scores["species_probabilities"]["dorada"] for scores in fish]))
+    species_id = 0 if dorada > 0.5 else 1
+    same_species = [scores for scores in fish if scores["species_id"] == species_id] or fish
+    cultivada = float(np.mean([scores["probabilities"]["cultivada"] for scores in same_species]))
+    predicted_class = 0 if cultivada >= 0.5 else 1
+    fish_confidence = float(np.mean([scores["fish_confidence"] for scores in fish]))
+
+    return {
+        "is_fish": fish_confidence > FISH_THRESHOLD,
+        "fish_confidence": fish_confidence,
+        "species_id": species_id,
+        "species_confidence": dorada if species_id == 0 else 1 - dorada,
+        "species_probabilities": {"dorada": dorada, "lubina": 1 - dorada},
+        "predicted_class": predicted_class,
+        "confidence": cultivada if predicted_class == 0 else 1 - cultivada,
+        "probabilities": {"cultivada": cultivada, "salvaje": 1 - cultivada},
+        "fish_frames": len(fish)
+    }